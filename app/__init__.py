@@ -14,11 +14,21 @@ def create_app(config_object='app.config.DevelopmentConfig'):
     from app.models.database import init_db
     init_db(app)
     
+    # Pool delle importazioni in background
+    from app.services.job_runner import init_job_runner
+    init_job_runner(app)
+    
+    # Cache dei risultati delle query sul catalogo
+    from app.services.query_cache import init_query_cache
+    init_query_cache(app)
+    
     # Registrazione dei blueprint
     from app.routes.main import main_bp
     from app.routes.api import api_bp
+    from app.routes.metrics import metrics_bp
     
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
+    app.register_blueprint(metrics_bp)
     
     return app
@@ -17,8 +17,36 @@ class Config:
     # Configurazioni Flask
     JSON_AS_ASCII = False
     
+    # Configurazioni database
+    SQLALCHEMY_ECHO = False  # Logging di tutte le istruzioni SQL
+    # PRAGMA applicati a ogni nuova connessione SQLite
+    SQLITE_PRAGMAS = {
+        'busy_timeout': 5000,  # ms di attesa su un lock prima di fallire
+    }
+    # Pool di connessioni (per processo: con gunicorn ogni worker ha il proprio)
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    DATABASE_POOL_TIMEOUT = 30
+    
     # Configurazioni Feed
-    DEFAULT_FEED_URL = os.environ.get('DEFAULT_FEED_URL', 'http://example.com/feed.json')
+    DEFAULT_FEED_URL = os.environ.get(
+        'DEFAULT_FEED_URL', 'https://repository.mobilifiver.com/public/feed/test_json/test.json'
+    )
+    # Fonti importate dallo scheduler (schedule in formato crontab); la prima è quella predefinita
+    FEED_SOURCES = [
+        {'name': 'mobilifiver', 'url': DEFAULT_FEED_URL, 'schedule': '0 6 * * *'},
+    ]
+    # Importazioni eseguite in parallelo (download e verifica; la scrittura è serializzata)
+    IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+    # Processi per la lettura dei feed di grandi dimensioni (0 o 1 = lettura sequenziale)
+    IMPORT_PARSE_WORKERS = int(os.environ.get('IMPORT_PARSE_WORKERS', 0))
+    # Lettura completa del feed prima della scrittura, per conoscerne il totale esatto (altrimenti stimato)
+    IMPORT_VERIFY_FEED = os.environ.get('IMPORT_VERIFY_FEED', 'false').lower() == 'true'
+    
+    # Cache dei risultati delle query dell'assistente (0 voci = disabilitata)
+    QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 1024))
+    QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))
     
     # Configurazioni logging
     LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -29,6 +57,7 @@ class DevelopmentConfig(Config):
     """Configurazione per ambiente di sviluppo"""
     DEBUG = True
     TESTING = False
+    SQLALCHEMY_ECHO = os.environ.get('SQLALCHEMY_ECHO') == '1'
 
 class TestingConfig(Config):
     """Configurazione per ambiente di test"""
@@ -43,3 +72,16 @@ class ProductionConfig(Config):
     # In produzione, usare una chiave segreta forte
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'produzione-chiave-molto-segreta'
     LOG_LEVEL = logging.WARNING
+    
+    # Profilo SQLite per letture concorrenti durante le importazioni
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # i lettori non vengono bloccati dallo scrittore
+        'synchronous': 'NORMAL',  # sicuro in WAL, evita un fsync per ogni commit
+        'mmap_size': 268435456,  # 256 MB di letture tramite memory map
+        'cache_size': -65536,  # 64 MB di page cache per connessione
+        'busy_timeout': 10000,
+        'temp_store': 'MEMORY',
+    }
+    # Una connessione per thread del worker gunicorn più quelle per importazioni e scheduler
+    DATABASE_POOL_SIZE = int(os.environ.get('GUNICORN_THREADS', 4)) + 2
+    DATABASE_MAX_OVERFLOW = 4
@@ -2,8 +2,11 @@
 Gestione del database con SQLAlchemy
 """
 import os
+import json
 import logging
-from sqlalchemy import create_engine
+from datetime import datetime
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from flask import current_app
@@ -14,6 +17,12 @@ logger = logging.getLogger("database")
 # Base per i modelli
 Base = declarative_base()
 
+# Indici creati da versioni precedenti e sostituiti da indici composti
+OBSOLETE_INDEXES = (
+    'ix_product_changes_product_id',  # prefisso di ix_product_changes_product_changed
+    'ix_product_changes_sync_id',  # prefisso di ix_product_changes_sync_product
+)
+
 # Dichiarazione variabili globali
 engine = None
 SessionLocal = None
@@ -40,8 +49,13 @@ def init_db(app):
     engine = create_engine(
         database_url,
         connect_args={"check_same_thread": False},  # Necessario per SQLite in ambiente multi-thread
-        echo=app.config['DEBUG']  # Attiva il logging SQL in modalità debug
+        echo=app.config.get('SQLALCHEMY_ECHO', False),
+        poolclass=QueuePool,
+        pool_size=app.config.get('DATABASE_POOL_SIZE', 5),
+        max_overflow=app.config.get('DATABASE_MAX_OVERFLOW', 10),
+        pool_timeout=app.config.get('DATABASE_POOL_TIMEOUT', 30)
     )
+    _register_sqlite_pragmas(engine, app.config.get('SQLITE_PRAGMAS', {}))
 
     # Creazione della session factory
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -54,17 +68,135 @@ def init_db(app):
     
     logger.info("Inizializzazione del database completata")
 
+def _register_sqlite_pragmas(engine, pragmas):
+    """
+    Applica i PRAGMA configurati a ogni nuova connessione del pool.
+    
+    Args:
+        engine: Engine SQLAlchemy
+        pragmas (dict): Nome e valore di ciascun PRAGMA
+    """
+    if not pragmas:
+        return
+    
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    
+    logger.info(f"PRAGMA SQLite: {', '.join(f'{k}={v}' for k, v in pragmas.items())}")
+
 def ensure_db_initialized():
     """
     Assicura che tutte le tabelle del database siano create.
     """
     # Importiamo i modelli qui per evitare dipendenze circolari
-    from app.models.models import Product, CatalogSync, ProductChange
+    from app.models.models import Product, CatalogSync, ProductChange, FeedFetchState, ImportFeedId, FeedSource, ProductPayload
     
     logger.info("Verifica delle tabelle del database...")
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _migrate_raw_data()
+    ensure_indexes()
+    
+    from app.services.search_index import ensure_search_index
+    ensure_search_index(engine)
+    
+    from app.services.taxonomy import ensure_taxonomy
+    from app.services.similarity import ensure_similarity
+    with get_db() as db:
+        ensure_taxonomy(db)
+        ensure_similarity(db)
     logger.info("Tabelle del database verificate e create se necessario!")
 
+def _add_missing_columns():
+    """
+    Aggiunge alle tabelle esistenti le colonne introdotte dopo la loro creazione.
+    
+    create_all crea solo le tabelle mancanti: le nuove colonne dei modelli
+    vengono aggiunte qui con ALTER TABLE, sempre come colonne nullable.
+    """
+    inspector = inspect(engine)
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                
+                column_type = column.type.compile(dialect=engine.dialect)
+                logger.info(f"Aggiunta colonna {table.name}.{column.name}")
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+def _migrate_raw_data(batch_size: int = 1000):
+    """
+    Sposta il JSON grezzo dei prodotti dalla colonna products.raw_data alla
+    tabella product_payloads, compresso, ed elimina la colonna.
+    
+    Lo spazio liberato viene riutilizzato dalle scritture successive; per
+    ridurre la dimensione del file serve un VACUUM esplicito.
+    
+    Args:
+        batch_size (int, optional): Prodotti letti per volta
+    """
+    from app.models.models import ProductPayload
+    
+    if 'raw_data' not in {column['name'] for column in inspect(engine).get_columns('products')}:
+        return
+    
+    logger.info("Migrazione di products.raw_data in product_payloads...")
+    payloads = ProductPayload.__table__
+    migrated = 0
+    last_id = ''
+    with engine.begin() as conn:
+        while True:
+            rows = conn.execute(text(
+                "SELECT id, raw_data, updated_at FROM products "
+                "WHERE id > :last_id AND raw_data IS NOT NULL ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'limit': batch_size}).all()
+            if not rows:
+                break
+            conn.execute(payloads.insert().prefix_with('OR IGNORE'), [{
+                'product_id': product_id,
+                'compressed': ProductPayload.pack(json.loads(raw_data)),
+                'updated_at': datetime.fromisoformat(updated_at) if updated_at else None
+            } for product_id, raw_data, updated_at in rows])
+            migrated += len(rows)
+            last_id = rows[-1][0]
+        
+        conn.execute(text("ALTER TABLE products DROP COLUMN raw_data"))
+    logger.info(f"Migrati {migrated} payload, colonna products.raw_data eliminata")
+
+def ensure_indexes():
+    """
+    Allinea gli indici delle tabelle esistenti a quelli dichiarati nei modelli.
+    
+    create_all crea gli indici solo insieme alle nuove tabelle: qui vengono
+    creati quelli mancanti, eliminati quelli obsoleti e aggiornate le
+    statistiche usate dal query planner.
+    """
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    logger.info(f"Creazione indice {index.name}")
+                    index.create(bind=conn)
+        
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                logger.info(f"Eliminazione indice obsoleto {name}")
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        
+        conn.execute(text("PRAGMA optimize"))
+
 def get_db():
     """
     Fornisce una sessione di database.
@@ -1,7 +1,9 @@
 """
 Modelli per il database dell'applicazione
 """
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean, JSON
+import json
+import zlib
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Boolean, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.models.database import Base
@@ -18,21 +20,21 @@ class Product(Base):
     item_group_id = Column(String, index=True)  # ID del gruppo di prodotti
     title = Column(String(255), nullable=False)
     description = Column(Text)
-    price = Column(Float)
+    price = Column(Float, index=True)
     sale_price = Column(Float)
     
     # Attributi prodotto
-    brand = Column(String(100))
+    brand = Column(String(100), index=True)
     condition = Column(String(50))
-    availability = Column(String(50))
+    availability = Column(String(50), index=True)
     availability_date = Column(String(50))  # Data di disponibilità per prodotti in backorder
     color = Column(String(100))
     material = Column(String(100))
     mpn = Column(String(100))  # Manufacturer Part Number
     
     # Categorie e classificazioni
-    google_product_category = Column(String(255))
-    product_type = Column(String(255))
+    google_product_category = Column(String(255), index=True)
+    product_type = Column(String(255), index=True)
     
     # URL e immagini
     link = Column(String(500))
@@ -44,6 +46,9 @@ class Product(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_synced = Column(DateTime)
+    content_hash = Column(String(40))  # Impronta del payload normalizzato, per saltare i prodotti invariati
+    removed_at = Column(DateTime, index=True)  # Valorizzato quando il prodotto esce dal feed
+    source_id = Column(Integer, ForeignKey('feed_sources.id'))  # Fonte che ha importato il prodotto
     
     # Etichette personalizzate
     custom_label_1 = Column(String(255))
@@ -51,16 +56,125 @@ class Product(Base):
     custom_label_3 = Column(String(255))
     custom_label_4 = Column(String(255))
     
-    # Metadati aggiuntivi
-    raw_data = Column(JSON)  # Memorizza l'intero JSON grezzo per eventuali campi non mappati
-    
     # Relazioni
     changes = relationship("ProductChange", back_populates="product")
+    payload = relationship("ProductPayload", uselist=False, lazy='select', cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Prodotti attivi di una fonte, per la fase di rimozione dell'importatore
+        Index('ix_products_source_removed', 'source_id', 'removed_at'),
+    )
+    
+    @property
+    def raw_data(self):
+        """JSON grezzo del feed per eventuali campi non mappati, letto solo all'accesso."""
+        return self.payload.data if self.payload else None
     
     def __repr__(self):
         return f"<Product(id='{self.id}', title='{self.title}')>"
 
 
+class ProductPayload(Base):
+    """
+    Payload grezzo del feed di un prodotto, compresso con zlib.
+    Tenuto fuori dalla tabella products così che le query sui prodotti non
+    leggano il JSON completo; viene riscritto a ogni modifica del prodotto.
+    """
+    __tablename__ = 'product_payloads'
+    
+    product_id = Column(String, ForeignKey('products.id'), primary_key=True)
+    compressed = Column(LargeBinary, nullable=False)  # JSON compatto compresso con zlib
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    
+    # La chiave è l'ID testuale del prodotto: senza rowid la tabella è un unico B-tree
+    __table_args__ = {'sqlite_with_rowid': False}
+    
+    @staticmethod
+    def pack(data) -> bytes:
+        """Serializza e comprime un payload (dizionario o JSON già codificato in UTF-8)."""
+        if not isinstance(data, bytes):
+            data = json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+        return zlib.compress(data)
+    
+    @staticmethod
+    def unpack(compressed: bytes):
+        """Decomprime e decodifica un payload."""
+        return json.loads(zlib.decompress(compressed).decode('utf-8')) if compressed else None
+    
+    @property
+    def data(self):
+        return self.unpack(self.compressed)
+    
+    def __repr__(self):
+        return f"<ProductPayload(product_id='{self.product_id}', bytes={len(self.compressed or b'')})>"
+
+
+class CategoryNode(Base):
+    """
+    Nodo dell'albero delle categorie, ricavato dai percorsi separati da '>'
+    di google_product_category e product_type (una tassonomia per campo).
+    I conteggi sono mantenuti dall'importatore insieme a ProductCategory.
+    """
+    __tablename__ = 'category_nodes'
+    
+    id = Column(Integer, primary_key=True)
+    taxonomy = Column(String, nullable=False)  # google, product_type
+    parent_id = Column(Integer, ForeignKey('category_nodes.id'))
+    name = Column(String, nullable=False)
+    path = Column(String, nullable=False)  # percorso normalizzato ("Arredamento > Tavoli")
+    path_key = Column(String, nullable=False)  # percorso in minuscolo, per la ricerca
+    depth = Column(Integer, nullable=False)
+    product_count = Column(Integer, default=0)  # prodotti attivi nel nodo e nei discendenti
+    direct_count = Column(Integer, default=0)  # prodotti attivi il cui percorso termina nel nodo
+    
+    __table_args__ = (
+        Index('ix_category_nodes_taxonomy_path', 'taxonomy', 'path_key', unique=True),
+        Index('ix_category_nodes_parent', 'parent_id'),
+    )
+    
+    def __repr__(self):
+        return f"<CategoryNode(taxonomy='{self.taxonomy}', path='{self.path}', products={self.product_count})>"
+
+
+class ProductCategory(Base):
+    """
+    Appartenenza di un prodotto attivo a un nodo di categoria: il nodo finale
+    del suo percorso e tutti i suoi antenati, così che i prodotti di un ramo
+    siano una lettura per intervallo sull'indice del nodo.
+    """
+    __tablename__ = 'product_categories'
+    
+    node_id = Column(Integer, ForeignKey('category_nodes.id'), primary_key=True)
+    product_id = Column(String, ForeignKey('products.id'), primary_key=True)
+    direct = Column(Boolean, default=False)  # True per il nodo finale del percorso
+    
+    __table_args__ = (
+        Index('ix_product_categories_product', 'product_id'),
+        {'sqlite_with_rowid': False},
+    )
+    
+    def __repr__(self):
+        return f"<ProductCategory(node_id={self.node_id}, product_id='{self.product_id}')>"
+
+
+class ProductSimilarity(Base):
+    """
+    Prodotti più simili a un prodotto attivo, calcolati dopo ogni importazione:
+    i simili di un prodotto sono una lettura sulla chiave primaria.
+    """
+    __tablename__ = 'product_similarity'
+    
+    product_id = Column(String, ForeignKey('products.id'), primary_key=True)
+    signature = Column(String(40), nullable=False)  # Impronta delle caratteristiche da cui sono calcolati i simili
+    neighbor_ids = Column(Text, nullable=False)  # ID dei prodotti simili separati da \n, dal più simile
+    scores = Column(Text, nullable=False)  # Similarità tra 0 e 1 separate da spazi, nello stesso ordine
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+    
+    def __repr__(self):
+        return f"<ProductSimilarity(product_id='{self.product_id}', neighbors={len((self.scores or '').split())})>"
+
+
 class CatalogSync(Base):
     """
     Registro delle sincronizzazioni del catalogo.
@@ -71,14 +185,18 @@ class CatalogSync(Base):
     id = Column(Integer, primary_key=True)
     source_url = Column(String(500))
     started_at = Column(DateTime, default=datetime.utcnow)
-    completed_at = Column(DateTime)
+    completed_at = Column(DateTime, index=True)
     success = Column(Boolean, default=False)
+    status = Column(String(20))  # running, completed, failed
+    checkpoint = Column(Integer, default=0)  # Elementi del feed già scritti (punto di ripresa)
     products_total = Column(Integer, default=0)
     products_added = Column(Integer, default=0)
     products_updated = Column(Integer, default=0)
     products_removed = Column(Integer, default=0)
     error_message = Column(Text)
     import_version = Column(String(20), unique=True, index=True)  # es. "2025-03-31"
+    source_id = Column(Integer, ForeignKey('feed_sources.id'), index=True)
+    metrics = Column(JSON)  # Tempi per fase e contatori dell'importazione (vedi ImportMetrics)
     
     # Relazioni
     changes = relationship("ProductChange", back_populates="sync")
@@ -96,8 +214,8 @@ class ProductChange(Base):
     __tablename__ = 'product_changes'
     
     id = Column(Integer, primary_key=True)
-    product_id = Column(String, ForeignKey('products.id'), index=True)
-    sync_id = Column(Integer, ForeignKey('catalog_syncs.id'), index=True)
+    product_id = Column(String, ForeignKey('products.id'))
+    sync_id = Column(Integer, ForeignKey('catalog_syncs.id'))
     field_name = Column(String(100))
     old_value = Column(Text)
     new_value = Column(Text)
@@ -107,5 +225,110 @@ class ProductChange(Base):
     product = relationship("Product", back_populates="changes")
     sync = relationship("CatalogSync", back_populates="changes")
     
+    __table_args__ = (
+        # Storico di un prodotto ordinato per data
+        Index('ix_product_changes_product_changed', 'product_id', 'changed_at'),
+        # Modifiche di una sincronizzazione, per prodotto
+        Index('ix_product_changes_sync_product', 'sync_id', 'product_id'),
+        # Modifiche recenti raggruppate per prodotto (indice coprente)
+        Index('ix_product_changes_changed_product', 'changed_at', 'product_id'),
+    )
+    
     def __repr__(self):
         return f"<ProductChange(product_id='{self.product_id}', field='{self.field_name}')>"
+
+
+class FeedSource(Base):
+    """
+    Registro delle fonti dei feed da importare.
+    Le fonti configurate (FEED_SOURCES) vengono allineate all'avvio; quelle
+    importate manualmente per URL vengono aggiunte alla prima importazione.
+    """
+    __tablename__ = 'feed_sources'
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), unique=True, nullable=False)
+    url = Column(String(500), unique=True, nullable=False)
+    schedule = Column(String(100))  # Espressione crontab, es. "0 6 * * *" (None: solo manuale)
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<FeedSource(name='{self.name}', url='{self.url}')>"
+
+
+class ImportFeedId(Base):
+    """
+    ID dei prodotti letti dal feed durante una sincronizzazione.
+    Tabella di appoggio per individuare i prodotti rimossi con un'unica
+    query al termine dell'importazione; le righe sopravvivono ai commit per
+    blocco, così che una sincronizzazione ripresa non debba rileggerle.
+    """
+    __tablename__ = 'import_feed_ids'
+    
+    sync_id = Column(Integer, ForeignKey('catalog_syncs.id'), primary_key=True)
+    product_id = Column(String, primary_key=True)
+    
+    def __repr__(self):
+        return f"<ImportFeedId(sync_id={self.sync_id}, product_id='{self.product_id}')>"
+
+
+class FeedFetchState(Base):
+    """
+    Stato dell'ultimo recupero di ciascun feed remoto.
+    Conserva i validatori HTTP e l'impronta del contenuto, così che le
+    importazioni successive possano usare richieste condizionali e saltare
+    i feed invariati.
+    """
+    __tablename__ = 'feed_fetch_states'
+    
+    id = Column(Integer, primary_key=True)
+    source_url = Column(String(500), unique=True, index=True)
+    etag = Column(String(255))
+    last_modified = Column(String(100))
+    content_digest = Column(String(64))  # SHA-256 del corpo dell'ultimo feed importato
+    checked_at = Column(DateTime)
+    changed_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f"<FeedFetchState(source_url='{self.source_url}', etag='{self.etag}')>"
+
+
+class CatalogStats(Base):
+    """
+    Aggregati del catalogo mantenuti in modo incrementale dall'importatore.
+    Contiene un'unica riga (id=1) letta dalla dashboard al posto dei COUNT(*).
+    """
+    __tablename__ = 'catalog_stats'
+    
+    id = Column(Integer, primary_key=True)
+    total_products = Column(Integer, default=0)
+    total_syncs = Column(Integer, default=0)
+    total_changes = Column(Integer, default=0)
+    last_sync_id = Column(Integer)
+    last_sync_at = Column(DateTime)
+    # Incrementato dalle sincronizzazioni che scrivono prodotti; invalida la cache delle query
+    catalog_version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<CatalogStats(products={self.total_products}, syncs={self.total_syncs}, changes={self.total_changes})>"
+
+
+class ImportLease(Base):
+    """
+    Lease delle importazioni mantenuti nel database.
+    Una riga per risorsa: 'write' serializza le scritture delle importazioni,
+    le altre (es. 'source:3') impediscono importazioni concorrenti della
+    stessa fonte, anche da processi diversi. Un lease è libero se holder è
+    vuoto o expires_at è passato: chi lo detiene lo rinnova periodicamente.
+    """
+    __tablename__ = 'import_leases'
+    
+    name = Column(String(600), primary_key=True)
+    holder = Column(String(50))  # ID del job che detiene il lease
+    acquired_at = Column(DateTime)
+    expires_at = Column(DateTime)
+    
+    def __repr__(self):
+        return f"<ImportLease(name='{self.name}', holder='{self.holder}')>"
@@ -1,17 +1,23 @@
 """
 API per l'applicazione FeedWise
 """
-from flask import Blueprint, jsonify, request, Response, current_app
+from flask import Blueprint, jsonify, request, Response, current_app, url_for, stream_with_context, g
+import json
 import logging
-from datetime import datetime
-from sqlalchemy import func
-from threading import Thread
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
 
 from app.models.database import get_db
-from app.models.models import Product, CatalogSync, ProductChange
-from app.services.catalog_importer import CatalogImporter
+from app.models.models import Product, CatalogSync, ProductChange, ProductPayload, ProductCategory
+from app.services.catalog_stats import get_catalog_stats_row
 from app.services.ai_assistant import handle_conversation
-from app.services.scheduler import run_scheduled_import
+from app.services.catalog_query import get_changes
+from app.services.feed_sources import get_or_create_url_source, list_feed_sources
+from app.services.job_runner import get_job_runner
+from app.services.metrics import REQUEST_LATENCY
+from app.services.scheduler import enqueue_source_import, enqueue_resume
+from app.services.taxonomy import TAXONOMY_FIELDS, TAXONOMY_GOOGLE, get_category_tree
 from app.utils.helpers import format_time_ago
 
 # Logger
@@ -20,6 +26,48 @@ logger = logging.getLogger("routes.api")
 # Blueprint per le API
 api_bp = Blueprint('api', __name__)
 
+# Campi restituiti da /api/products quando non è indicato il parametro fields
+DEFAULT_PRODUCT_FIELDS = (
+    'id', 'title', 'description', 'price', 'sale_price', 'brand', 'condition',
+    'availability', 'color', 'material', 'product_type', 'google_product_category',
+    'link', 'image_link', 'updated_at', 'availability_date'
+)
+
+# Campo di /api/products letto dalla tabella dei payload compressi
+RAW_DATA_FIELD = 'raw_data'
+
+# Dimensione predefinita e massima delle pagine di /api/products
+PRODUCTS_PAGE_SIZE = 100
+PRODUCTS_MAX_PAGE_SIZE = 1000
+
+# Secondi senza aggiornamenti dopo i quali lo stream SSE di un'importazione invia un keepalive
+SSE_KEEPALIVE_SECONDS = 15
+
+# Righe lette per volta dal cursore durante l'esportazione
+EXPORT_BATCH_SIZE = 1000
+
+# Righe accorpate in ogni blocco inviato al client durante l'esportazione
+EXPORT_FLUSH_ROWS = 200
+
+@api_bp.before_request
+def start_request_timer():
+    """Registra l'istante di inizio della richiesta per l'istogramma di latenza."""
+    g.request_started = time.perf_counter()
+
+@api_bp.after_request
+def record_request_latency(response):
+    """
+    Registra la latenza della richiesta, etichettata con la regola di routing.
+    
+    Per le risposte in streaming (esportazione, eventi) misura il tempo fino
+    all'invio delle intestazioni.
+    """
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint, request.method, str(response.status_code))
+    return response
+
 @api_bp.route('/dashboard')
 def dashboard_data():
     """API per i dati della dashboard."""
@@ -27,18 +75,9 @@ def dashboard_data():
     
     try:
         with get_db() as db:
-            # Conta totale prodotti
-            total_products = db.query(func.count(Product.id)).scalar() or 0
-            
-            # Conta sincronizzazioni
-            total_syncs = db.query(func.count(CatalogSync.id)).scalar() or 0
-            
-            # Ultima sincronizzazione
-            last_sync = db.query(CatalogSync).order_by(CatalogSync.completed_at.desc()).first()
-            last_sync_time = "Mai" if not last_sync else format_time_ago(last_sync.completed_at)
-            
-            # Totale modifiche
-            total_changes = db.query(func.count(ProductChange.id)).scalar() or 0
+            # Aggregati mantenuti dall'importatore
+            stats = get_catalog_stats_row(db)
+            last_sync_time = format_time_ago(stats.last_sync_at) if stats.last_sync_id else "Mai"
             
             # Lista sincronizzazioni recenti
             recent_syncs = db.query(CatalogSync).order_by(CatalogSync.completed_at.desc()).limit(10).all()
@@ -54,14 +93,15 @@ def dashboard_data():
                     'added': sync.products_added,
                     'updated': sync.products_updated,
                     'removed': sync.products_removed,
-                    'success': sync.success
+                    'success': sync.success,
+                    'status': sync.status
                 })
             
             return jsonify({
-                'totalProducts': total_products,
-                'totalSyncs': total_syncs,
+                'totalProducts': stats.total_products,
+                'totalSyncs': stats.total_syncs,
                 'lastSync': last_sync_time,
-                'totalChanges': total_changes,
+                'totalChanges': stats.total_changes,
                 'syncs': syncs_data
             })
     except Exception as e:
@@ -70,44 +110,139 @@ def dashboard_data():
 
 @api_bp.route('/products')
 def get_products():
-    """API per ottenere tutti i prodotti."""
+    """
+    API per ottenere i prodotti, una pagina alla volta.
+    
+    Parametri della query string:
+        after: ID dell'ultimo prodotto della pagina precedente (paginazione keyset)
+        limit: Numero di prodotti per pagina (massimo PRODUCTS_MAX_PAGE_SIZE)
+        brand, availability: Filtri per valore esatto
+        category: ID di un nodo di /api/categories (prodotti del nodo e dei discendenti)
+        min_price, max_price: Filtri sull'intervallo di prezzo
+        fields: Elenco di campi separati da virgola da restituire
+    
+    Il corpo è un array JSON di prodotti; se esistono altre pagine il cursore
+    della successiva è indicato negli header X-Next-Cursor e Link.
+    """
     logger.debug("Richiesta lista prodotti")
     
+    try:
+        stmt, fields = _products_query_from_args(request.args)
+        limit = _int_arg(request.args, 'limit', PRODUCTS_PAGE_SIZE, maximum=PRODUCTS_MAX_PAGE_SIZE)
+        after = request.args.get('after')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if after:
+        stmt = stmt.where(Product.id > after)
+    stmt = stmt.order_by(Product.id).limit(limit + 1)
+    
     try:
         with get_db() as db:
-            products = db.query(Product).all()
-            products_data = []
-            
-            for product in products:
-                try:
-                    product_dict = {
-                        'id': product.id,
-                        'title': product.title,
-                        'description': product.description,
-                        'price': product.price,
-                        'sale_price': product.sale_price,
-                        'brand': product.brand,
-                        'condition': product.condition,
-                        'availability': product.availability,
-                        'color': product.color,
-                        'material': product.material,
-                        'product_type': product.product_type,
-                        'google_product_category': product.google_product_category,
-                        'link': product.link,
-                        'image_link': product.image_link,
-                        'updated_at': product.updated_at.strftime('%Y-%m-%d %H:%M') if product.updated_at else None,
-                        'availability_date': product.availability_date
-                    }
-                    
-                    products_data.append(product_dict)
-                except Exception as e:
-                    logger.error(f"Errore nell'elaborazione del prodotto {product.id}: {str(e)}")
-            
-            return jsonify(products_data)
+            rows = db.execute(stmt).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        products_data = [_serialize_product_row(row, fields) for row in rows]
+        
+        response = jsonify(products_data)
+        if has_more:
+            next_cursor = rows[-1].id
+            args = request.args.to_dict()
+            args.update(after=next_cursor, limit=limit)
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = f'<{url_for(".get_products", **args)}>; rel="next"'
+        return response
     except Exception as e:
         logger.error(f"Errore nel caricamento dei prodotti: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/products/export')
+def export_products():
+    """
+    API per esportare l'intero catalogo in streaming.
+    
+    Accetta gli stessi filtri e il parametro fields di /api/products.
+    Con format=ndjson (predefinito) restituisce un prodotto JSON per riga,
+    con format=json un unico array JSON. I prodotti vengono letti da un
+    cursore lato server e inviati man mano, senza costruire la risposta
+    in memoria.
+    """
+    logger.debug("Richiesta esportazione prodotti")
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'json'):
+        return jsonify({"error": f"Formato non supportato: {export_format}"}), 400
+    
+    try:
+        stmt, fields = _products_query_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    stmt = stmt.order_by(Product.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    
+    def generate():
+        with get_db() as db:
+            try:
+                if export_format == 'json':
+                    yield '['
+                separator = '\n' if export_format == 'ndjson' else ','
+                buffer = []
+                first_batch = True
+                for row in db.execute(stmt):
+                    buffer.append(json.dumps(_serialize_product_row(row, fields), ensure_ascii=False, default=str))
+                    if len(buffer) >= EXPORT_FLUSH_ROWS:
+                        yield _export_batch(buffer, separator, first_batch)
+                        buffer = []
+                        first_batch = False
+                if buffer:
+                    yield _export_batch(buffer, separator, first_batch)
+                if export_format == 'json':
+                    yield ']'
+            except Exception as e:
+                # Lo stato HTTP è già stato inviato: la risposta risulterà troncata
+                logger.error(f"Errore durante l'esportazione dei prodotti: {str(e)}")
+                raise
+    
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+@api_bp.route('/changes')
+def changes_data():
+    """
+    API per lo storico delle modifiche raggruppato per prodotto.
+    
+    Parametri della query string:
+        since, until: Date ISO (es. 2025-03-31 o 2025-03-31T06:00) che delimitano il periodo
+        days: In alternativa a since, numero di giorni a ritroso (predefinito 7)
+        product_id, field: Filtri ripetibili su prodotti e campi
+        limit: Numero massimo di prodotti (predefinito 10)
+    """
+    logger.debug("Richiesta storico modifiche")
+    
+    try:
+        if request.args.get('since'):
+            since = _date_arg(request.args, 'since')
+        else:
+            since = datetime.now() - timedelta(days=_int_arg(request.args, 'days', 7))
+        until = _date_arg(request.args, 'until')
+        limit = _int_arg(request.args, 'limit', 10, maximum=PRODUCTS_MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        changes = get_changes(
+            since=since,
+            until=until,
+            product_ids=request.args.getlist('product_id') or None,
+            fields=request.args.getlist('field') or None,
+            limit=limit
+        )
+        return jsonify(changes)
+    except Exception as e:
+        logger.error(f"Errore nel recupero dello storico modifiche: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @api_bp.route('/chat', methods=['POST'])
 def chat_api():
     """API per la chat con l'assistente AI."""
@@ -137,30 +272,147 @@ def chat_api():
 
 @api_bp.route('/import', methods=['POST'])
 def start_import():
-    """API per avviare una nuova importazione."""
+    """
+    API per avviare una nuova importazione.
+    
+    L'importazione viene accodata nel pool delle importazioni: se la stessa
+    fonte è già in coda o in esecuzione viene restituito il job esistente.
+    """
     logger.debug("Richiesta importazione")
     
     source_type = request.json.get('source_type')
     source_url = request.json.get('url')
     version_label = request.json.get('version_label')
     
-    if source_type == 'url' and source_url:
-        # Avvia l'importazione in un thread separato per non bloccare l'API
-        thread = Thread(target=run_import, args=(source_url, None, version_label))
-        thread.daemon = True
-        thread.start()
-        return jsonify({'success': True, 'message': 'Importazione avviata'})
-    elif source_type == 'file':
-        # In una implementazione reale, qui gestiresti l'upload del file
-        return jsonify({'success': False, 'message': 'Importazione da file non ancora implementata'})
-    elif source_type == 'default':
-        # Usa l'URL predefinito del feed
-        thread = Thread(target=run_scheduled_import)
-        thread.daemon = True
-        thread.start()
-        return jsonify({'success': True, 'message': 'Importazione avviata con URL predefinito'})
-    else:
-        return jsonify({'success': False, 'message': 'Parametri non validi'})
+    try:
+        if source_type == 'url' and source_url:
+            with get_db() as db:
+                source_id = get_or_create_url_source(db, source_url).id
+            job, created = get_job_runner().submit(
+                source_url=source_url, version_label=version_label, source_id=source_id
+            )
+            message = 'Importazione avviata'
+        elif source_type == 'file':
+            # In una implementazione reale, qui gestiresti l'upload del file
+            return jsonify({'success': False, 'message': 'Importazione da file non ancora implementata'})
+        elif source_type == 'default':
+            # Usa la fonte predefinita del registro
+            job, created = enqueue_source_import()
+            message = 'Importazione avviata con URL predefinito'
+        elif source_type == 'source' and request.json.get('source_id') is not None:
+            job, created = enqueue_source_import(int(request.json['source_id']))
+            message = 'Importazione avviata'
+        else:
+            return jsonify({'success': False, 'message': 'Parametri non validi'})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    if not created:
+        message = 'Importazione già in corso per questa fonte'
+    return jsonify({'success': True, 'message': message, 'job': job.to_dict()})
+
+@api_bp.route('/import/<int:sync_id>/resume', methods=['POST'])
+def resume_sync(sync_id):
+    """API per riprendere un'importazione interrotta dal suo ultimo checkpoint."""
+    logger.debug(f"Richiesta ripresa importazione {sync_id}")
+    
+    with get_db() as db:
+        sync = db.get(CatalogSync, sync_id)
+        if not sync:
+            return jsonify({'success': False, 'message': 'Sincronizzazione non trovata'}), 404
+        if sync.success:
+            return jsonify({'success': False, 'message': 'Sincronizzazione già completata'})
+        checkpoint = sync.checkpoint or 0
+    
+    job, created = enqueue_resume(sync_id)
+    if not created:
+        return jsonify({'success': True, 'message': 'Importazione già in corso per questa fonte', 'job': job.to_dict()})
+    return jsonify({
+        'success': True,
+        'message': f'Importazione ripresa dall\'elemento {checkpoint}',
+        'job': job.to_dict()
+    })
+
+@api_bp.route('/import/jobs')
+def import_jobs():
+    """API per lo stato delle importazioni in coda, in esecuzione e concluse."""
+    return jsonify([job.to_dict() for job in get_job_runner().list_jobs()])
+
+@api_bp.route('/import/<job_id>')
+def import_job(job_id):
+    """API per lo stato e l'avanzamento di una singola importazione."""
+    job = get_job_runner().get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato'}), 404
+    return jsonify(job.to_dict())
+
+@api_bp.route('/import/<job_id>/events')
+def import_job_events(job_id):
+    """
+    Stream Server-Sent Events con lo stato di un'importazione.
+    
+    Invia un evento a ogni aggiornamento (cambio di fase o fine blocco) e
+    chiude lo stream alla conclusione del job.
+    """
+    job = get_job_runner().get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job non trovato'}), 404
+    
+    def generate():
+        version = -1
+        while True:
+            current = job.wait_for_change(version, timeout=SSE_KEEPALIVE_SECONDS)
+            if current == version:
+                # Nessun aggiornamento: commento per mantenere aperta la connessione
+                yield ': keepalive\n\n'
+                continue
+            version = current
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@api_bp.route('/categories')
+def get_categories():
+    """
+    API per l'albero delle categorie con il numero di prodotti attivi per nodo.
+    
+    Parametri della query string:
+        taxonomy: Tassonomia (google per google_product_category, product_type)
+        depth: Profondità massima dei nodi restituiti
+    
+    product_count comprende i prodotti dei discendenti, direct_count solo
+    quelli il cui percorso termina nel nodo. L'ID di un nodo può essere
+    usato come filtro category di /api/products.
+    """
+    taxonomy = request.args.get('taxonomy', TAXONOMY_GOOGLE)
+    if taxonomy not in TAXONOMY_FIELDS:
+        return jsonify({"error": f"Parametro taxonomy non valido: {taxonomy}"}), 400
+    try:
+        depth = _int_arg(request.args, 'depth', None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        with get_db() as db:
+            return jsonify({'taxonomy': taxonomy, 'categories': get_category_tree(db, taxonomy, depth)})
+    except Exception as e:
+        logger.error(f"Errore nel recupero dell'albero delle categorie: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/sources')
+def feed_sources():
+    """API per l'elenco delle fonti dei feed registrate."""
+    try:
+        with get_db() as db:
+            return jsonify(list_feed_sources(db))
+    except Exception as e:
+        logger.error(f"Errore nel recupero delle fonti: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @api_bp.route('/placeholder.png')
 def placeholder_image():
@@ -177,19 +429,112 @@ def placeholder_image():
     '''
     return Response(svg, mimetype='image/svg+xml')
 
-def run_import(source_url, json_file, version_label):
-    """Esegue un'importazione in background."""
-    logger.info(f"Avvio importazione da {source_url}")
+def _int_arg(args, name, default, maximum=None):
+    """Legge un parametro intero positivo dalla query string."""
+    value = args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"Parametro {name} non valido: {args.get(name)}")
+    if value < 1:
+        raise ValueError(f"Parametro {name} deve essere maggiore di zero")
+    return min(value, maximum) if maximum else value
+
+def _date_arg(args, name):
+    """Legge un parametro data ISO opzionale dalla query string."""
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Parametro {name} non valido: {value}")
+
+def _float_arg(args, name):
+    """Legge un parametro numerico opzionale dalla query string."""
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Parametro {name} non valido: {value}")
+
+def _products_query_from_args(args):
+    """
+    Costruisce la select dei prodotti a partire dai parametri della richiesta.
     
-    with get_db() as db:
-        try:
-            importer = CatalogImporter(
-                db_session=db,
-                source_url=source_url,
-                json_file=json_file,
-                version_label=version_label
-            )
-            success = importer.import_catalog()
-            logger.info(f"Importazione completata con successo: {success}")
-        except Exception as e:
-            logger.error(f"Errore durante l'importazione: {str(e)}")
+    Vengono selezionate solo le colonne richieste (più l'ID, necessario al
+    cursore): raw_data, salvato compresso in product_payloads, viene letto
+    con una join solo se richiesto esplicitamente.
+    I prodotti rimossi dal feed sono esclusi.
+    
+    Args:
+        args: Parametri della query string
+        
+    Returns:
+        tuple: Select SQLAlchemy e tupla dei campi da restituire
+        
+    Raises:
+        ValueError: Se un parametro non è valido
+    """
+    columns = Product.__table__.c
+    
+    if args.get('fields'):
+        fields = tuple(f.strip() for f in args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in columns and f != RAW_DATA_FIELD]
+        if unknown:
+            raise ValueError(f"Campi non validi: {', '.join(unknown)}")
+    else:
+        fields = DEFAULT_PRODUCT_FIELDS
+    
+    selected = [columns[f] for f in fields if f != RAW_DATA_FIELD]
+    if 'id' not in fields:
+        selected.append(columns.id)
+    if RAW_DATA_FIELD in fields:
+        selected.append(ProductPayload.compressed.label(RAW_DATA_FIELD))
+    stmt = select(*selected).where(Product.removed_at.is_(None))
+    if RAW_DATA_FIELD in fields:
+        stmt = stmt.outerjoin(ProductPayload, ProductPayload.product_id == Product.id)
+    
+    if args.get('brand'):
+        stmt = stmt.where(Product.brand == args['brand'])
+    if args.get('availability'):
+        stmt = stmt.where(Product.availability == args['availability'])
+    
+    category_id = _int_arg(args, 'category', None)
+    if category_id is not None:
+        # Lettura per intervallo sulla chiave (node_id, product_id), già ordinata per ID
+        stmt = stmt.join(ProductCategory, ProductCategory.product_id == Product.id).where(
+            ProductCategory.node_id == category_id
+        )
+    
+    min_price = _float_arg(args, 'min_price')
+    if min_price is not None:
+        stmt = stmt.where(Product.price >= min_price)
+    max_price = _float_arg(args, 'max_price')
+    if max_price is not None:
+        stmt = stmt.where(Product.price <= max_price)
+    
+    return stmt, fields
+
+def _export_batch(lines, separator, first_batch):
+    """Unisce un blocco di righe esportate nel testo da inviare al client."""
+    text = separator.join(lines)
+    if separator == '\n':
+        return text + '\n'
+    return text if first_batch else separator + text
+
+def _serialize_product_row(row, fields):
+    """Converte una riga di prodotto in dizionario serializzabile in JSON."""
+    product_dict = {}
+    for field in fields:
+        value = getattr(row, field)
+        if field == RAW_DATA_FIELD:
+            value = ProductPayload.unpack(value)
+        elif isinstance(value, datetime):
+            value = value.strftime('%Y-%m-%d %H:%M')
+        product_dict[field] = value
+    return product_dict
@@ -0,0 +1,25 @@
+"""
+Endpoint delle metriche in formato Prometheus
+"""
+from flask import Blueprint, Response
+import logging
+
+from app.models.database import get_db
+from app.services.metrics import render_metrics
+
+# Logger
+logger = logging.getLogger("routes.metrics")
+
+# Blueprint per le metriche
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Espone metriche delle importazioni e latenza delle API in formato testo Prometheus."""
+    try:
+        with get_db() as db:
+            body = render_metrics(db)
+        return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        logger.error(f"Errore nella generazione delle metriche: {str(e)}")
+        return Response(f"# errore: {str(e)}\n", status=500, mimetype='text/plain')
@@ -284,7 +284,9 @@ def format_query_result(result: Dict[str, Any]) -> str:
 def get_similar_products(product_id: str, limit: int = 3) -> List[Dict[str, Any]]:
     """
     Trova prodotti simili a un prodotto dato.
-    Semplice implementazione basata su categoria e prezzo simile.
+    Usa l'indice dei simili calcolato a ogni importazione; se il prodotto non
+    vi compare (indice non ancora calcolato o NumPy non installato) cerca
+    prodotti della stessa categoria con prezzo simile.
     
     Args:
         product_id: ID del prodotto di riferimento
@@ -293,7 +295,11 @@ def get_similar_products(product_id: str, limit: int = 3) -> List[Dict[str, Any]
     Returns:
         Lista di prodotti simili
     """
-    from app.services.catalog_query import get_product_by_id, get_products_by_category
+    from app.services.catalog_query import get_product_by_id, get_products_by_category, get_similar_products_from_index
+    
+    similar_products = get_similar_products_from_index(product_id, limit)
+    if similar_products:
+        return similar_products
         
     # Ottieni il prodotto di riferimento
     product = get_product_by_id(product_id)
@@ -0,0 +1,249 @@
+"""
+Scrittura a blocchi dei prodotti importati.
+
+Invece di creare un oggetto ORM per ogni riga del feed, i prodotti nuovi e
+modificati vengono accumulati in buffer e scritti con un'unica istruzione
+``INSERT ... ON CONFLICT DO UPDATE`` eseguita in modalità executemany.
+Le modifiche (ProductChange), i payload grezzi compressi (ProductPayload) e
+gli ID letti dal feed (ImportFeedId) vengono scritti allo stesso modo.
+"""
+import logging
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Union
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models.models import Product, ProductChange, ProductPayload, ImportFeedId
+
+# Logger
+logger = logging.getLogger("bulk_writer")
+
+# Numero predefinito di righe per blocco di scrittura
+DEFAULT_CHUNK_SIZE = 1000
+
+# Campi del prodotto confrontati e aggiornati ad ogni importazione
+TRACKED_FIELDS = (
+    'title',
+    'description',
+    'price',
+    'sale_price',
+    'brand',
+    'condition',
+    'availability',
+    'color',
+    'material',
+    'mpn',
+    'availability_date',
+    'google_product_category',
+    'product_type',
+    'link',
+    'mobile_link',
+    'image_link',
+    'additional_image_links',
+    'custom_label_1',
+    'custom_label_2',
+    'custom_label_3',
+    'custom_label_4',
+)
+
+_products = Product.__table__
+_changes = ProductChange.__table__
+_feed_ids = ImportFeedId.__table__
+_payloads = ProductPayload.__table__
+
+def _build_upsert_statement():
+    """
+    Costruisce l'istruzione di upsert sui prodotti.
+
+    Un'importazione senza fonte non toglie il prodotto alla fonte che lo possiede.
+    """
+    stmt = sqlite_insert(_products)
+    update_columns = TRACKED_FIELDS + ('content_hash', 'last_synced', 'updated_at', 'removed_at')
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    set_['source_id'] = func.coalesce(stmt.excluded.source_id, _products.c.source_id)
+    return stmt.on_conflict_do_update(index_elements=[_products.c.id], set_=set_)
+
+_UPSERT_PRODUCTS = _build_upsert_statement()
+
+_TOUCH_PRODUCTS = (
+    update(_products)
+    .where(_products.c.id == bindparam('b_id'))
+    .values(last_synced=bindparam('b_last_synced'),
+            source_id=func.coalesce(bindparam('b_source_id'), _products.c.source_id))
+)
+
+_INSERT_CHANGES = insert(_changes)
+
+def _build_payload_upsert_statement():
+    """Costruisce l'istruzione di upsert sui payload grezzi."""
+    stmt = sqlite_insert(_payloads)
+    return stmt.on_conflict_do_update(
+        index_elements=[_payloads.c.product_id],
+        set_={column: stmt.excluded[column] for column in ('compressed', 'updated_at')}
+    )
+
+_UPSERT_PAYLOADS = _build_payload_upsert_statement()
+
+# Un ID ripetuto nel feed viene registrato una sola volta
+_INSERT_FEED_IDS = sqlite_insert(_feed_ids).on_conflict_do_nothing()
+
+class BulkProductWriter:
+    """
+    Accumula le scritture dei prodotti e le esegue a blocchi.
+
+    Le righe passate a upsert devono contenere tutte le stesse chiavi.
+    I blocchi vengono scritti automaticamente al raggiungimento di chunk_size;
+    flush() scrive quanto rimasto nei buffer. Il commit resta al chiamante.
+    """
+    def __init__(self, db_session: Session, chunk_size: int = DEFAULT_CHUNK_SIZE, metrics=None):
+        """
+        Inizializza lo scrittore.
+
+        Args:
+            db_session (Session): Sessione del database SQLAlchemy
+            chunk_size (int, optional): Numero di righe per blocco di scrittura
+            metrics (ImportMetrics, optional): Metriche a cui attribuire il tempo
+                                               delle scritture (fase 'write')
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size deve essere maggiore di zero")
+
+        self.db = db_session
+        self.chunk_size = chunk_size
+        self.metrics = metrics
+        self._upserts: List[Dict[str, Any]] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._touched: List[Dict[str, Any]] = []
+        self._changes: List[Dict[str, Any]] = []
+        self._feed_ids: List[Dict[str, Any]] = []
+        self._written_ids: List[str] = []
+        self.rows_written = 0
+        self.changes_written = 0
+
+    def upsert(self, row: Dict[str, Any], payload: Union[bytes, Dict[str, Any]] = None):
+        """
+        Accoda un prodotto nuovo o modificato.
+
+        Args:
+            row (Dict[str, Any]): Valori delle colonne del prodotto
+            payload (Union[bytes, Dict[str, Any]], optional): Dati grezzi del feed: JSON in UTF-8
+                                                              non compresso (ProductRecord.payload_json)
+                                                              o dizionario, compressi con ProductPayload.pack
+                                                              e salvati in product_payloads
+        """
+        self._upserts.append(row)
+        if payload is not None:
+            self._payloads.append({
+                'product_id': row['id'],
+                'compressed': ProductPayload.pack(payload),
+                'updated_at': row.get('updated_at') or datetime.now(timezone.utc)
+            })
+        if len(self._upserts) >= self.chunk_size:
+            self._flush_upserts()
+
+    def touch(self, product_id: str, synced_at: datetime = None, source_id: int = None):
+        """
+        Accoda l'aggiornamento di last_synced per un prodotto invariato.
+
+        Come per upsert, il prodotto passa alla fonte del feed in cui è stato
+        letto: così anche i prodotti invariati importati prima del registro
+        delle fonti vengono assegnati alla propria. Senza fonte (source_id
+        None) la fonte del prodotto resta invariata.
+
+        Args:
+            product_id (str): ID del prodotto
+            synced_at (datetime, optional): Istante di sincronizzazione
+            source_id (int, optional): Fonte del feed (None: fonte del prodotto invariata)
+        """
+        self._touched.append({
+            'b_id': product_id,
+            'b_last_synced': synced_at or datetime.now(timezone.utc),
+            'b_source_id': source_id
+        })
+        if len(self._touched) >= self.chunk_size:
+            self._flush_touched()
+
+    def add_changes(self, changes: Iterable[Dict[str, Any]]):
+        """
+        Accoda righe di ProductChange.
+
+        Args:
+            changes (Iterable[Dict[str, Any]]): Valori delle colonne delle modifiche
+        """
+        self._changes.extend(changes)
+        if len(self._changes) >= self.chunk_size:
+            self._flush_changes()
+
+    def add_feed_id(self, sync_id: int, product_id: str):
+        """
+        Accoda la registrazione di un ID letto dal feed.
+
+        Args:
+            sync_id (int): ID della sincronizzazione in corso
+            product_id (str): ID del prodotto
+        """
+        self._feed_ids.append({'sync_id': sync_id, 'product_id': product_id})
+        if len(self._feed_ids) >= self.chunk_size:
+            self._flush_feed_ids()
+
+    def flush(self):
+        """Scrive tutte le righe ancora nei buffer."""
+        self._flush_upserts()
+        self._flush_touched()
+        self._flush_changes()
+        self._flush_feed_ids()
+
+    def pop_written_ids(self) -> List[str]:
+        """
+        Restituisce gli ID dei prodotti scritti dall'ultima chiamata e azzera l'elenco.
+
+        Returns:
+            List[str]: ID dei prodotti inseriti o aggiornati
+        """
+        written_ids, self._written_ids = self._written_ids, []
+        return written_ids
+
+    def _measure(self):
+        """Contesto che attribuisce il tempo della scrittura alla fase 'write'."""
+        return self.metrics.measure('write') if self.metrics is not None else nullcontext()
+
+    def _flush_upserts(self):
+        if not self._upserts:
+            return
+        with self._measure():
+            self.db.execute(_UPSERT_PRODUCTS, self._upserts)
+            if self._payloads:
+                self.db.execute(_UPSERT_PAYLOADS, self._payloads)
+        self._written_ids.extend(row['id'] for row in self._upserts)
+        self.rows_written += len(self._upserts)
+        logger.debug(f"Scritti {len(self._upserts)} prodotti")
+        self._upserts = []
+        self._payloads = []
+
+    def _flush_touched(self):
+        if not self._touched:
+            return
+        with self._measure():
+            self.db.execute(_TOUCH_PRODUCTS, self._touched)
+        self._touched = []
+
+    def _flush_changes(self):
+        if not self._changes:
+            return
+        # Le modifiche referenziano i prodotti: questi vanno scritti prima
+        self._flush_upserts()
+        with self._measure():
+            self.db.execute(_INSERT_CHANGES, self._changes)
+        self.changes_written += len(self._changes)
+        logger.debug(f"Scritte {len(self._changes)} modifiche")
+        self._changes = []
+
+    def _flush_feed_ids(self):
+        if not self._feed_ids:
+            return
+        with self._measure():
+            self.db.execute(_INSERT_FEED_IDS, self._feed_ids)
+        self._feed_ids = []
@@ -1,19 +1,56 @@
 """
 Importatore di catalogo prodotti da feed JSON
 """
+import hashlib
 import json
 import os
+import tempfile
 import requests
 from datetime import datetime, timezone
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional
 
+from sqlalchemy import DateTime, delete, insert, literal, select, update
 from sqlalchemy.orm import Session
-from app.models.models import Product, CatalogSync, ProductChange
+from app.models.models import Product, CatalogSync, ProductChange, FeedFetchState, ImportFeedId
+from app.services.bulk_writer import BulkProductWriter, DEFAULT_CHUNK_SIZE, TRACKED_FIELDS
+from app.services.catalog_stats import apply_stats_delta
+from app.services.intent_router import refresh_intent_router
+from app.services.metrics import ImportMetrics
+from app.services.search_index import update_search_index, remove_removed_products
+from app.services.similarity import update_similarity
+from app.services.taxonomy import update_taxonomy, remove_removed_from_taxonomy
+from app.utils.feed_parser import CHUNK_SIZE, iter_feed_products, iter_file_chunks
+from app.utils.feed_shards import map_feed_shards, supports_sharding
+from app.utils.product_normalizer import ProductNormalizer, ProductRecord, parse_price
 
 # Logger
 logger = logging.getLogger("catalog_importer")
 
+# Normalizzatore dei prodotti del feed: i valori dei record seguono l'ordine di TRACKED_FIELDS
+PRODUCT_NORMALIZER = ProductNormalizer(TRACKED_FIELDS, {'price': parse_price, 'sale_price': parse_price})
+
+# Numero massimo di ID per ogni query IN sui prodotti esistenti
+_LOOKUP_BATCH_SIZE = 500
+
+# Fasi dell'importazione riportate al callback di avanzamento
+PHASE_FETCH = 'fetch'  # download del feed
+PHASE_PARSE = 'parse'  # lettura e decodifica dei prodotti
+PHASE_DIFF = 'diff'  # confronto con i prodotti esistenti
+PHASE_WRITE = 'write'  # scrittura e commit
+
+# Fasi misurate solo nelle metriche dell'importazione (CatalogSync.metrics)
+PHASE_VERIFY = 'verify'  # lettura di verifica del feed durante prepare()
+PHASE_PREPROCESS = 'preprocess'  # normalizzazione e impronta dei prodotti
+PHASE_INDEX = 'index'  # aggiornamento dell'indice full-text
+PHASE_COMMIT = 'commit'
+PHASE_REMOVE = 'remove'  # marcatura dei prodotti rimossi
+
+# Modifica registrata quando un prodotto esce dal feed o vi ricompare
+STATUS_FIELD = 'status'
+STATUS_ACTIVE = 'active'
+STATUS_REMOVED = 'removed'
+
 class CatalogImporter:
     """
     Classe per importare cataloghi di prodotti da JSON esterno o locale.
@@ -21,7 +58,10 @@ class CatalogImporter:
     Gestisce l'aggiunta di nuovi prodotti, l'aggiornamento di quelli esistenti
     e tiene traccia delle modifiche.
     """
-    def __init__(self, db_session: Session, source_url: str = None, json_file: str = None, version_label: str = None):
+    def __init__(self, db_session: Session, source_url: str = None, json_file: str = None, version_label: str = None,
+                 streaming: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE, sync_record: CatalogSync = None,
+                 source_id: int = None, progress_callback: Callable[[str, int, Optional[int]], None] = None,
+                 parse_workers: int = 0, verify_feed: bool = False):
         """
         Inizializza l'importatore di catalogo.
         
@@ -30,6 +70,21 @@ class CatalogImporter:
             source_url (str, optional): URL da cui recuperare il JSON
             json_file (str, optional): Percorso del file JSON locale
             version_label (str, optional): Etichetta versione per il registro di sincronizzazione
+            streaming (bool, optional): Se True legge i prodotti uno alla volta invece
+                                        di caricare l'intero feed in memoria
+            chunk_size (int, optional): Numero di righe per blocco di scrittura e di commit
+            sync_record (CatalogSync, optional): Sincronizzazione esistente da riprendere
+            source_id (int, optional): Fonte registrata (FeedSource) del feed; i prodotti
+                                       rimossi vengono cercati solo tra quelli della fonte
+            progress_callback (Callable, optional): Chiamato a ogni cambio di fase e a fine blocco
+                                                    con fase, elementi elaborati ed elementi attesi
+            parse_workers (int, optional): Processi per la decodifica e la normalizzazione del
+                                           feed in streaming; con meno di 2 la lettura è sequenziale
+            verify_feed (bool, optional): Se True prepare() legge l'intero feed per
+                                          validarlo e contarne i prodotti prima della
+                                          scrittura; altrimenti il totale è stimato
+                                          dall'ultima sincronizzazione riuscita della
+                                          stessa fonte
         
         Raises:
             ValueError: Se non viene specificato né source_url né json_file
@@ -37,16 +92,47 @@ class CatalogImporter:
         self.db = db_session
         self.source_url = source_url
         self.json_file = json_file
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        self.source_id = source_id
+        self.progress_callback = progress_callback
+        self.parse_workers = parse_workers
+        self.verify_feed = verify_feed
+        
+        # Esito della fase di preparazione (None finché non eseguita)
+        self.feed_changed = None
+        self.items_expected = None
+        
+        # True quando un blocco confermato ha scritto prodotti (vedi _update_sync_record)
+        self._products_committed = False
+        
+        # Tempi per fase e contatori, salvati sul record di sincronizzazione
+        self.metrics = ImportMetrics()
+        
+        # Copia locale del feed remoto e validatori della risposta HTTP
+        self._download_path = None
+        self._download_encoding = 'utf-8'
+        self._fetch_validators = None
         
         if not source_url and not json_file:
             raise ValueError("È necessario specificare o source_url o json_file")
-            
-        self.sync_record = CatalogSync(
-            source_url=source_url if source_url else f"file://{os.path.abspath(json_file)}",
-            started_at=datetime.now(timezone.utc),
-            import_version=version_label
-        )
-        self.db.add(self.sync_record)
+        
+        if sync_record is not None:
+            self.sync_record = sync_record
+            self.sync_record.status = 'running'
+            self.sync_record.error_message = None
+            self.sync_record.completed_at = None
+        else:
+            self.sync_record = CatalogSync(
+                source_url=source_url if source_url else f"file://{os.path.abspath(json_file)}",
+                started_at=datetime.now(timezone.utc),
+                import_version=version_label,
+                status='running',
+                checkpoint=0,
+                source_id=source_id
+            )
+            self.db.add(self.sync_record)
+            apply_stats_delta(self.db, syncs=1)
         self.db.commit()
         
         log_message = f"Inizializzato CatalogImporter (sync_id: {self.sync_record.id}"
@@ -55,6 +141,40 @@ class CatalogImporter:
         log_message += ")"
         logger.info(log_message)
     
+    @classmethod
+    def resume(cls, db_session: Session, sync_id: int, **kwargs) -> 'CatalogImporter':
+        """
+        Crea un importatore che riprende una sincronizzazione non completata.
+        
+        Il feed viene riletto dalla stessa fonte e gli elementi già scritti
+        (fino al checkpoint salvato) vengono saltati.
+        
+        Args:
+            db_session (Session): Sessione del database SQLAlchemy
+            sync_id (int): ID della sincronizzazione da riprendere
+            **kwargs: Altri argomenti per il costruttore (es. chunk_size)
+            
+        Returns:
+            CatalogImporter: Importatore pronto per import_catalog()
+            
+        Raises:
+            ValueError: Se la sincronizzazione non esiste o è già completata
+        """
+        sync_record = db_session.get(CatalogSync, sync_id)
+        if sync_record is None:
+            raise ValueError(f"Sincronizzazione {sync_id} non trovata")
+        if sync_record.success:
+            raise ValueError(f"La sincronizzazione {sync_id} è già stata completata")
+        
+        source = sync_record.source_url or ''
+        if source.startswith('file://'):
+            kwargs.update(source_url=None, json_file=source[len('file://'):])
+        else:
+            kwargs.update(source_url=source, json_file=None)
+        
+        return cls(db_session, version_label=sync_record.import_version, sync_record=sync_record,
+                   source_id=sync_record.source_id, **kwargs)
+    
     def fetch_catalog(self) -> Optional[List[Dict[str, Any]]]:
         """
         Recupera il catalogo prodotti dalla fonte specificata.
@@ -64,15 +184,10 @@ class CatalogImporter:
                                            o None in caso di errore
         """
         try:
-            if self.source_url:
-                logger.info(f"Recupero catalogo da URL: {self.source_url}")
-                response = requests.get(self.source_url, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-            else:
-                logger.info(f"Lettura catalogo da file: {self.json_file}")
-                with open(self.json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+            path, encoding = self._feed_file()
+            logger.info(f"Lettura catalogo da file: {path}")
+            with open(path, 'r', encoding=encoding) as f:
+                data = json.load(f)
             
             # Gestione del formato JSON
             products = data.get("products", data) if isinstance(data, dict) else data
@@ -90,64 +205,229 @@ class CatalogImporter:
             self._update_sync_record(success=False, error_message=str(e))
             return None
     
+    def iter_catalog(self) -> Iterator[Dict[str, Any]]:
+        """
+        Legge il catalogo in streaming, un prodotto alla volta.
+        
+        A differenza di fetch_catalog non carica l'intero feed in memoria:
+        l'array dei prodotti viene decodificato in modo incrementale dal file
+        locale o dalla copia scaricata del feed remoto. Gli errori vengono
+        propagati al chiamante.
+        
+        Yields:
+            Dict[str, Any]: Dati grezzi di un prodotto
+        """
+        path, encoding = self._feed_file()
+        logger.info(f"Lettura catalogo in streaming da file: {path}")
+        yield from iter_feed_products(iter_file_chunks(path, encoding=encoding))
+    
+    def check_for_updates(self) -> bool:
+        """
+        Verifica se il feed è cambiato dall'ultima importazione riuscita.
+        
+        Per i feed remoti invia una richiesta condizionale (If-None-Match /
+        If-Modified-Since) e, se il server risponde con il contenuto, lo scarica
+        in un file temporaneo confrontandone l'impronta con quella salvata.
+        I file locali sono sempre considerati modificati.
+        
+        Returns:
+            bool: False se il feed è sicuramente invariato, True altrimenti
+        """
+        if not self.source_url:
+            return True
+        return self._download_feed(conditional=True)
+    
     def import_catalog(self) -> bool:
         """
         Esegue l'importazione completa del catalogo.
         
+        Equivale a prepare() seguita da write(). Se il feed remoto risulta
+        invariato l'importazione termina subito e il record di sincronizzazione
+        viene marcato come 'unchanged'.
+        
         Returns:
             bool: True se l'importazione è avvenuta con successo, False altrimenti
         """
-        products_data = self.fetch_catalog()
-        if not products_data:
+        try:
+            return self.prepare() and self.write()
+        finally:
+            self._discard_download()
+    
+    def prepare(self) -> bool:
+        """
+        Prima fase dell'importazione: recupera il feed e ne verifica il contenuto.
+        
+        Scarica il feed remoto (con richiesta condizionale). Con verify_feed
+        lo legge anche per intero, controllando che sia un JSON valido e
+        contando i prodotti: costa una lettura in più del feed, ma rende noto
+        il totale esatto durante la scrittura. Senza verifica il totale, da cui
+        dipende il tempo residuo, è stimato con i prodotti dell'ultima
+        sincronizzazione riuscita della stessa fonte.
+        Non scrive prodotti, quindi può essere eseguita in parallelo alla
+        scrittura di altre importazioni. In caso di errore la sincronizzazione
+        viene marcata come fallita.
+        
+        Returns:
+            bool: True se si può procedere con write(), False in caso di errore
+        """
+        try:
+            self.metrics.enter(PHASE_FETCH)
+            self._report_progress(PHASE_FETCH)
+            self.feed_changed = self.check_for_updates()
+            if self.feed_changed and self.streaming and self.verify_feed:
+                self.metrics.enter(PHASE_VERIFY)
+                self._report_progress(PHASE_PARSE)
+                items = 0
+                if self._parallel_parsing():
+                    for results in self._map_feed(None):
+                        items += len(results)
+                        self._report_progress(PHASE_PARSE, items)
+                else:
+                    for _ in self.iter_catalog():
+                        items += 1
+                        if items % self.chunk_size == 0:
+                            self._report_progress(PHASE_PARSE, items)
+                self.items_expected = items
+                logger.info(f"Feed verificato: {self.items_expected} prodotti")
+            elif self.feed_changed and self.items_expected is None:
+                self.items_expected = self._estimate_items_expected()
+            return True
+        except Exception as e:
+            logger.error(f"Errore durante il recupero del catalogo: {str(e)}")
+            self._discard_download()
+            self._update_sync_record(success=False, error_message=str(e))
             return False
+        finally:
+            # L'attesa del lease di scrittura non è attribuita ad alcuna fase
+            self.metrics.stop()
+    
+    def write(self) -> bool:
+        """
+        Seconda fase dell'importazione: scrive prodotti, modifiche e rimozioni.
+        
+        Le scritture di importazioni diverse sullo stesso database vanno
+        serializzate dal chiamante (vedi job_runner). La copia locale del feed
+        viene eliminata al termine.
+        
+        Returns:
+            bool: True se l'importazione è avvenuta con successo, False altrimenti
+        """
+        try:
+            if self.feed_changed is None and not self.prepare():
+                return False
+            
+            if not self.feed_changed:
+                self._save_fetch_state(changed=False)
+                self._update_sync_record(success=True, status='unchanged')
+                logger.info(f"Feed invariato, importazione {self.sync_record.id} non necessaria")
+                return True
+            
+            return self._import_products()
+        finally:
+            self._discard_download()
+    
+    def _import_products(self) -> bool:
+        """
+        Legge il feed e scrive i prodotti nuovi e modificati.
+        
+        Returns:
+            bool: True se l'importazione è avvenuta con successo, False altrimenti
+        """
+        self.metrics.enter(PHASE_PARSE)
+        if self.streaming and self._parallel_parsing():
+            records = self._iter_parallel_records()
+        elif self.streaming:
+            records = self._normalize(self.iter_catalog())
+        else:
+            products_data = self.fetch_catalog()
+            if not products_data:
+                return False
+            records = self._normalize(products_data)
             
+        writer = BulkProductWriter(self.db, chunk_size=self.chunk_size, metrics=self.metrics)
+        
+        # Elementi del feed già scritti da un tentativo precedente
+        checkpoint = self.sync_record.checkpoint or 0
+        if checkpoint:
+            logger.info(f"Ripresa della sincronizzazione {self.sync_record.id} dall'elemento {checkpoint}")
+        
+        # Contatori (ripartono da quelli salvati in caso di ripresa)
+        stats = {
+            'added': self.sync_record.products_added or 0,
+            'updated': self.sync_record.products_updated or 0,
+            'unchanged': 0,
+            'total': 0
+        }
+        
         try:
-            # Ottieni prodotti esistenti
-            existing_products = {p.id: p for p in self.db.query(Product).all()}
-            logger.info(f"Prodotti esistenti nel database: {len(existing_products)}")
+            # Prodotti e modifiche già riportati nelle statistiche del catalogo
+            self._stats_applied = {'added': stats['added'], 'removed': 0, 'changes': 0}
             
-            # Contatori
-            stats = {
-                'added': 0,
-                'updated': 0,
-                'unchanged': 0,
-                'processed_ids': set()
-            }
+            # Prodotti del blocco corrente, confrontati con il database a fine blocco
+            pending = []
+            self._report_progress(PHASE_PARSE)
             
             # Elaborazione prodotti
-            for product_data in products_data:
-                product_data = self._preprocess_product_data(product_data)
-                product_id = product_data.get("id")
+            for record in records:
+                stats['total'] += 1
                 
-                if not product_id:
-                    logger.warning(f"Prodotto senza ID trovato: {product_data}")
+                if stats['total'] <= checkpoint:
+                    # Già scritto insieme al suo ID in import_feed_ids
                     continue
                 
-                stats['processed_ids'].add(product_id)
-                
-                # Aggiorna o aggiungi prodotto
-                if product_id in existing_products:
-                    changes = self._update_product(existing_products[product_id], product_data)
-                    stats['updated' if changes else 'unchanged'] += 1
+                if record.id:
+                    pending.append(record)
                 else:
-                    self._add_product(product_data)
-                    stats['added'] += 1
+                    logger.warning(f"Prodotto senza ID trovato: {record.payload_json.decode('utf-8')}")
+                
+                # Fine blocco: scrivi e registra il punto di ripresa
+                if stats['total'] % self.chunk_size == 0:
+                    self._commit_chunk(pending, writer, stats)
+                    pending = []
+                    self.metrics.enter(PHASE_PARSE)
+            
+            # Totale esatto (senza verifica preliminare era una stima)
+            self.items_expected = stats['total']
+            self.metrics.enter(PHASE_DIFF)
+            self._report_progress(PHASE_DIFF, stats['total'])
+            self._write_products(pending, writer, stats)
+            self.metrics.enter(PHASE_WRITE)
+            self._report_progress(PHASE_WRITE, stats['total'])
+            writer.flush()
+            
+            if stats['total'] == 0:
+                raise ValueError("Il feed non contiene prodotti")
+            
+            if self.streaming:
+                logger.info(f"Catalogo letto in streaming. {stats['total']} prodotti trovati.")
             
             # Gestione prodotti rimossi
-            removed_ids = set(existing_products.keys()) - stats['processed_ids']
-            products_removed = len(removed_ids)
+            self.metrics.enter(PHASE_REMOVE)
+            products_removed = self._mark_removed_products(writer, stats)
             
             # Commit modifiche
+            self._apply_written_stats(writer, stats)
+            self.metrics.enter(PHASE_INDEX)
+            written_ids = writer.pop_written_ids()
+            update_search_index(self.db, written_ids)
+            update_taxonomy(self.db, written_ids)
+            self.metrics.enter(PHASE_COMMIT)
             self.db.commit()
+            self.metrics.stop()
             
             # Aggiorna record sincronizzazione
+            self._save_fetch_state(changed=True)
+            self._record_counters(writer, stats)
             self._update_sync_record(
                 success=True,
-                products_total=len(products_data),
+                products_total=stats['total'],
                 products_added=stats['added'],
                 products_updated=stats['updated'],
-                products_removed=products_removed
+                products_removed=products_removed,
+                checkpoint=stats['total']
             )
+            self._refresh_intent_router()
+            self._update_similarity()
             
             logger.info(
                 f"Importazione completata. "
@@ -161,139 +441,517 @@ class CatalogImporter:
         except Exception as e:
             logger.error(f"Errore durante l'importazione: {str(e)}")
             self.db.rollback()
+            self._record_counters(writer, stats)
             self._update_sync_record(success=False, error_message=str(e))
             return False
     
-    def _preprocess_product_data(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _refresh_intent_router(self):
+        """Ricompila il router delle domande con le categorie del catalogo appena importato."""
+        try:
+            refresh_intent_router(self.db)
+        except Exception as e:
+            logger.error(f"Errore nella compilazione del router degli intenti: {str(e)}")
+    
+    def _update_similarity(self):
+        """Ricalcola i prodotti simili dei prodotti cambiati; un errore non annulla l'importazione."""
+        try:
+            update_similarity(self.db)
+            self.db.commit()
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornamento dell'indice dei prodotti simili: {str(e)}")
+            self.db.rollback()
+    
+    def _normalize(self, products_data: Iterable[Dict[str, Any]]) -> Iterator[ProductRecord]:
         """
-        Preelabora i dati del prodotto prima dell'importazione.
+        Normalizza in sequenza i prodotti letti dal feed.
         
         Args:
-            product_data (Dict[str, Any]): Dati grezzi del prodotto
+            products_data (Iterable[Dict[str, Any]]): Dati grezzi dei prodotti
             
+        Yields:
+            ProductRecord: Prodotti normalizzati, nell'ordine del feed
+        """
+        for product_data in products_data:
+            self.metrics.enter(PHASE_PREPROCESS)
+            record = PRODUCT_NORMALIZER.normalize(product_data)
+            self.metrics.enter(PHASE_PARSE)
+            yield record
+    
+    def _parallel_parsing(self) -> bool:
+        """Indica se il feed va letto con più processi (vedi feed_shards)."""
+        if self.parse_workers < 2:
+            return False
+        _, encoding = self._feed_file()
+        if not supports_sharding(encoding):
+            logger.info(f"Codifica {encoding} non frazionabile: lettura sequenziale del feed")
+            return False
+        return True
+    
+    def _map_feed(self, func) -> Iterator[List[Any]]:
+        """Applica func ai prodotti del feed su parse_workers processi, un frammento alla volta."""
+        path, encoding = self._feed_file()
+        logger.info(f"Lettura catalogo in streaming da file: {path} ({self.parse_workers} processi)")
+        return map_feed_shards(path, encoding, func, self.parse_workers)
+    
+    def _iter_parallel_records(self) -> Iterator[ProductRecord]:
+        """
+        Legge il feed con più processi, che decodificano e normalizzano i prodotti.
+        
+        Il tempo di attesa dei frammenti è attribuito alla fase di lettura;
+        il tempo CPU dei processi di lavoro non compare nelle metriche.
+        
+        Yields:
+            ProductRecord: Prodotti normalizzati, nell'ordine del feed
+        """
+        for records in self._map_feed(PRODUCT_NORMALIZER.normalize):
+            yield from records
+    
+    def _record_counters(self, writer: BulkProductWriter, stats: Dict[str, Any]):
+        """Riporta nelle metriche i contatori dell'importazione."""
+        self.metrics.items_total = stats['total']
+        self.metrics.rows_written = writer.rows_written
+        self.metrics.changes_written = writer.changes_written
+    
+    def _feed_file(self) -> tuple:
+        """
+        Restituisce il file da cui leggere il feed, scaricandolo se necessario.
+        
         Returns:
-            Dict[str, Any]: Dati preprocessati
+            tuple: Percorso del file e relativa codifica
         """
-        return {
-            key: json.dumps(value) if isinstance(value, list) 
-            else (value if value is not None else '')
-            for key, value in product_data.items()
-        }
+        if not self.source_url:
+            return self.json_file, 'utf-8'
+        if self._download_path is None:
+            self._download_feed(conditional=False)
+        return self._download_path, self._download_encoding
     
-    def _add_product(self, product_data: Dict[str, Any]) -> Product:
+    def _download_feed(self, conditional: bool) -> bool:
         """
-        Aggiunge un nuovo prodotto al database.
+        Scarica il feed remoto in un file temporaneo calcolandone l'impronta.
         
         Args:
-            product_data (Dict[str, Any]): Dati del prodotto
+            conditional (bool): Se True usa i validatori salvati e confronta
+                                l'impronta con quella dell'ultimo feed importato
+        
+        Returns:
+            bool: False se il feed risulta invariato, True altrimenti
+        """
+        state = self._get_fetch_state() if conditional else None
+        headers = {}
+        if state is not None:
+            if state.etag:
+                headers['If-None-Match'] = state.etag
+            if state.last_modified:
+                headers['If-Modified-Since'] = state.last_modified
+        
+        logger.info(f"Recupero catalogo da URL: {self.source_url}")
+        with requests.get(self.source_url, headers=headers, timeout=30, stream=True) as response:
+            if response.status_code == 304:
+                logger.info("Feed non modificato (HTTP 304)")
+                return False
+            response.raise_for_status()
+            
+            digest = hashlib.sha256()
+            fd, path = tempfile.mkstemp(prefix='feedwise-', suffix='.json')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        digest.update(chunk)
+                        self.metrics.bytes_downloaded += len(chunk)
+                        f.write(chunk)
+            except Exception:
+                os.remove(path)
+                raise
+            
+            self._discard_download()
+            self._download_path = path
+            self._download_encoding = response.encoding or 'utf-8'
+            self._fetch_validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_digest': digest.hexdigest()
+            }
+        
+        if state is not None and state.content_digest == self._fetch_validators['content_digest']:
+            logger.info("Feed scaricato identico all'ultimo importato")
+            return False
+        return True
+    
+    def _discard_download(self):
+        """Elimina la copia locale del feed remoto, se presente."""
+        if self._download_path and os.path.exists(self._download_path):
+            os.remove(self._download_path)
+        self._download_path = None
+    
+    def _get_fetch_state(self) -> Optional[FeedFetchState]:
+        """Restituisce lo stato dell'ultimo recupero del feed remoto."""
+        return self.db.query(FeedFetchState).filter(
+            FeedFetchState.source_url == self.source_url
+        ).first()
+    
+    def _save_fetch_state(self, changed: bool):
+        """
+        Memorizza i validatori dell'ultimo recupero del feed remoto.
+        
+        Va chiamato solo quando il contenuto è stato importato (o era già
+        importato), così che un'importazione fallita venga ritentata.
+        Il commit avviene insieme all'aggiornamento del record di sincronizzazione.
+        
+        Args:
+            changed (bool): True se il contenuto è stato appena importato
+        """
+        if not self.source_url:
+            return
+        
+        now = datetime.now(timezone.utc)
+        state = self._get_fetch_state()
+        if state is None:
+            state = FeedFetchState(source_url=self.source_url)
+            self.db.add(state)
+        
+        if self._fetch_validators:
+            state.etag = self._fetch_validators['etag']
+            state.last_modified = self._fetch_validators['last_modified']
+            state.content_digest = self._fetch_validators['content_digest']
+        state.checked_at = now
+        if changed:
+            state.changed_at = now
+    
+    def _product_row(self, record: ProductRecord, synced_at: datetime) -> Dict[str, Any]:
+        """
+        Converte un prodotto normalizzato nei valori delle colonne.
+        
+        Args:
+            record (ProductRecord): Prodotto normalizzato
+            synced_at (datetime): Istante di sincronizzazione
+            
+        Returns:
+            Dict[str, Any]: Valori delle colonne per l'upsert
+        """
+        row = dict(zip(TRACKED_FIELDS, record.values))
+        row.update(
+            id=record.id,
+            item_group_id=record.item_group_id,
+            created_at=synced_at,
+            updated_at=synced_at,
+            last_synced=synced_at,
+            removed_at=None,
+            source_id=self.source_id,
+            content_hash=record.content_hash
+        )
+        return row
+    
+    def _commit_chunk(self, pending: List[tuple], writer: BulkProductWriter, stats: Dict[str, Any]):
+        """
+        Scrive il blocco corrente e salva il punto di ripresa sul CatalogSync.
+        
+        Il commit per blocco rilascia il lock di scrittura di SQLite tra un
+        blocco e l'altro e rende il lavoro svolto recuperabile con resume().
+        
+        Args:
+            pending (List[ProductRecord]): Prodotti normalizzati del blocco
+            writer (BulkProductWriter): Scrittore a blocchi dell'importazione
+            stats (Dict[str, Any]): Contatori dell'importazione
+        """
+        self.metrics.enter(PHASE_DIFF)
+        self._report_progress(PHASE_DIFF, stats['total'])
+        self._write_products(pending, writer, stats)
+        self.metrics.enter(PHASE_WRITE)
+        self._report_progress(PHASE_WRITE, stats['total'])
+        writer.flush()
+        
+        self.sync_record.checkpoint = stats['total']
+        self.sync_record.products_added = stats['added']
+        self.sync_record.products_updated = stats['updated']
+        self._apply_written_stats(writer, stats)
+        self.metrics.enter(PHASE_INDEX)
+        written_ids = writer.pop_written_ids()
+        update_search_index(self.db, written_ids)
+        update_taxonomy(self.db, written_ids)
+        self.metrics.enter(PHASE_COMMIT)
+        self.db.commit()
+        if written_ids:
+            self._products_committed = True
+        logger.debug(f"Blocco completato: {stats['total']} elementi del feed elaborati")
+        self._report_progress(PHASE_PARSE, stats['total'])
+    
+    def _estimate_items_expected(self) -> Optional[int]:
+        """
+        Stima i prodotti del feed con quelli dell'ultima sincronizzazione riuscita della stessa fonte.
+        
+        Returns:
+            Optional[int]: Prodotti attesi, o None se la fonte non è mai stata importata
+        """
+        query = self.db.query(CatalogSync.products_total).filter(
+            CatalogSync.status == 'completed',
+            CatalogSync.products_total > 0,
+            CatalogSync.id != self.sync_record.id
+        )
+        if self.source_id is not None:
+            query = query.filter(CatalogSync.source_id == self.source_id)
+        else:
+            query = query.filter(CatalogSync.source_url == self.sync_record.source_url)
+        
+        previous = query.order_by(CatalogSync.completed_at.desc()).first()
+        if previous is None:
+            return None
+        logger.info(f"Prodotti attesi stimati dall'ultima sincronizzazione: {previous.products_total}")
+        return previous.products_total
+    
+    def _report_progress(self, phase: str, items_processed: int = 0):
+        """
+        Notifica l'avanzamento al callback, se presente.
+        
+        Un errore del callback non interrompe l'importazione.
+        
+        Args:
+            phase (str): Fase corrente (PHASE_FETCH, PHASE_PARSE, PHASE_DIFF, PHASE_WRITE)
+            items_processed (int, optional): Elementi del feed elaborati finora
+        """
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(phase, items_processed, self.items_expected)
+        except Exception as e:
+            logger.warning(f"Errore nel callback di avanzamento: {str(e)}")
+    
+    def _write_products(self, pending: List[ProductRecord], writer: BulkProductWriter, stats: Dict[str, Any]):
+        """
+        Classifica i prodotti di un blocco e accoda le relative scritture.
+        
+        Impronta e stato di rimozione dei prodotti esistenti vengono letti con
+        poche query IN sugli ID del blocco, senza caricare l'intero catalogo.
+        I prodotti nuovi vengono inseriti, quelli invariati solo marcati come
+        sincronizzati; quelli con impronta diversa o rimossi in precedenza
+        passano al confronto campo per campo. Le righe delle colonne vengono
+        costruite solo per i prodotti da scrivere.
+        
+        Args:
+            pending (List[ProductRecord]): Prodotti normalizzati del blocco
+            writer (BulkProductWriter): Scrittore a blocchi dell'importazione
+            stats (Dict[str, Any]): Contatori dell'importazione
+        """
+        if not pending:
+            return
+        
+        existing = {}
+        for start in range(0, len(pending), _LOOKUP_BATCH_SIZE):
+            batch_ids = [record.id for record in pending[start:start + _LOOKUP_BATCH_SIZE]]
+            rows = self.db.execute(
+                select(Product.id, Product.content_hash, Product.removed_at).where(Product.id.in_(batch_ids))
+            )
+            for product_id, content_hash, removed_at in rows:
+                existing[product_id] = (content_hash, removed_at)
+        
+        synced_at = datetime.now(timezone.utc)
+        candidates = []
+        for record in pending:
+            product_id = record.id
+            writer.add_feed_id(self.sync_record.id, product_id)
+            
+            current = existing.get(product_id)
+            if current is None:
+                writer.upsert(self._product_row(record, synced_at), payload=record.payload_json)
+                stats['added'] += 1
+            elif current[1] is None and current[0] == record.content_hash:
+                writer.touch(product_id, synced_at, self.source_id)
+                stats['unchanged'] += 1
+            else:
+                candidates.append((record, current[1] is not None))
+            # Un ID ripetuto nel blocco viene confrontato con la riga appena accodata
+            existing[product_id] = (record.content_hash, None)
+        
+        self._apply_changed_products(candidates, writer, stats, synced_at)
+    
+    def _mark_removed_products(self, writer: BulkProductWriter, stats: Dict[str, Any]) -> int:
+        """
+        Marca come rimossi i prodotti assenti dal feed con operazioni su insiemi.
+        
+        I prodotti attivi della stessa fonte il cui ID non compare in
+        import_feed_ids per questa sincronizzazione ricevono removed_at; per ciascuno viene registrata una
+        modifica di stato con un unico INSERT ... SELECT. Le righe di appoggio
+        vengono poi eliminate.
+        
+        Args:
+            writer (BulkProductWriter): Scrittore a blocchi dell'importazione
+            stats (Dict[str, Any]): Contatori dell'importazione
             
         Returns:
-            Product: Istanza del nuovo prodotto
-        """
-        # Conversione valori numerici
-        price = float(product_data.get("price", 0)) if product_data.get("price") else None
-        sale_price = float(product_data.get("sale_price", 0)) if product_data.get("sale_price") else None
-        
-        # Crea il prodotto con tutti i campi disponibili
-        product = Product(
-            id=product_data.get("id"),
-            item_group_id=product_data.get("item_group_id", ''),
-            title=product_data.get("title", ''),
-            description=product_data.get("description", ''),
-            price=price,
-            sale_price=sale_price,
-            brand=product_data.get("brand", ''),
-            condition=product_data.get("condition", ''),
-            availability=product_data.get("availability", ''),
-            color=product_data.get("color", ''),
-            material=product_data.get("material", ''),
-            mpn=product_data.get("mpn", ''),
-            availability_date=product_data.get("availability_date", ''),
-            google_product_category=product_data.get("google_product_category", ''),
-            product_type=product_data.get("product_type", ''),
-            link=product_data.get("link", ''),
-            mobile_link=product_data.get("mobile_link", ''),
-            image_link=product_data.get("image_link", ''),
-            additional_image_links=product_data.get("additional_image_links", ''),
-            custom_label_1=product_data.get("custom_label_1", ''),
-            custom_label_2=product_data.get("custom_label_2", ''),
-            custom_label_3=product_data.get("custom_label_3", ''),
-            custom_label_4=product_data.get("custom_label_4", ''),
-            raw_data=product_data,
-            last_synced=datetime.now(timezone.utc)
+            int: Numero di prodotti marcati come rimossi
+        """
+        sync_id = self.sync_record.id
+        now = datetime.now(timezone.utc)
+        
+        missing = (
+            Product.removed_at.is_(None),
+            Product.source_id == self.source_id if self.source_id is not None else Product.source_id.is_(None),
+            ~select(ImportFeedId.product_id).where(
+                ImportFeedId.sync_id == sync_id,
+                ImportFeedId.product_id == Product.id
+            ).exists()
+        )
+        
+        changes = self.db.execute(
+            insert(ProductChange).from_select(
+                ['product_id', 'sync_id', 'field_name', 'old_value', 'new_value', 'changed_at'],
+                select(
+                    Product.id,
+                    literal(sync_id),
+                    literal(STATUS_FIELD),
+                    literal(STATUS_ACTIVE),
+                    literal(STATUS_REMOVED),
+                    literal(now, DateTime)
+                ).where(*missing)
+            )
+        )
+        removed = self.db.execute(
+            update(Product).where(*missing).values(removed_at=now).execution_options(synchronize_session=False)
+        ).rowcount
+        
+        remove_removed_products(self.db, now)
+        remove_removed_from_taxonomy(self.db, now)
+        self.db.execute(delete(ImportFeedId).where(ImportFeedId.sync_id == sync_id))
+        
+        writer.changes_written += changes.rowcount
+        stats['removed'] = removed
+        if removed:
+            logger.info(f"Prodotti non più presenti nel feed marcati come rimossi: {removed}")
+        return removed
+    
+    def _apply_written_stats(self, writer: BulkProductWriter, stats: Dict[str, Any]):
+        """
+        Riporta nelle statistiche del catalogo quanto scritto dall'ultimo commit.
+        
+        Args:
+            writer (BulkProductWriter): Scrittore a blocchi dell'importazione
+            stats (Dict[str, Any]): Contatori dell'importazione
+        """
+        removed = stats.get('removed', 0)
+        apply_stats_delta(
+            self.db,
+            products=(stats['added'] - self._stats_applied['added']) - (removed - self._stats_applied['removed']),
+            changes=writer.changes_written - self._stats_applied['changes']
         )
+        self._stats_applied = {'added': stats['added'], 'removed': removed, 'changes': writer.changes_written}
+    
+    def _apply_changed_products(self, candidates: List[tuple], writer: BulkProductWriter, stats: Dict[str, Any],
+                                synced_at: datetime):
+        """
+        Confronta campo per campo i prodotti la cui impronta è cambiata.
+        
+        I valori correnti vengono letti con poche query IN invece di caricare
+        l'intero catalogo. Anche i prodotti senza differenze nei campi tracciati
+        vengono riscritti, per aggiornarne l'impronta. I prodotti rimossi in
+        precedenza e ricomparsi nel feed tornano attivi e contano come aggiunti.
+        
+        Args:
+            candidates (List[tuple]): Coppie (prodotto normalizzato, ricomparso) da confrontare
+            writer (BulkProductWriter): Scrittore a blocchi dell'importazione
+            stats (Dict[str, Any]): Contatori dell'importazione
+            synced_at (datetime): Istante di sincronizzazione del blocco
+        """
+        if not candidates:
+            return
         
-        self.db.add(product)
-        return product
+        # Le righe da confrontare possono essere ancora nei buffer dello scrittore
+        writer.flush()
+        
+        columns = [Product.id] + [getattr(Product, field) for field in TRACKED_FIELDS]
+        existing_rows = {}
+        for start in range(0, len(candidates), _LOOKUP_BATCH_SIZE):
+            batch_ids = [record.id for record, _ in candidates[start:start + _LOOKUP_BATCH_SIZE]]
+            for existing in self.db.execute(select(*columns).where(Product.id.in_(batch_ids))):
+                existing_rows[existing.id] = existing
+        
+        for record, restored in candidates:
+            row = self._product_row(record, synced_at)
+            changes = self._diff_product(existing_rows[record.id], record, row)
+            # Anche senza modifiche ai campi tracciati l'impronta è cambiata: il payload va riscritto
+            writer.upsert(row, payload=record.payload_json)
+            if restored:
+                changes.append(self._change_row(record.id, STATUS_FIELD, STATUS_REMOVED, STATUS_ACTIVE, synced_at))
+                writer.add_changes(changes)
+                stats['added'] += 1
+            elif changes:
+                writer.add_changes(changes)
+                stats['updated'] += 1
+            else:
+                stats['unchanged'] += 1
     
-    def _update_product(self, product: Product, product_data: Dict[str, Any]) -> List[ProductChange]:
+    def _diff_product(self, existing, record: ProductRecord, row: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
-        Aggiorna un prodotto esistente e registra le modifiche.
+        Confronta un prodotto esistente con i nuovi dati e prepara le modifiche.
+        
+        I campi assenti dal feed mantengono il valore attuale: la riga viene
+        aggiornata di conseguenza.
         
         Args:
-            product (Product): Prodotto esistente da aggiornare
-            product_data (Dict[str, Any]): Nuovi dati del prodotto
+            existing: Riga con i valori correnti dei campi tracciati
+            record (ProductRecord): Prodotto normalizzato dal feed
+            row (Dict[str, Any]): Valori delle colonne calcolati dal record
             
         Returns:
-            List[ProductChange]: Lista delle modifiche effettuate
+            List[Dict[str, Any]]: Valori delle righe ProductChange da inserire
         """
         changes = []
-        update_fields = {
-            'title': str,
-            'description': str,
-            'price': lambda x: float(x) if x else None,
-            'sale_price': lambda x: float(x) if x else None,
-            'brand': str,
-            'condition': str,
-            'availability': str,
-            'color': str,
-            'material': str,
-            'mpn': str,
-            'availability_date': str,
-            'google_product_category': str,
-            'product_type': str,
-            'link': str,
-            'mobile_link': str,
-            'image_link': str,
-            'additional_image_links': str,
-            'custom_label_1': str,
-            'custom_label_2': str,
-            'custom_label_3': str,
-            'custom_label_4': str
-        }
         
-        for field, converter in update_fields.items():
-            if field in product_data:
-                new_value = converter(product_data[field])
-                old_value = getattr(product, field)
-                
-                if new_value != old_value:
-                    setattr(product, field, new_value)
-                    changes.append(
-                        ProductChange(
-                            product_id=product.id,
-                            sync_id=self.sync_record.id,
-                            field_name=field,
-                            old_value=str(old_value),
-                            new_value=str(new_value),
-                            changed_at=datetime.now(timezone.utc)
-                        )
-                    )
-        
-        if changes:
-            self.db.add_all(changes)
-        
-        product.last_synced = datetime.now(timezone.utc)
+        for index, field in enumerate(TRACKED_FIELDS):
+            old_value = getattr(existing, field)
+            
+            if not record.has(index):
+                row[field] = old_value
+                continue
+            
+            new_value = record.values[index]
+            if new_value != old_value:
+                changes.append(self._change_row(row['id'], field, old_value, new_value, row['last_synced']))
+        
         return changes
     
+    def _change_row(self, product_id: str, field: str, old_value, new_value, changed_at: datetime) -> Dict[str, Any]:
+        """
+        Prepara i valori di una riga ProductChange della sincronizzazione corrente.
+        
+        Args:
+            product_id (str): ID del prodotto
+            field (str): Nome del campo modificato
+            old_value: Valore precedente
+            new_value: Nuovo valore
+            changed_at (datetime): Istante della modifica
+            
+        Returns:
+            Dict[str, Any]: Valori delle colonne della modifica
+        """
+        return {
+            'product_id': product_id,
+            'sync_id': self.sync_record.id,
+            'field_name': field,
+            'old_value': str(old_value),
+            'new_value': str(new_value),
+            'changed_at': changed_at
+        }
+    
     def _update_sync_record(self, **kwargs):
         """
-        Aggiorna il record di sincronizzazione con i risultati.
+        Aggiorna il record di sincronizzazione con i risultati e le metriche.
+        
+        La versione del catalogo avanza solo se la sincronizzazione ha scritto
+        prodotti: con aggiunte, modifiche o rimozioni se riuscita, con almeno
+        un blocco di prodotti confermato se fallita. Una sincronizzazione senza
+        modifiche (ad esempio un feed invariato) non invalida le cache.
         
         Args:
             **kwargs: Coppie chiave-valore da aggiornare
         """
+        if 'success' in kwargs and 'status' not in kwargs:
+            kwargs['status'] = 'completed' if kwargs['success'] else 'failed'
         for key, value in kwargs.items():
             setattr(self.sync_record, key, value)
+        self.sync_record.metrics = self.metrics.to_dict()
         self.sync_record.completed_at = datetime.now(timezone.utc)
+        if kwargs.get('success'):
+            catalog_changed = any(kwargs.get(key) for key in ('products_added', 'products_updated', 'products_removed'))
+        else:
+            catalog_changed = self._products_committed
+        apply_stats_delta(self.db, last_sync=self.sync_record, catalog_changed=catalog_changed)
         self.db.commit()
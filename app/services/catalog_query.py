@@ -4,11 +4,17 @@ Versione semplificata che sarà implementata in futuro con NLP più avanzato.
 """
 import logging
 from typing import Dict, List, Any, Optional
-from sqlalchemy import func, or_, desc
+from sqlalchemy import func, or_, desc, select
 from datetime import datetime, timedelta
 
 from app.models.database import get_db
 from app.models.models import Product, CatalogSync, ProductChange
+from app.services.catalog_stats import get_catalog_version
+from app.services.intent_router import get_intent_router
+from app.services.query_cache import get_query_cache
+from app.services.search_index import search_products
+from app.services.similarity import get_neighbor_products
+from app.services.taxonomy import TAXONOMY_PRODUCT_TYPE, count_categories, find_category_nodes, get_category_product_ids
 
 # Logger
 logger = logging.getLogger("catalog_query")
@@ -17,6 +23,10 @@ def execute_query(query_text: str) -> Dict[str, Any]:
     """
     Esegue una query in linguaggio naturale sul catalogo.
     
+    L'intento viene riconosciuto dal router compilato (intent_router) e il
+    risultato conservato nella cache delle query per intento e parametri,
+    fino alla successiva sincronizzazione del catalogo.
+    
     Args:
         query_text: Query in linguaggio naturale
         
@@ -25,60 +35,24 @@ def execute_query(query_text: str) -> Dict[str, Any]:
     """
     logger.info(f"Esecuzione query: {query_text}")
     
-    # Normalizza la query
-    query_text = query_text.lower().strip()
-    
-    # Analisi semplificata dell'intento
-    intent = "unknown"
-    
-    # Controllo per ID prodotto specifico
-    import re
-    product_id_match = re.search(r'\b([A-Za-z0-9]{6,})\b', query_text)
-    
-    if "statistiche" in query_text or "statistiche del catalogo" in query_text:
-        intent = "stats"
-        return get_catalog_stats_response()
-    
-    elif "novità" in query_text or "modifiche recenti" in query_text:
-        intent = "changes"
-        return get_recent_changes_response()
-    
-    elif product_id_match:
-        # Probabile richiesta di informazioni su prodotto specifico
-        product_id = product_id_match.group(1)
-        intent = "product_info"
-        return get_product_info_response(product_id)
-    
-    elif any(keyword in query_text for keyword in ["prezzo", "costo", "economico", "costoso"]):
-        # Query relativa al prezzo
-        intent = "product_price"
-        
-        if "sotto" in query_text or "meno di" in query_text:
-            # Cerca un valore numerico
-            price_match = re.search(r'(\d+)', query_text)
-            if price_match:
-                price_limit = float(price_match.group(1))
-                return get_products_by_price_response(max_price=price_limit)
-        
-        elif "sopra" in query_text or "più di" in query_text:
-            price_match = re.search(r'(\d+)', query_text)
-            if price_match:
-                price_limit = float(price_match.group(1))
-                return get_products_by_price_response(min_price=price_limit)
-                
-        # Fallback: mostra prodotti più economici
-        return get_products_by_price_response(max_price=100, limit=5)
+    try:
+        with get_db() as db:
+            version = get_catalog_version(db)
+            router = get_intent_router(db, version)
+    except Exception as e:
+        logger.error(f"Errore nella lettura della versione del catalogo: {str(e)}")
+        version, router = None, get_intent_router()
     
-    # Ricerca per categoria
-    categories = ["tavolo", "sedia", "mobile", "libreria", "scaffale", "cassettiera"]
-    for category in categories:
-        if category in query_text:
-            intent = "product_category"
-            return get_products_by_category_response(category)
+    intent, params = router.route(query_text)
+    handler = INTENT_HANDLERS[intent]
+    if version is None:
+        return handler(**params)
     
-    # Se non riusciamo a capire l'intento, eseguiamo una ricerca full-text
-    intent = "full_text_search"
-    return get_full_text_search_response(query_text)
+    key = (intent, tuple(sorted(params.items())))
+    return get_query_cache().get_or_compute(
+        intent, key, version, lambda: handler(**params),
+        cacheable=lambda result: 'error' not in result
+    )
     
 def get_product_by_id(product_id: str) -> Optional[Dict[str, Any]]:
     """
@@ -117,10 +91,11 @@ def get_product_by_id(product_id: str) -> Optional[Dict[str, Any]]:
 
 def get_products_by_category(category: str, limit: int = 10) -> List[Dict[str, Any]]:
     """
-    Recupera prodotti per categoria.
+    Recupera prodotti per categoria dall'albero delle categorie.
     
     Args:
-        category: Nome della categoria
+        category: Nome o percorso (anche parziale) della categoria, cercato
+                  sia in product_type sia in google_product_category
         limit: Numero massimo di risultati
         
     Returns:
@@ -128,12 +103,10 @@ def get_products_by_category(category: str, limit: int = 10) -> List[Dict[str, A
     """
     try:
         with get_db() as db:
-            products = db.query(Product).filter(
-                or_(
-                    Product.product_type.ilike(f'%{category}%'),
-                    Product.google_product_category.ilike(f'%{category}%')
-                )
-            ).limit(limit).all()
+            nodes = find_category_nodes(db, category)
+            product_ids = get_category_product_ids(db, [node.id for node in nodes], limit)
+            by_id = {p.id: p for p in db.query(Product).filter(Product.id.in_(product_ids))} if product_ids else {}
+            products = [by_id[product_id] for product_id in product_ids if product_id in by_id]
             
             return [{
                 'id': p.id,
@@ -149,6 +122,34 @@ def get_products_by_category(category: str, limit: int = 10) -> List[Dict[str, A
         logger.error(f"Errore nel recupero dei prodotti per categoria {category}: {str(e)}")
         return []
 
+def get_similar_products_from_index(product_id: str, limit: int = 3) -> List[Dict[str, Any]]:
+    """
+    Recupera i prodotti più simili a un prodotto dall'indice dei simili.
+    
+    Args:
+        product_id: ID del prodotto di riferimento
+        limit: Numero massimo di risultati
+        
+    Returns:
+        Lista di prodotti simili con la similarità, vuota se il prodotto non è nell'indice
+    """
+    try:
+        with get_db() as db:
+            return [{
+                'id': p.id,
+                'title': p.title,
+                'price': p.price,
+                'sale_price': p.sale_price,
+                'brand': p.brand,
+                'availability': p.availability,
+                'image_link': p.image_link,
+                'category': p.product_type or p.google_product_category,
+                'similarity': score
+            } for p, score in get_neighbor_products(db, product_id, limit)]
+    except Exception as e:
+        logger.error(f"Errore nel recupero dei prodotti simili a {product_id}: {str(e)}")
+        return []
+
 def get_catalog_stats() -> Dict[str, Any]:
     """
     Recupera statistiche generali sul catalogo.
@@ -159,20 +160,22 @@ def get_catalog_stats() -> Dict[str, Any]:
     try:
         with get_db() as db:
             # Conteggio prodotti
-            total_products = db.query(func.count(Product.id)).scalar() or 0
+            total_products = db.query(func.count(Product.id)).filter(Product.removed_at.is_(None)).scalar() or 0
             
             # Statistiche sui prezzi
             price_stats = db.query(
                 func.avg(Product.price),
                 func.min(Product.price),
                 func.max(Product.price)
-            ).first()
+            ).filter(Product.removed_at.is_(None)).first()
             
             # Conta marche uniche
-            unique_brands = db.query(func.count(func.distinct(Product.brand))).scalar() or 0
+            unique_brands = db.query(func.count(func.distinct(Product.brand))).filter(
+                Product.removed_at.is_(None)
+            ).scalar() or 0
             
-            # Conta categorie uniche
-            unique_categories = db.query(func.count(func.distinct(Product.product_type))).scalar() or 0
+            # Conta categorie uniche (percorsi product_type dell'albero delle categorie)
+            unique_categories = count_categories(db, TAXONOMY_PRODUCT_TYPE)
             
             # Importazioni recenti
             recent_imports = db.query(CatalogSync).filter(
@@ -183,7 +186,7 @@ def get_catalog_stats() -> Dict[str, Any]:
             top_brands = [r[0] for r in db.query(
                 Product.brand, 
                 func.count(Product.id).label('count')
-            ).group_by(Product.brand).order_by(desc('count')).limit(5).all() if r[0]]
+            ).filter(Product.removed_at.is_(None)).group_by(Product.brand).order_by(desc('count')).limit(5).all() if r[0]]
             
             return {
                 'total_products': total_products,
@@ -215,6 +218,93 @@ def get_catalog_stats() -> Dict[str, Any]:
             'unique_categories': 0
         }
 
+def get_changes(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    product_ids: Optional[List[str]] = None,
+    fields: Optional[List[str]] = None,
+    limit: Optional[int] = 10
+) -> List[Dict[str, Any]]:
+    """
+    Recupera lo storico delle modifiche raggruppato per prodotto.
+    
+    I prodotti sono ordinati per numero di modifiche decrescente; per ognuno
+    vengono restituite tutte le modifiche che soddisfano i filtri, dalla più
+    recente. Prodotti, conteggi e modifiche sono letti con un'unica query.
+    
+    Args:
+        since: Includi solo le modifiche a partire da questa data
+        until: Includi solo le modifiche precedenti a questa data
+        product_ids: Limita ai prodotti indicati
+        fields: Limita ai campi indicati (es. ['price', 'availability'])
+        limit: Numero massimo di prodotti (None per nessun limite)
+        
+    Returns:
+        Lista di prodotti con le rispettive modifiche
+    """
+    filters = []
+    if since is not None:
+        filters.append(ProductChange.changed_at >= since)
+    if until is not None:
+        filters.append(ProductChange.changed_at < until)
+    if product_ids:
+        filters.append(ProductChange.product_id.in_(product_ids))
+    if fields:
+        filters.append(ProductChange.field_name.in_(fields))
+    
+    # Prodotti più modificati nel periodo
+    top_products = select(
+        ProductChange.product_id,
+        func.count(ProductChange.id).label('change_count')
+    ).where(*filters).group_by(
+        ProductChange.product_id
+    ).order_by(
+        desc('change_count'), ProductChange.product_id
+    )
+    if limit is not None:
+        top_products = top_products.limit(limit)
+    top_products = top_products.subquery()
+    
+    # Modifiche dei prodotti selezionati, già ordinate per gruppo
+    stmt = select(
+        top_products.c.product_id,
+        top_products.c.change_count,
+        Product.title,
+        ProductChange.field_name,
+        ProductChange.old_value,
+        ProductChange.new_value,
+        ProductChange.changed_at
+    ).join(
+        Product, Product.id == top_products.c.product_id
+    ).join(
+        ProductChange, ProductChange.product_id == top_products.c.product_id
+    ).where(*filters).order_by(
+        top_products.c.change_count.desc(),
+        top_products.c.product_id,
+        ProductChange.changed_at.desc()
+    )
+    
+    with get_db() as db:
+        rows = db.execute(stmt).all()
+    
+    changes_list = []
+    for row in rows:
+        if not changes_list or changes_list[-1]['id'] != row.product_id:
+            changes_list.append({
+                'id': row.product_id,
+                'title': row.title,
+                'change_count': row.change_count,
+                'changes': []
+            })
+        changes_list[-1]['changes'].append({
+            'field': row.field_name,
+            'old_value': row.old_value,
+            'new_value': row.new_value,
+            'date': row.changed_at.strftime('%Y-%m-%d %H:%M') if row.changed_at else None
+        })
+    
+    return changes_list
+
 # Funzioni di risposta per vari tipi di query
 
 def get_product_info_response(product_id: str) -> Dict[str, Any]:
@@ -270,7 +360,7 @@ def get_products_by_price_response(min_price: float = None, max_price: float = N
     """
     try:
         with get_db() as db:
-            query = db.query(Product)
+            query = db.query(Product).filter(Product.removed_at.is_(None))
             
             if min_price is not None:
                 query = query.filter(Product.price >= min_price)
@@ -332,56 +422,16 @@ def get_recent_changes_response() -> Dict[str, Any]:
         Dizionario con risultato della query
     """
     try:
-        with get_db() as db:
-            # Trova le modifiche degli ultimi 7 giorni
-            one_week_ago = datetime.now() - timedelta(days=7)
-            
-            # Ottiene i prodotti modificati raggruppati
-            product_changes = db.query(
-                ProductChange.product_id, 
-                func.count(ProductChange.id).label('change_count')
-            ).filter(
-                ProductChange.changed_at >= one_week_ago
-            ).group_by(
-                ProductChange.product_id
-            ).order_by(
-                desc('change_count')
-            ).limit(10).all()
-            
-            changes_list = []
-            
-            for product_id, _ in product_changes:
-                product = db.query(Product).filter(Product.id == product_id).first()
-                
-                if not product:
-                    continue
-                
-                changes = db.query(ProductChange).filter(
-                    ProductChange.product_id == product_id,
-                    ProductChange.changed_at >= one_week_ago
-                ).order_by(
-                    desc(ProductChange.changed_at)
-                ).all()
-                
-                changes_data = [{
-                    'field': c.field_name,
-                    'old_value': c.old_value,
-                    'new_value': c.new_value,
-                    'date': c.changed_at.strftime('%Y-%m-%d %H:%M')
-                } for c in changes]
-                
-                changes_list.append({
-                    'id': product.id,
-                    'title': product.title,
-                    'changes': changes_data
-                })
-            
-            return {
-                'success': len(changes_list) > 0,
-                'intent': 'changes',
-                'result_type': 'changes',
-                'changes': changes_list
-            }
+        # Modifiche degli ultimi 7 giorni per i 10 prodotti più modificati
+        one_week_ago = datetime.now() - timedelta(days=7)
+        changes_list = get_changes(since=one_week_ago, limit=10)
+        
+        return {
+            'success': len(changes_list) > 0,
+            'intent': 'changes',
+            'result_type': 'changes',
+            'changes': changes_list
+        }
     except Exception as e:
         logger.error(f"Errore nel recupero delle modifiche recenti: {str(e)}")
         return {
@@ -403,25 +453,27 @@ def get_full_text_search_response(query_text: str) -> Dict[str, Any]:
         Dizionario con risultato della query
     """
     try:
-        terms = query_text.split()
-        
         with get_db() as db:
-            # Ricerca semplice
-            query = db.query(Product)
+            # Ricerca sull'indice full-text, ordinata per rilevanza
+            products = search_products(db, query_text, limit=10)
             
-            # Filtra per ogni termine
-            for term in terms:
-                if len(term) >= 3:  # ignora termini troppo brevi
-                    query = query.filter(
-                        or_(
-                            Product.title.ilike(f'%{term}%'),
-                            Product.description.ilike(f'%{term}%'),
-                            Product.brand.ilike(f'%{term}%'),
-                            Product.product_type.ilike(f'%{term}%')
+            if products is None:
+                # Indice non disponibile: ricerca semplice con LIKE
+                query = db.query(Product).filter(Product.removed_at.is_(None))
+                
+                # Filtra per ogni termine
+                for term in query_text.split():
+                    if len(term) >= 3:  # ignora termini troppo brevi
+                        query = query.filter(
+                            or_(
+                                Product.title.ilike(f'%{term}%'),
+                                Product.description.ilike(f'%{term}%'),
+                                Product.brand.ilike(f'%{term}%'),
+                                Product.product_type.ilike(f'%{term}%')
+                            )
                         )
-                    )
-            
-            products = query.limit(10).all()
+                
+                products = query.limit(10).all()
             
             product_list = [{
                 'id': p.id,
@@ -449,3 +501,13 @@ def get_full_text_search_response(query_text: str) -> Dict[str, Any]:
             'error': str(e),
             'products': []
         }
+
+# Funzioni di risposta per intento (vedi IntentRouter.route)
+INTENT_HANDLERS = {
+    'stats': get_catalog_stats_response,
+    'changes': get_recent_changes_response,
+    'product_info': get_product_info_response,
+    'product_price': get_products_by_price_response,
+    'product_category': get_products_by_category_response,
+    'full_text_search': get_full_text_search_response
+}
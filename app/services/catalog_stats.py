@@ -0,0 +1,127 @@
+"""
+Aggregati del catalogo per la dashboard.
+
+I contatori sono memorizzati in un'unica riga di CatalogStats e aggiornati
+dall'importatore nella stessa transazione delle scritture a cui si
+riferiscono, così che la lettura sia sempre O(1). Se la riga non esiste
+viene ricostruita con i COUNT completi.
+
+La stessa riga contiene la versione del catalogo, incrementata dalle
+sincronizzazioni che scrivono prodotti (aggiunti, modificati o rimossi,
+anche da una sincronizzazione poi fallita): chi conserva risultati
+derivati dal catalogo (la cache delle query) la confronta per sapere se
+sono ancora validi. Una sincronizzazione senza modifiche non la cambia.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.models.models import Product, CatalogSync, ProductChange, CatalogStats
+
+# Logger
+logger = logging.getLogger("catalog_stats")
+
+# ID dell'unica riga di statistiche
+STATS_ROW_ID = 1
+
+def refresh_catalog_stats(db: Session) -> CatalogStats:
+    """
+    Ricalcola da zero le statistiche con scansioni complete delle tabelle.
+    
+    Il commit resta al chiamante.
+    
+    Args:
+        db (Session): Sessione del database
+        
+    Returns:
+        CatalogStats: Riga delle statistiche aggiornata
+    """
+    logger.info("Ricalcolo completo delle statistiche del catalogo")
+    
+    last_sync = db.query(CatalogSync).order_by(CatalogSync.completed_at.desc()).first()
+    
+    stats = db.get(CatalogStats, STATS_ROW_ID)
+    if stats is None:
+        stats = CatalogStats(id=STATS_ROW_ID)
+        db.add(stats)
+    
+    stats.total_products = db.query(func.count(Product.id)).filter(Product.removed_at.is_(None)).scalar() or 0
+    stats.total_syncs = db.query(func.count(CatalogSync.id)).scalar() or 0
+    stats.total_changes = db.query(func.count(ProductChange.id)).scalar() or 0
+    stats.last_sync_id = last_sync.id if last_sync else None
+    stats.last_sync_at = last_sync.completed_at if last_sync else None
+    stats.catalog_version = (stats.catalog_version or 0) + 1
+    db.flush()
+    return stats
+
+def get_catalog_stats_row(db: Session) -> CatalogStats:
+    """
+    Restituisce la riga delle statistiche, creandola se necessario.
+    
+    Args:
+        db (Session): Sessione del database
+        
+    Returns:
+        CatalogStats: Riga delle statistiche
+    """
+    stats = db.get(CatalogStats, STATS_ROW_ID)
+    if stats is None:
+        stats = refresh_catalog_stats(db)
+        db.commit()
+    return stats
+
+def get_catalog_version(db: Session) -> int:
+    """
+    Restituisce la versione corrente del catalogo.
+    
+    Args:
+        db (Session): Sessione del database
+        
+    Returns:
+        int: Versione del catalogo (0 se le statistiche non esistono ancora)
+    """
+    version = db.query(CatalogStats.catalog_version).filter(CatalogStats.id == STATS_ROW_ID).scalar()
+    return version or 0
+
+def apply_stats_delta(db: Session, products: int = 0, syncs: int = 0, changes: int = 0,
+                      last_sync: Optional[CatalogSync] = None, catalog_changed: bool = False):
+    """
+    Aggiorna i contatori con incrementi atomici.
+    
+    Va chiamata prima del commit delle scritture a cui si riferisce, così che
+    contatori e dati restino coerenti. Se la riga non esiste ancora viene
+    ricalcolata da zero (includendo già le scritture correnti).
+    
+    La versione del catalogo viene incrementata solo con catalog_changed:
+    una sincronizzazione conclusa senza scritture aggiorna last_sync_* ma non
+    invalida cache e router legati alla versione.
+    
+    Args:
+        db (Session): Sessione del database
+        products (int): Variazione del numero di prodotti
+        syncs (int): Variazione del numero di sincronizzazioni
+        changes (int): Variazione del numero di modifiche registrate
+        last_sync (CatalogSync, optional): Sincronizzazione appena conclusa
+        catalog_changed (bool, optional): Se sono stati confermati prodotti scritti,
+                                          anche da una sincronizzazione poi fallita
+    """
+    table = CatalogStats.__table__
+    values = {
+        'total_products': table.c.total_products + products,
+        'total_syncs': table.c.total_syncs + syncs,
+        'total_changes': table.c.total_changes + changes,
+        'updated_at': datetime.now(timezone.utc)
+    }
+    if last_sync is not None:
+        values['last_sync_id'] = last_sync.id
+        values['last_sync_at'] = last_sync.completed_at
+    if catalog_changed:
+        values['catalog_version'] = func.coalesce(table.c.catalog_version, 0) + 1
+    
+    result = db.execute(update(table).where(table.c.id == STATS_ROW_ID).values(**values))
+    if result.rowcount == 0:
+        db.flush()
+        refresh_catalog_stats(db)
@@ -0,0 +1,115 @@
+"""
+Registro delle fonti dei feed.
+
+Le fonti dichiarate in configurazione (FEED_SOURCES) vengono allineate alla
+tabella feed_sources all'avvio; le importazioni manuali per URL registrano
+la propria fonte alla prima esecuzione. Ogni prodotto e ogni
+sincronizzazione sono associati alla fonte da cui provengono, così che la
+rimozione dei prodotti assenti dal feed riguardi solo quella fonte.
+"""
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.models import FeedSource
+
+# Logger
+logger = logging.getLogger("feed_sources")
+
+def sync_feed_sources(db: Session, sources: Iterable[Dict[str, Any]]) -> List[FeedSource]:
+    """
+    Allinea il registro alle fonti configurate.
+
+    Le fonti sono identificate per nome: URL, schedule e stato vengono
+    aggiornati, quelle nuove inserite. I prodotti senza fonte (importati
+    prima del registro o da file) non vengono assegnati qui: una fonte li
+    acquisisce quando li legge nel proprio feed, e fino ad allora non sono
+    marcati come rimossi dalle sue importazioni.
+
+    Args:
+        db (Session): Sessione del database
+        sources (Iterable[Dict[str, Any]]): Fonti con chiavi name, url e
+                                            opzionalmente schedule ed enabled
+
+    Returns:
+        List[FeedSource]: Fonti configurate, nell'ordine della configurazione
+    """
+    configured = []
+    for entry in sources:
+        source = db.query(FeedSource).filter(FeedSource.name == entry['name']).first()
+        if source is None:
+            # Una fonte già registrata per URL riceve il nome configurato
+            source = db.query(FeedSource).filter(FeedSource.url == entry['url']).first()
+        if source is None:
+            source = FeedSource(name=entry['name'], url=entry['url'])
+            db.add(source)
+            logger.info(f"Registrata la fonte {entry['name']}: {entry['url']}")
+
+        source.name = entry['name']
+        source.url = entry['url']
+        source.schedule = entry.get('schedule')
+        source.enabled = entry.get('enabled', True)
+        configured.append(source)
+    db.commit()
+    return configured
+
+def get_default_source(db: Session) -> Optional[FeedSource]:
+    """
+    Restituisce la fonte predefinita: la prima fonte attiva con schedule.
+
+    Args:
+        db (Session): Sessione del database
+
+    Returns:
+        Optional[FeedSource]: Fonte predefinita o None se il registro è vuoto
+    """
+    return db.query(FeedSource).filter(
+        FeedSource.enabled == True,
+        FeedSource.schedule.isnot(None)
+    ).order_by(FeedSource.id).first()
+
+def get_or_create_url_source(db: Session, url: str) -> FeedSource:
+    """
+    Restituisce la fonte associata a un URL, registrandola se necessario.
+
+    Args:
+        db (Session): Sessione del database
+        url (str): URL del feed
+
+    Returns:
+        FeedSource: Fonte del feed (senza schedule se creata qui)
+    """
+    source = db.query(FeedSource).filter(FeedSource.url == url).first()
+    if source is not None:
+        return source
+
+    try:
+        source = FeedSource(name=url[:255], url=url)
+        db.add(source)
+        db.commit()
+        logger.info(f"Registrata la fonte manuale {url}")
+        return source
+    except IntegrityError:
+        # Registrata nel frattempo da una richiesta concorrente
+        db.rollback()
+        return db.query(FeedSource).filter(FeedSource.url == url).one()
+
+def list_feed_sources(db: Session) -> List[Dict[str, Any]]:
+    """
+    Elenca le fonti registrate.
+
+    Args:
+        db (Session): Sessione del database
+
+    Returns:
+        List[Dict[str, Any]]: Dati delle fonti
+    """
+    return [{
+        'id': source.id,
+        'name': source.name,
+        'url': source.url,
+        'schedule': source.schedule,
+        'enabled': source.enabled
+    } for source in db.query(FeedSource).order_by(FeedSource.id)]
@@ -0,0 +1,129 @@
+"""
+Lease delle importazioni mantenuti nel database.
+
+Un lease è una riga di import_leases rivendicata con un UPDATE condizionale:
+riesce solo se la riga è libera, scaduta o già dello stesso detentore.
+Poiché lo stato è nel database, il lease vale per tutti i processi che lo
+usano (worker gunicorn, scheduler, script). Chi detiene un lease lo rinnova
+prima della scadenza; se il processo termina senza rilasciarlo, il lease
+torna libero dopo LEASE_TTL secondi.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.sqlite import insert
+
+from app.models.database import get_db
+from app.models.models import ImportLease
+
+# Logger
+logger = logging.getLogger("import_lease")
+
+# Lease che serializza le scritture delle importazioni sul database
+WRITE_LEASE = 'write'
+
+# Durata di un lease non rinnovato (secondi)
+LEASE_TTL = 300
+
+# Intervallo tra i rinnovi dei lease detenuti (secondi)
+LEASE_RENEW_INTERVAL = 60
+
+def source_lease_name(key: Tuple) -> str:
+    """
+    Restituisce il nome del lease di una fonte.
+
+    Args:
+        key (Tuple): Chiave della fonte, es. ('source', 3) o ('url', 'https://...')
+
+    Returns:
+        str: Nome del lease, es. 'source:3'
+    """
+    return f"{key[0]}:{key[1]}"
+
+def acquire_lease(name: str, holder: str, ttl: float = LEASE_TTL) -> bool:
+    """
+    Tenta di rivendicare un lease, senza attendere.
+
+    Args:
+        name (str): Nome del lease
+        holder (str): Identificativo del richiedente (ID del job)
+        ttl (float, optional): Secondi di validità del lease
+
+    Returns:
+        bool: True se il lease è ora del richiedente, False se è di altri
+    """
+    table = ImportLease.__table__
+    now = datetime.now(timezone.utc)
+
+    with get_db() as db:
+        db.execute(insert(table).values(name=name).on_conflict_do_nothing())
+        result = db.execute(
+            table.update()
+            .where(table.c.name == name,
+                   or_(table.c.holder.is_(None), table.c.holder == holder, table.c.expires_at < now))
+            .values(holder=holder, acquired_at=now, expires_at=now + timedelta(seconds=ttl))
+        )
+        db.commit()
+        return result.rowcount == 1
+
+def renew_lease(name: str, holder: str, ttl: float = LEASE_TTL) -> bool:
+    """
+    Prolunga un lease detenuto.
+
+    Args:
+        name (str): Nome del lease
+        holder (str): Identificativo del detentore
+        ttl (float, optional): Secondi di validità da ora
+
+    Returns:
+        bool: True se rinnovato, False se il lease non è più del detentore
+    """
+    table = ImportLease.__table__
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+
+    with get_db() as db:
+        result = db.execute(
+            table.update()
+            .where(table.c.name == name, table.c.holder == holder)
+            .values(expires_at=expires_at)
+        )
+        db.commit()
+        return result.rowcount == 1
+
+def release_lease(name: str, holder: str):
+    """
+    Rilascia un lease, se è ancora del detentore indicato.
+
+    Args:
+        name (str): Nome del lease
+        holder (str): Identificativo del detentore
+    """
+    table = ImportLease.__table__
+
+    with get_db() as db:
+        db.execute(
+            table.update()
+            .where(table.c.name == name, table.c.holder == holder)
+            .values(holder=None, acquired_at=None, expires_at=None)
+        )
+        db.commit()
+
+def get_lease_holder(name: str) -> Optional[str]:
+    """
+    Restituisce il detentore di un lease valido.
+
+    Args:
+        name (str): Nome del lease
+
+    Returns:
+        Optional[str]: Identificativo del detentore o None se il lease è libero
+    """
+    with get_db() as db:
+        lease = db.get(ImportLease, name)
+        if lease is None or lease.holder is None:
+            return None
+        if lease.expires_at is None or lease.expires_at < datetime.now(timezone.utc).replace(tzinfo=None):
+            return None
+        return lease.holder
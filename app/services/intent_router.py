@@ -0,0 +1,299 @@
+"""
+Riconoscimento dell'intento delle domande sul catalogo.
+
+Il router viene compilato una volta: le parole chiave degli intenti e il
+vocabolario delle categorie confluiscono in un unico automa di Aho-Corasick,
+che trova tutte le occorrenze in una sola scansione della domanda. Il costo
+del riconoscimento dipende quindi dalla lunghezza della domanda e non dal
+numero di categorie.
+
+Il vocabolario comprende le categorie di base e i segmenti dei percorsi
+product_type e google_product_category dei prodotti attivi ("Arredamento >
+Tavoli da pranzo" contribuisce "arredamento" e "tavoli da pranzo"). Il
+router è legato alla versione del catalogo (CatalogStats.catalog_version):
+l'importatore lo ricompila al termine di ogni importazione riuscita e gli
+altri processi alla prima domanda successiva a un cambio di versione, cioè
+a una sincronizzazione che ha scritto prodotti.
+"""
+import logging
+import re
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import union
+from sqlalchemy.orm import Session
+
+from app.models.models import Product
+from app.services.catalog_stats import get_catalog_version
+
+# Logger
+logger = logging.getLogger("intent_router")
+
+# Categorie riconosciute anche senza prodotti nel database
+BASE_CATEGORIES = ("tavolo", "sedia", "mobile", "libreria", "scaffale", "cassettiera")
+
+# Numero massimo di categorie derivate dal database
+MAX_CATEGORY_TERMS = 20000
+
+# Tipi di parola chiave
+KEYWORD_STATS = 'stats'
+KEYWORD_CHANGES = 'changes'
+KEYWORD_PRICE = 'price'
+KEYWORD_BELOW = 'below'
+KEYWORD_ABOVE = 'above'
+KEYWORD_CATEGORY = 'category'
+
+# Parole chiave degli intenti, riconosciute anche all'interno di altre parole
+INTENT_KEYWORDS = {
+    "statistiche": KEYWORD_STATS,
+    "novità": KEYWORD_CHANGES,
+    "modifiche recenti": KEYWORD_CHANGES,
+    "prezzo": KEYWORD_PRICE,
+    "costo": KEYWORD_PRICE,
+    "economico": KEYWORD_PRICE,
+    "costoso": KEYWORD_PRICE,
+    "sotto": KEYWORD_BELOW,
+    "meno di": KEYWORD_BELOW,
+    "sopra": KEYWORD_ABOVE,
+    "più di": KEYWORD_ABOVE,
+}
+
+# ID prodotto: almeno 6 caratteri alfanumerici, con almeno una cifra oppure
+# scritti in maiuscolo come gli SKU alfabetici (es. "MENAPPCEM"); parole
+# minuscole come "tavolo" o "prezzo" non vengono prese per ID
+_PRODUCT_ID = re.compile(r'\b[A-Za-z0-9]{6,}\b')
+_NUMBER = re.compile(r'(\d+)')
+_CATEGORY_SEPARATORS = re.compile(r'\s*[>/|]\s*')
+
+_router = None
+_router_lock = threading.Lock()
+
+class KeywordAutomaton:
+    """
+    Automa di Aho-Corasick su un insieme di parole chiave.
+    """
+    def __init__(self, keywords: Dict[str, Any]):
+        """
+        Costruisce l'automa.
+
+        Args:
+            keywords (Dict[str, Any]): Parole chiave (non vuote) e valore associato a ciascuna
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Parole chiave che terminano in ogni stato: (lunghezza, valore)
+        self._output: List[Tuple[Tuple[int, Any], ...]] = [()]
+
+        for keyword, value in keywords.items():
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state] += ((len(keyword), value),)
+
+        # Collegamenti di fallimento in ampiezza: ogni stato eredita le uscite del suo suffisso
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Trova tutte le occorrenze delle parole chiave, anche sovrapposte.
+
+        Args:
+            text (str): Testo da esaminare
+
+        Yields:
+            Tuple[int, int, Any]: Inizio, fine e valore di ogni occorrenza
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                yield end - length, end, value
+
+class IntentRouter:
+    """
+    Router compilato degli intenti, per una versione del catalogo.
+    """
+    def __init__(self, categories: Iterable[str] = (), version: Optional[int] = None):
+        """
+        Compila il router.
+
+        Args:
+            categories (Iterable[str], optional): Categorie oltre a quelle di base, in minuscolo
+            version (int, optional): Versione del catalogo da cui derivano le categorie
+        """
+        keywords: Dict[str, Tuple[str, Optional[str]]] = {}
+        for category in (*BASE_CATEGORIES, *categories):
+            keywords[category] = (KEYWORD_CATEGORY, category)
+        for keyword, kind in INTENT_KEYWORDS.items():
+            keywords[keyword] = (kind, None)
+
+        self.version = version
+        self.categories = len(keywords) - len(INTENT_KEYWORDS)
+        self._automaton = KeywordAutomaton(keywords)
+
+    def route(self, query_text: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Riconosce l'intento di una query e ne estrae i parametri.
+
+        Args:
+            query_text (str): Query in linguaggio naturale
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: Intento (chiave di INTENT_HANDLERS) e parametri della risposta
+        """
+        # Normalizza la query (gli ID prodotto mantengono maiuscole e minuscole)
+        original_text = ' '.join(query_text.split())
+        query_text = original_text.lower()
+
+        kinds = set()
+        category, category_span = None, None
+        for start, end, (kind, value) in self._automaton.iter_matches(query_text):
+            if kind != KEYWORD_CATEGORY:
+                kinds.add(kind)
+            elif start == 0 or not query_text[start - 1].isalnum():
+                # Categoria a inizio parola: vince la più lunga, poi la prima
+                if category_span is None or (end - start, -start) > category_span:
+                    category, category_span = value, (end - start, -start)
+
+        if KEYWORD_STATS in kinds:
+            return "stats", {}
+
+        if KEYWORD_CHANGES in kinds:
+            return "changes", {}
+
+        product_id = _find_product_id(original_text)
+        if product_id:
+            # Probabile richiesta di informazioni su prodotto specifico
+            return "product_info", {'product_id': product_id}
+
+        if KEYWORD_PRICE in kinds:
+            price_match = _NUMBER.search(query_text)
+            if price_match and KEYWORD_BELOW in kinds:
+                return "product_price", {'max_price': float(price_match.group(1))}
+            if price_match and KEYWORD_ABOVE in kinds:
+                return "product_price", {'min_price': float(price_match.group(1))}
+            # Fallback: mostra prodotti più economici
+            return "product_price", {'max_price': 100, 'limit': 5}
+
+        if category is not None:
+            return "product_category", {'category': category}
+
+        # Se non riusciamo a capire l'intento, eseguiamo una ricerca full-text
+        return "full_text_search", {'query_text': query_text}
+
+def _find_product_id(text: str) -> Optional[str]:
+    """
+    Cerca nel testo un probabile ID prodotto, con maiuscole e minuscole originali.
+
+    Un ID puramente alfabetico è accettato solo se scritto in maiuscolo in una
+    frase che non lo è per intero ("CERCO TAVOLO" non contiene ID).
+
+    Args:
+        text (str): Query normalizzata negli spazi, non in minuscolo
+
+    Returns:
+        Optional[str]: Primo ID trovato o None
+    """
+    for match in _PRODUCT_ID.finditer(text):
+        token = match.group()
+        if any(char.isdigit() for char in token):
+            return token
+        if token.isupper() and not text.isupper():
+            return token
+    return None
+
+def load_category_vocabulary(db: Session, limit: int = MAX_CATEGORY_TERMS) -> List[str]:
+    """
+    Ricava le categorie dai percorsi di categoria dei prodotti attivi.
+
+    Args:
+        db (Session): Sessione del database
+        limit (int, optional): Numero massimo di categorie
+
+    Returns:
+        List[str]: Segmenti distinti dei percorsi, in minuscolo
+    """
+    paths = union(
+        db.query(Product.product_type.label('path')).filter(Product.removed_at.is_(None)),
+        db.query(Product.google_product_category.label('path')).filter(Product.removed_at.is_(None))
+    )
+    terms = set()
+    for (path,) in db.execute(paths):
+        for segment in _CATEGORY_SEPARATORS.split((path or '').lower()):
+            segment = ' '.join(segment.split())
+            # Le tassonomie numeriche (ID di Google) non sono parole da riconoscere
+            if len(segment) >= 3 and any(char.isalpha() for char in segment):
+                terms.add(segment)
+    if len(terms) > limit:
+        logger.warning(f"Vocabolario delle categorie limitato a {limit} voci su {len(terms)}")
+    return sorted(terms)[:limit]
+
+def refresh_intent_router(db: Session) -> IntentRouter:
+    """
+    Ricompila il router con il vocabolario della versione corrente del catalogo.
+
+    Args:
+        db (Session): Sessione del database
+
+    Returns:
+        IntentRouter: Router compilato
+    """
+    return _compile_router(db, get_catalog_version(db), blocking=True)
+
+def get_intent_router(db: Session = None, version: Optional[int] = None) -> IntentRouter:
+    """
+    Restituisce il router corrente, ricompilandolo se la versione del catalogo è cambiata.
+
+    Mentre un altro thread ricompila il router si continua a usare quello
+    corrente; senza database è disponibile il router delle categorie di base.
+
+    Args:
+        db (Session, optional): Sessione del database
+        version (int, optional): Versione corrente del catalogo
+
+    Returns:
+        IntentRouter: Router degli intenti
+    """
+    router = _router
+    if db is None:
+        return router or IntentRouter()
+    if router is not None and router.version == version:
+        return router
+    return _compile_router(db, version, blocking=router is None)
+
+def _compile_router(db: Session, version: int, blocking: bool) -> IntentRouter:
+    """Compila il router per la versione data, se non già compilato da un altro thread."""
+    global _router
+
+    if not _router_lock.acquire(blocking=blocking):
+        return _router
+    try:
+        if _router is None or _router.version != version:
+            _router = IntentRouter(load_category_vocabulary(db), version)
+            logger.info(f"Router degli intenti compilato: {_router.categories} categorie (versione {version})")
+        return _router
+    finally:
+        _router_lock.release()
@@ -0,0 +1,470 @@
+"""
+Esecuzione in background delle importazioni del catalogo.
+
+Le importazioni vengono eseguite da un pool limitato di thread. La fase di
+preparazione (download ed eventuale verifica del feed) procede in parallelo
+per fonti diverse, mentre la fase di scrittura è serializzata dal lease
+'write' del database, così che due importazioni non si contendano il lock
+di scrittura di SQLite, anche se avviate da processi diversi (vedi
+import_lease).
+
+Ogni job rivendica all'accodamento il lease della propria fonte: una
+richiesta per una fonte già in coda o in esecuzione restituisce il job
+esistente se è di questo processo, altrimenti viene rifiutata. I lease
+detenuti vengono rinnovati da un thread per job fino alla sua conclusione.
+
+Ogni job riceve dall'importatore la fase corrente e gli elementi elaborati
+a ogni fine blocco, da cui ricava velocità e tempo residuo stimato.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import OperationalError
+
+from app.models.database import get_db
+from app.services.catalog_importer import CatalogImporter, PHASE_FETCH, PHASE_PARSE, PHASE_DIFF, PHASE_WRITE
+from app.services.import_lease import (WRITE_LEASE, LEASE_RENEW_INTERVAL, acquire_lease, get_lease_holder,
+                                       release_lease, renew_lease, source_lease_name)
+
+# Logger
+logger = logging.getLogger("job_runner")
+
+# Importazioni eseguite in parallelo se non configurato (IMPORT_WORKERS)
+DEFAULT_MAX_WORKERS = 2
+
+# Job conclusi conservati per la consultazione dello stato
+JOB_HISTORY_SIZE = 100
+
+# Stati del job
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+
+# Fase di un job in attesa del lease di scrittura (le altre fasi sono quelle dell'importatore)
+PHASE_WAITING = 'waiting'
+
+# Secondi tra i tentativi di rivendicare il lease di scrittura
+WRITE_LEASE_POLL_INTERVAL = 1.0
+
+# Fasi riportate nello stato dei job
+JOB_PHASES = (PHASE_FETCH, PHASE_PARSE, PHASE_DIFF, PHASE_WAITING, PHASE_WRITE)
+
+_runner = None
+_runner_guard = threading.Lock()
+
+class ImportJob:
+    """
+    Stato di un'importazione richiesta al pool.
+    """
+    def __init__(self, key: Tuple, source_url: str = None, json_file: str = None, version_label: str = None,
+                 source_id: int = None, resume_sync_id: int = None):
+        """
+        Inizializza il job in stato 'queued'.
+
+        Args:
+            key (Tuple): Chiave della fonte, usata per la deduplicazione
+            source_url (str, optional): URL del feed
+            json_file (str, optional): Percorso del file JSON locale
+            version_label (str, optional): Etichetta versione della sincronizzazione
+            source_id (int, optional): Fonte registrata del feed
+            resume_sync_id (int, optional): Sincronizzazione da riprendere
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.source_url = source_url
+        self.json_file = json_file
+        self.version_label = version_label
+        self.source_id = source_id
+        self.resume_sync_id = resume_sync_id
+
+        self.state = JOB_QUEUED
+        self.phase = None
+        self.sync_id = resume_sync_id
+        self.success = None
+        self.error = None
+        self.submitted_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+        
+        # Avanzamento
+        self.items_processed = 0
+        self.items_expected = None
+        self.throughput = None  # elementi al secondo nella passata corrente
+        self.eta_seconds = None
+        self._pass_started = None  # (istante, elementi) all'inizio della passata sul feed
+        
+        # Versione dello stato, incrementata a ogni aggiornamento (per lo stream SSE)
+        self.version = 0
+        self._changed = threading.Condition()
+        self._done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        """True se il job è concluso, con successo o meno."""
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Attende la conclusione del job.
+
+        Args:
+            timeout (float, optional): Secondi massimi di attesa
+
+        Returns:
+            bool: True se il job si è concluso entro il timeout
+        """
+        return self._done.wait(timeout)
+
+    def wait_for_change(self, version: int, timeout: float = None) -> int:
+        """
+        Attende un aggiornamento dello stato successivo a una versione nota.
+
+        Args:
+            version (int): Ultima versione osservata
+            timeout (float, optional): Secondi massimi di attesa
+
+        Returns:
+            int: Versione corrente (uguale a quella indicata se scade il timeout)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def start(self):
+        """Registra l'avvio del job nel thread del pool."""
+        with self._changed:
+            self.state = JOB_RUNNING
+            self.started_at = datetime.now(timezone.utc)
+            self._notify()
+
+    def set_phase(self, phase: str):
+        """
+        Aggiorna la fase corrente.
+
+        Args:
+            phase (str): Una delle JOB_PHASES
+        """
+        with self._changed:
+            self.phase = phase
+            self._notify()
+
+    def update_progress(self, phase: str, items_processed: int, items_expected: Optional[int]):
+        """
+        Callback di avanzamento dell'importatore.
+
+        La velocità è calcolata dall'inizio della passata corrente sul feed
+        (verifica in preparazione, se abilitata, poi scrittura): una nuova
+        passata riparte da zero elementi.
+
+        Args:
+            phase (str): Fase corrente
+            items_processed (int): Elementi del feed elaborati nella passata
+            items_expected (Optional[int]): Elementi totali del feed, se noti o stimati
+        """
+        now = time.monotonic()
+        with self._changed:
+            if self._pass_started is None or items_processed < self.items_processed:
+                self._pass_started = (now, items_processed)
+
+            self.phase = phase
+            self.items_processed = items_processed
+            self.items_expected = items_expected
+
+            started_at, started_items = self._pass_started
+            elapsed = now - started_at
+            if elapsed > 0 and items_processed > started_items:
+                self.throughput = (items_processed - started_items) / elapsed
+            else:
+                self.throughput = None
+
+            if self.throughput and items_expected is not None:
+                self.eta_seconds = max(items_expected - items_processed, 0) / self.throughput
+            else:
+                self.eta_seconds = None
+            self._notify()
+
+    def finish(self, success: bool, error: str = None):
+        """
+        Registra la conclusione del job.
+
+        Args:
+            success (bool): Esito dell'importazione
+            error (str, optional): Messaggio di errore
+        """
+        with self._changed:
+            self.success = success
+            self.error = error
+            self.state = JOB_COMPLETED if success else JOB_FAILED
+            self.phase = None
+            self.eta_seconds = None
+            self.finished_at = datetime.now(timezone.utc)
+            self._done.set()
+            self._notify()
+
+    def _notify(self):
+        """Incrementa la versione e risveglia chi attende un aggiornamento. Richiede _changed."""
+        self.version += 1
+        self._changed.notify_all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Restituisce lo stato del job in formato serializzabile.
+
+        Returns:
+            Dict[str, Any]: Stato del job
+        """
+        return {
+            'id': self.id,
+            'state': self.state,
+            'phase': self.phase,
+            'items_processed': self.items_processed,
+            'items_expected': self.items_expected,
+            'throughput': round(self.throughput, 1) if self.throughput is not None else None,
+            'eta_seconds': round(self.eta_seconds, 1) if self.eta_seconds is not None else None,
+            'source_id': self.source_id,
+            'source': self.source_url or self.json_file,
+            'sync_id': self.sync_id,
+            'success': self.success,
+            'error': self.error,
+            'submitted_at': self.submitted_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class ImportJobRunner:
+    """
+    Pool limitato di thread per le importazioni, con deduplicazione per fonte tramite lease.
+    """
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, history_size: int = JOB_HISTORY_SIZE,
+                 parse_workers: int = 0, verify_feed: bool = False):
+        """
+        Inizializza il pool.
+
+        Args:
+            max_workers (int, optional): Importazioni eseguite contemporaneamente
+            history_size (int, optional): Job conclusi conservati in memoria
+            parse_workers (int, optional): Processi per la lettura di ciascun feed
+            verify_feed (bool, optional): Se True ogni feed viene letto e contato prima della scrittura
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers deve essere maggiore di zero")
+
+        self.max_workers = max_workers
+        self.history_size = history_size
+        self.parse_workers = parse_workers
+        self.verify_feed = verify_feed
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='import')
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, ImportJob]' = OrderedDict()
+        self._held: Dict[str, ImportJob] = {}  # lease detenuti dai job di questo processo
+
+    def submit(self, source_url: str = None, json_file: str = None, version_label: str = None,
+               source_id: int = None, resume_sync_id: int = None) -> Tuple[ImportJob, bool]:
+        """
+        Accoda un'importazione, a meno che la stessa fonte non sia già in coda o in esecuzione.
+
+        La deduplicazione usa il lease della fonte nel database: se lo detiene
+        un job di questo processo viene restituito quel job.
+
+        Args:
+            source_url (str, optional): URL del feed
+            json_file (str, optional): Percorso del file JSON locale
+            version_label (str, optional): Etichetta versione della sincronizzazione
+            source_id (int, optional): Fonte registrata del feed
+            resume_sync_id (int, optional): Sincronizzazione da riprendere
+
+        Returns:
+            Tuple[ImportJob, bool]: Job e True se è stato creato, False se esisteva già
+
+        Raises:
+            ValueError: Se non viene indicata alcuna fonte o se la fonte è già
+                        in importazione in un altro processo
+        """
+        if source_id is not None:
+            key = ('source', source_id)
+        elif source_url:
+            key = ('url', source_url)
+        elif json_file:
+            key = ('file', json_file)
+        else:
+            raise ValueError("È necessario specificare una fonte per l'importazione")
+
+        lease = source_lease_name(key)
+        with self._lock:
+            job = ImportJob(key, source_url=source_url, json_file=json_file, version_label=version_label,
+                            source_id=source_id, resume_sync_id=resume_sync_id)
+            if not acquire_lease(lease, job.id):
+                active = self._jobs.get(get_lease_holder(lease))
+                if active is not None:
+                    logger.info(f"Importazione già in corso per {key[1]} (job {active.id})")
+                    return active, False
+                raise ValueError(f"Importazione già in corso per {key[1]} in un altro processo")
+
+            self._held[lease] = job
+            self._jobs[job.id] = job
+            self._trim_history()
+
+        logger.info(f"Importazione accodata per {key[1]} (job {job.id})")
+        threading.Thread(target=self._keep_leases, args=(job,), name=f'lease-{job.id}', daemon=True).start()
+        self._executor.submit(self._run, job)
+        return job, True
+
+    def get_job(self, job_id: str) -> Optional[ImportJob]:
+        """
+        Restituisce un job per ID.
+
+        Args:
+            job_id (str): ID del job
+
+        Returns:
+            Optional[ImportJob]: Job o None se sconosciuto
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[ImportJob]:
+        """
+        Elenca i job noti, dal più recente.
+
+        Returns:
+            List[ImportJob]: Job in coda, in esecuzione e conclusi
+        """
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def shutdown(self, wait: bool = True):
+        """
+        Arresta il pool. I job già accodati vengono comunque eseguiti.
+
+        Args:
+            wait (bool, optional): Se True attende la conclusione dei job
+        """
+        self._executor.shutdown(wait=wait)
+
+    def _trim_history(self):
+        """Elimina i job conclusi più vecchi oltre history_size."""
+        excess = len(self._jobs) - self.history_size
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: ImportJob):
+        """Esegue un job nel thread del pool."""
+        job.start()
+        success, error = False, None
+
+        try:
+            with get_db() as db:
+                if job.resume_sync_id is not None:
+                    importer = CatalogImporter.resume(db, job.resume_sync_id, progress_callback=job.update_progress,
+                                                      parse_workers=self.parse_workers, verify_feed=self.verify_feed)
+                else:
+                    importer = CatalogImporter(
+                        db_session=db,
+                        source_url=job.source_url,
+                        json_file=job.json_file,
+                        version_label=job.version_label,
+                        source_id=job.source_id,
+                        progress_callback=job.update_progress,
+                        parse_workers=self.parse_workers,
+                        verify_feed=self.verify_feed
+                    )
+                job.sync_id = importer.sync_record.id
+
+                if importer.prepare():
+                    job.set_phase(PHASE_WAITING)
+                    self._acquire_write_lease(job)
+                    try:
+                        success = importer.write()
+                    finally:
+                        self._release(WRITE_LEASE, job)
+                if not success:
+                    error = importer.sync_record.error_message
+        except Exception as e:
+            logger.error(f"Errore durante l'esecuzione del job {job.id}: {str(e)}")
+            error = str(e)
+        finally:
+            self._release(source_lease_name(job.key), job)
+            job.finish(success, error)
+
+        if success:
+            logger.info(f"Job {job.id} completato (sincronizzazione {job.sync_id})")
+        else:
+            logger.error(f"Job {job.id} fallito: {error}")
+
+    def _acquire_write_lease(self, job: ImportJob):
+        """Attende il lease di scrittura del database e lo registra tra quelli del job."""
+        while True:
+            try:
+                if acquire_lease(WRITE_LEASE, job.id):
+                    break
+            except OperationalError as e:
+                logger.warning(f"Database occupato durante la richiesta del lease di scrittura: {str(e)}")
+            time.sleep(WRITE_LEASE_POLL_INTERVAL)
+
+        with self._lock:
+            self._held[WRITE_LEASE] = job
+
+    def _release(self, lease: str, job: ImportJob):
+        """Rilascia un lease del job. Un errore non interrompe il job: il lease scadrà da solo."""
+        with self._lock:
+            if self._held.get(lease) is job:
+                del self._held[lease]
+
+        try:
+            release_lease(lease, job.id)
+        except Exception as e:
+            logger.error(f"Errore durante il rilascio del lease {lease}: {str(e)}")
+
+    def _keep_leases(self, job: ImportJob):
+        """Rinnova i lease del job fino alla sua conclusione (thread dedicato)."""
+        while not job.wait(LEASE_RENEW_INTERVAL):
+            with self._lock:
+                leases = [lease for lease, holder in self._held.items() if holder is job]
+
+            for lease in leases:
+                try:
+                    if not renew_lease(lease, job.id):
+                        logger.error(f"Lease {lease} del job {job.id} scaduto e rivendicato da un altro job")
+                except Exception as e:
+                    logger.error(f"Errore durante il rinnovo del lease {lease}: {str(e)}")
+
+def init_job_runner(app) -> ImportJobRunner:
+    """
+    Crea il pool delle importazioni secondo la configurazione dell'applicazione.
+
+    Args:
+        app: Applicazione Flask
+
+    Returns:
+        ImportJobRunner: Pool delle importazioni
+    """
+    global _runner
+
+    with _runner_guard:
+        if _runner is not None:
+            _runner.shutdown(wait=False)
+        _runner = ImportJobRunner(max_workers=app.config.get('IMPORT_WORKERS', DEFAULT_MAX_WORKERS),
+                                  parse_workers=app.config.get('IMPORT_PARSE_WORKERS', 0),
+                                  verify_feed=app.config.get('IMPORT_VERIFY_FEED', False))
+    return _runner
+
+def get_job_runner() -> ImportJobRunner:
+    """
+    Restituisce il pool delle importazioni, creandolo con i valori predefiniti se necessario.
+
+    Returns:
+        ImportJobRunner: Pool delle importazioni
+    """
+    global _runner
+
+    with _runner_guard:
+        if _runner is None:
+            _runner = ImportJobRunner()
+        return _runner
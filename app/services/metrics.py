@@ -0,0 +1,308 @@
+"""
+Metriche dell'applicazione in formato testo Prometheus.
+
+Raccoglie tre famiglie di metriche:
+
+- i tempi delle importazioni, misurati da ImportMetrics per fase (tempo
+  reale e tempo CPU del thread) e salvati su CatalogSync.metrics;
+- la latenza delle richieste alle API, in istogrammi aggiornati dagli hook
+  del blueprint api_bp;
+- hit, miss e occupazione della cache delle query (query_cache).
+
+Istogrammi e cache sono tenuti in memoria e sono quindi per processo: con
+più worker gunicorn ogni worker espone i propri.
+"""
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # non disponibile su Windows
+    resource = None
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models.models import CatalogSync, FeedSource
+from app.services.query_cache import get_query_cache
+
+# Logger
+logger = logging.getLogger("metrics")
+
+# Limiti superiori (secondi) dei bucket della latenza delle richieste
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Restituisce il picco di memoria residente del processo.
+
+    Returns:
+        Optional[int]: Byte, o None se il modulo resource non è disponibile
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta kilobyte, macOS byte
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class ImportMetrics:
+    """
+    Tempi per fase di un'importazione e contatori associati.
+
+    Le fasi si alternano con enter(): il tempo trascorso viene attribuito
+    alla fase precedente. Il tempo CPU è quello del thread corrente
+    (time.thread_time), quindi non include le altre importazioni del pool.
+    """
+    def __init__(self):
+        self.phases: Dict[str, List[float]] = {}
+        self.bytes_downloaded = 0
+        self.items_total = 0
+        self.rows_written = 0
+        self.changes_written = 0
+        self._current = None
+        self._wall_started = 0.0
+        self._cpu_started = 0.0
+
+    def enter(self, phase: str):
+        """
+        Chiude la fase corrente e ne apre una nuova.
+
+        Args:
+            phase (str): Nome della fase
+        """
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if self._current is not None:
+            totals = self.phases.setdefault(self._current, [0.0, 0.0])
+            totals[0] += wall - self._wall_started
+            totals[1] += cpu - self._cpu_started
+        self._current = phase
+        self._wall_started, self._cpu_started = wall, cpu
+
+    def stop(self):
+        """Chiude la fase corrente."""
+        self.enter(None)
+
+    @contextmanager
+    def measure(self, phase: str):
+        """
+        Attribuisce a una fase il blocco di codice, poi torna alla fase precedente.
+
+        Args:
+            phase (str): Nome della fase
+        """
+        previous = self._current
+        self.enter(phase)
+        try:
+            yield
+        finally:
+            self.enter(previous)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Riassume le misure in formato serializzabile (salvato su CatalogSync.metrics).
+
+        Returns:
+            Dict[str, Any]: Tempi per fase e contatori
+        """
+        self.stop()
+        wall_total = sum(wall for wall, _ in self.phases.values())
+        return {
+            'phases': {
+                phase: {'wall_seconds': round(wall, 4), 'cpu_seconds': round(cpu, 4)}
+                for phase, (wall, cpu) in self.phases.items()
+            },
+            'wall_seconds': round(wall_total, 4),
+            'cpu_seconds': round(sum(cpu for _, cpu in self.phases.values()), 4),
+            'items_total': self.items_total,
+            'rows_per_second': round(self.items_total / wall_total, 1) if wall_total > 0 else None,
+            'bytes_downloaded': self.bytes_downloaded,
+            'rows_written': self.rows_written,
+            'changes_written': self.changes_written,
+            'peak_rss_bytes': peak_rss_bytes()
+        }
+
+class Histogram:
+    """
+    Istogramma cumulativo con etichette, esposto in formato Prometheus.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        Inizializza l'istogramma.
+
+        Args:
+            name (str): Nome della metrica
+            documentation (str): Testo della riga HELP
+            labelnames (Tuple[str, ...]): Nomi delle etichette
+            buckets (Tuple[float, ...], optional): Limiti superiori dei bucket, crescenti
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # etichette -> (conteggi per bucket, somma, conteggio)
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str):
+        """
+        Registra un'osservazione.
+
+        Args:
+            value (float): Valore osservato
+            *labels (str): Valori delle etichette, nell'ordine di labelnames
+        """
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        """
+        Restituisce le righe della metrica in formato testo Prometheus.
+
+        Returns:
+            List[str]: Righe HELP, TYPE e campioni
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items())
+
+        for labels, counts, total, count in series:
+            named = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(dict(named, le=bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(dict(named, le='+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(named)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(named)} {count}")
+        return lines
+
+REQUEST_LATENCY = Histogram(
+    'feedwise_api_request_duration_seconds',
+    'Latenza delle richieste alle API (fino all\'invio delle intestazioni)',
+    ('endpoint', 'method', 'status')
+)
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    """Formatta le etichette di un campione ({nome="valore",...})."""
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def _gauge(lines: List[str], name: str, documentation: str, samples: Iterable[Tuple[Dict[str, Any], Any]]):
+    """Aggiunge una metrica gauge con i campioni non nulli."""
+    lines.append(f"# HELP {name} {documentation}")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+def _counter(lines: List[str], name: str, documentation: str, samples: Iterable[Tuple[Dict[str, Any], Any]]):
+    """Aggiunge una metrica counter con i campioni indicati."""
+    lines.append(f"# HELP {name} {documentation}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+def _render_query_cache(lines: List[str]):
+    """Aggiunge le metriche della cache delle query."""
+    cache = get_query_cache().stats()
+    _counter(lines, 'feedwise_query_cache_hits_total', 'Query servite dalla cache, per intento', (
+        ({'intent': intent}, count) for intent, count in sorted(cache['hits'].items())
+    ))
+    _counter(lines, 'feedwise_query_cache_misses_total', 'Query calcolate sul database, per intento', (
+        ({'intent': intent}, count) for intent, count in sorted(cache['misses'].items())
+    ))
+    for key, name, documentation in (
+        ('evictions', 'feedwise_query_cache_evictions_total', 'Voci rimosse per i limiti di dimensione della cache'),
+        ('expirations', 'feedwise_query_cache_expirations_total', 'Voci scadute (TTL)'),
+        ('invalidations', 'feedwise_query_cache_invalidations_total', 'Svuotamenti della cache per cambio di versione del catalogo'),
+    ):
+        _counter(lines, name, documentation, [({}, cache[key])])
+    _gauge(lines, 'feedwise_query_cache_entries', 'Voci nella cache delle query', [({}, cache['entries'])])
+    _gauge(lines, 'feedwise_query_cache_bytes', 'Dimensione stimata dei risultati in cache', [({}, cache['bytes'])])
+
+def render_metrics(db: Session) -> str:
+    """
+    Compone il testo esposto su /metrics.
+
+    Per ciascuna fonte vengono riportate le misure dell'ultima importazione
+    conclusa che le ha registrate. L'etichetta source è il nome della fonte
+    (o il suo ID, se il nome è l'URL) e 'sconosciuta' per le importazioni
+    senza fonte: l'URL o il percorso del feed non viene esposto, perché
+    /metrics non è autenticato e l'URL può contenere credenziali.
+
+    Args:
+        db (Session): Sessione del database
+
+    Returns:
+        str: Metriche in formato testo Prometheus (version 0.0.4)
+    """
+    latest = db.query(
+        func.coalesce(CatalogSync.source_id, 0).label('source_key'),
+        func.max(CatalogSync.id).label('sync_id')
+    ).filter(CatalogSync.metrics.isnot(None)).group_by('source_key').subquery()
+
+    rows = db.query(CatalogSync, FeedSource.name, FeedSource.url).join(
+        latest, CatalogSync.id == latest.c.sync_id
+    ).outerjoin(FeedSource, FeedSource.id == CatalogSync.source_id).order_by(CatalogSync.id).all()
+
+    imports = []
+    for sync, source_name, source_url in rows:
+        # Le fonti manuali per URL hanno come nome l'URL stesso (vedi get_or_create_url_source)
+        if source_name and source_name != source_url[:255]:
+            source = source_name
+        elif sync.source_id is not None:
+            source = str(sync.source_id)
+        else:
+            source = 'sconosciuta'
+        labels = {'source': source}
+        imports.append((labels, sync, sync.metrics or {}))
+
+    lines: List[str] = []
+    _gauge(lines, 'feedwise_import_phase_wall_seconds', 'Tempo reale per fase dell\'ultima importazione', (
+        (dict(labels, phase=phase), values.get('wall_seconds'))
+        for labels, _, metrics in imports for phase, values in metrics.get('phases', {}).items()
+    ))
+    _gauge(lines, 'feedwise_import_phase_cpu_seconds', 'Tempo CPU per fase dell\'ultima importazione', (
+        (dict(labels, phase=phase), values.get('cpu_seconds'))
+        for labels, _, metrics in imports for phase, values in metrics.get('phases', {}).items()
+    ))
+    for key, name, documentation in (
+        ('wall_seconds', 'feedwise_import_wall_seconds', 'Durata dell\'ultima importazione'),
+        ('rows_per_second', 'feedwise_import_rows_per_second', 'Elementi del feed elaborati al secondo'),
+        ('items_total', 'feedwise_import_items', 'Elementi del feed dell\'ultima importazione'),
+        ('bytes_downloaded', 'feedwise_import_downloaded_bytes', 'Byte scaricati dall\'ultima importazione'),
+        ('rows_written', 'feedwise_import_rows_written', 'Prodotti scritti dall\'ultima importazione'),
+        ('changes_written', 'feedwise_import_changes_written', 'Modifiche registrate dall\'ultima importazione'),
+        ('peak_rss_bytes', 'feedwise_import_peak_rss_bytes', 'Picco di memoria residente del processo al termine dell\'importazione'),
+    ):
+        _gauge(lines, name, documentation, ((labels, metrics.get(key)) for labels, _, metrics in imports))
+    _gauge(lines, 'feedwise_import_success', 'Esito dell\'ultima importazione (1 riuscita, 0 fallita)', (
+        (labels, 1 if sync.success else 0) for labels, sync, _ in imports
+    ))
+    _gauge(lines, 'feedwise_import_completed_timestamp_seconds', 'Conclusione dell\'ultima importazione (epoch)', (
+        (labels, sync.completed_at.replace(tzinfo=timezone.utc).timestamp() if sync.completed_at else None)
+        for labels, sync, _ in imports
+    ))
+
+    lines.extend(REQUEST_LATENCY.render())
+    _render_query_cache(lines)
+    return '\n'.join(lines) + '\n'
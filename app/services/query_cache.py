@@ -0,0 +1,209 @@
+"""
+Cache in memoria dei risultati delle query sul catalogo.
+
+Le domande dell'assistente si ripetono molto tra due importazioni
+("statistiche", "tavolo"...): i risultati di execute_query vengono quindi
+conservati per intento e parametri normalizzati. La cache è limitata nel
+numero di voci e nella dimensione stimata (JSON serializzato), con
+rimozione delle voci usate meno di recente (LRU) e scadenza (TTL).
+
+Ogni lettura indica la versione corrente del catalogo, il contatore
+CatalogStats.catalog_version incrementato dall'importatore quando una
+sincronizzazione scrive prodotti: quando cambia, tutte le voci vengono
+scartate. Un feed invariato lascia la cache intatta.
+Poiché la versione è letta dal database, l'invalidazione vale anche per i
+processi che non hanno eseguito l'importazione.
+
+La cache è per processo: con più worker gunicorn ognuno ha la propria.
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# Logger
+logger = logging.getLogger("query_cache")
+
+# Valori predefiniti se non configurati (QUERY_CACHE_*)
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 300.0
+
+_cache = None
+_cache_guard = threading.Lock()
+
+class QueryCache:
+    """
+    Cache LRU con scadenza e invalidazione per versione del catalogo.
+    """
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl: float = DEFAULT_TTL):
+        """
+        Inizializza la cache.
+
+        Args:
+            max_entries (int, optional): Numero massimo di voci (0 disabilita la cache)
+            max_bytes (int, optional): Dimensione massima stimata dei risultati conservati
+            ttl (float, optional): Secondi di validità di una voce
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # chiave -> (scadenza, dimensione, risultato)
+        self._entries: 'OrderedDict[Hashable, Tuple[float, int, Any]]' = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0 and self.ttl > 0
+
+    def get_or_compute(self, intent: str, key: Hashable, version: int, compute: Callable[[], Any],
+                       cacheable: Callable[[Any], bool] = None) -> Any:
+        """
+        Restituisce il risultato conservato per la chiave, o lo calcola e lo conserva.
+
+        Il calcolo avviene fuori dal lock: due richieste concorrenti per la
+        stessa chiave possono calcolarla entrambe. Il chiamante riceve sempre
+        una copia, così che le modifiche al risultato non alterino la cache.
+
+        Args:
+            intent (str): Intento della query, usato per le metriche
+            key (Hashable): Chiave del risultato (intento e parametri normalizzati)
+            version (int): Versione corrente del catalogo
+            compute (Callable): Funzione che calcola il risultato
+            cacheable (Callable, optional): Indica se un risultato può essere conservato
+
+        Returns:
+            Any: Risultato della query
+        """
+        if not self.enabled:
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._discard(key)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits[intent] = self.hits.get(intent, 0) + 1
+                return copy.deepcopy(entry[2])
+            self.misses[intent] = self.misses.get(intent, 0) + 1
+
+        result = compute()
+        if cacheable is None or cacheable(result):
+            self._store(key, version, result)
+        return copy.deepcopy(result)
+
+    def clear(self):
+        """Scarta tutte le voci."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Restituisce contatori e occupazione della cache.
+
+        Returns:
+            Dict[str, Any]: Hit e miss per intento, rimozioni, invalidazioni, voci e byte
+        """
+        with self._lock:
+            return {
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'version': self._version
+            }
+
+    def _store(self, key: Hashable, version: int, result: Any):
+        """Conserva un risultato, rimuovendo le voci meno recenti oltre i limiti."""
+        try:
+            size = len(json.dumps(result, default=str))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Risultato non conservato in cache: {str(e)}")
+            return
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            if version != self._version:
+                # Calcolato su una versione già superata
+                return
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _check_version(self, version: int):
+        """Scarta tutte le voci se la versione del catalogo è cambiata (con il lock acquisito)."""
+        if self._version is not None and version < self._version:
+            # Lettura concorrente di una versione precedente: nessuna invalidazione
+            return
+        if version != self._version:
+            if self._entries:
+                logger.info(f"Catalogo alla versione {version}: scartate {len(self._entries)} voci della cache")
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+def init_query_cache(app) -> QueryCache:
+    """
+    Crea la cache delle query secondo la configurazione dell'applicazione.
+
+    Args:
+        app: Applicazione Flask
+
+    Returns:
+        QueryCache: Cache delle query
+    """
+    global _cache
+
+    with _cache_guard:
+        _cache = QueryCache(
+            max_entries=app.config.get('QUERY_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+            max_bytes=app.config.get('QUERY_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES),
+            ttl=app.config.get('QUERY_CACHE_TTL', DEFAULT_TTL)
+        )
+    return _cache
+
+def get_query_cache() -> QueryCache:
+    """
+    Restituisce la cache delle query, creandola con i valori predefiniti se necessario.
+
+    Returns:
+        QueryCache: Cache delle query
+    """
+    global _cache
+
+    with _cache_guard:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
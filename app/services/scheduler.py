@@ -5,23 +5,80 @@ Gestisce l'esecuzione automatica delle importazioni del feed.
 import os
 import logging
 from datetime import datetime
+from typing import Tuple
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from flask import current_app
 from app.models.database import get_db, ensure_db_initialized
-from app.services.catalog_importer import CatalogImporter
-from app.models.models import CatalogSync
+from app.models.models import CatalogSync, FeedSource
+from app.services.feed_sources import get_default_source
+from app.services.job_runner import ImportJob, get_job_runner
 
 # Logger
 logger = logging.getLogger("scheduler")
 
-# Configurazione del feed (valore di fallback, in genere letto da config)
-FEED_URL = "https://repository.mobilifiver.com/public/feed/test_json/test.json"
 FEED_PREFIX = "feed"  # Prefisso per le etichette di versione
 
-def run_scheduled_import():
+def enqueue_source_import(source_id: int = None) -> Tuple[ImportJob, bool]:
     """
-    Esegue l'importazione programmata del feed.
+    Accoda l'importazione di una fonte registrata nel pool delle importazioni.
+    
+    Args:
+        source_id (int, optional): ID della fonte (predefinita: la prima fonte configurata)
+    
+    Returns:
+        Tuple[ImportJob, bool]: Job e True se è stato creato, False se la fonte
+                                era già in coda o in esecuzione
+    
+    Raises:
+        ValueError: Se la fonte non esiste o non è attiva
+    """
+    with get_db() as db:
+        source = db.get(FeedSource, source_id) if source_id is not None else get_default_source(db)
+        if source is None or not source.enabled:
+            raise ValueError("Nessuna fonte del feed attiva trovata")
+        source_id, source_url = source.id, source.url
+        
+        # Crea etichetta con fonte e data corrente (univoca anche per importazioni ravvicinate)
+        current_datetime = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        version_label = base_label = f"{FEED_PREFIX}{source_id}_{current_datetime}"
+        attempt = 1
+        while db.query(CatalogSync.id).filter(CatalogSync.import_version == version_label).first():
+            attempt += 1
+            version_label = f"{base_label}_{attempt}"
+    
+    return get_job_runner().submit(source_url=source_url, version_label=version_label, source_id=source_id)
+
+def enqueue_resume(sync_id: int) -> Tuple[ImportJob, bool]:
+    """
+    Accoda la ripresa di una sincronizzazione fallita o interrotta.
+    
+    Args:
+        sync_id (int): ID della sincronizzazione da riprendere
+    
+    Returns:
+        Tuple[ImportJob, bool]: Job e True se è stato creato, False se la fonte
+                                era già in coda o in esecuzione
+    
+    Raises:
+        ValueError: Se la sincronizzazione non esiste
+    """
+    with get_db() as db:
+        sync = db.get(CatalogSync, sync_id)
+        if sync is None:
+            raise ValueError(f"Sincronizzazione {sync_id} non trovata")
+        source, source_id = sync.source_url or '', sync.source_id
+    
+    if source.startswith('file://'):
+        return get_job_runner().submit(json_file=source[len('file://'):], source_id=source_id, resume_sync_id=sync_id)
+    return get_job_runner().submit(source_url=source, source_id=source_id, resume_sync_id=sync_id)
+
+def run_scheduled_import(source_id: int = None):
+    """
+    Esegue l'importazione programmata di una fonte e ne attende la conclusione.
+    
+    Args:
+        source_id (int, optional): ID della fonte (predefinita: la prima fonte configurata)
     
     Returns:
         bool: True se l'importazione è avvenuta con successo, False altrimenti
@@ -29,60 +86,96 @@ def run_scheduled_import():
     logger.info("Avvio importazione programmata")
     
     try:
-        # Crea etichetta con data corrente
-        current_datetime = datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
-        version_label = f"{FEED_PREFIX}_{current_datetime}"
+        job, _ = enqueue_source_import(source_id)
+        job.wait()
         
-        # Esegui l'importazione
-        with get_db() as db:
-            importer = CatalogImporter(
-                db_session=db,
-                source_url=FEED_URL,
-                version_label=version_label
-            )
-            success = importer.import_catalog()
+        if job.success:
+            logger.info(f"Importazione {job.version_label} completata con successo!")
+        else:
+            logger.error(f"Importazione {job.version_label} fallita.")
             
-            if success:
-                logger.info(f"Importazione {version_label} completata con successo!")
-            else:
-                logger.error(f"Importazione {version_label} fallita.")
-                
-            return success
+        return job.success
     
     except Exception as e:
         logger.error(f"Errore durante l'importazione programmata: {str(e)}")
         return False
 
+def resume_import(sync_id: int):
+    """
+    Riprende una sincronizzazione fallita o interrotta dal suo ultimo checkpoint
+    e ne attende la conclusione.
+    
+    Args:
+        sync_id (int): ID della sincronizzazione da riprendere
+    
+    Returns:
+        bool: True se l'importazione è avvenuta con successo, False altrimenti
+    """
+    logger.info(f"Ripresa della sincronizzazione {sync_id}")
+    
+    try:
+        job, _ = enqueue_resume(sync_id)
+        job.wait()
+        
+        if job.success:
+            logger.info(f"Sincronizzazione {sync_id} completata con successo!")
+        else:
+            logger.error(f"Ripresa della sincronizzazione {sync_id} fallita.")
+            
+        return job.success
+    
+    except Exception as e:
+        logger.error(f"Errore durante la ripresa della sincronizzazione {sync_id}: {str(e)}")
+        return False
+
+def _enqueue_scheduled(source_id: int):
+    """Job dello scheduler: accoda l'importazione senza attenderne la conclusione."""
+    try:
+        enqueue_source_import(source_id)
+    except Exception as e:
+        logger.error(f"Errore durante l'avvio dell'importazione programmata della fonte {source_id}: {str(e)}")
+
 def start_scheduler():
     """
-    Avvia lo scheduler con i job configurati.
+    Avvia lo scheduler con un job per ciascuna fonte attiva del registro.
     
     Returns:
         BackgroundScheduler: L'istanza dello scheduler avviato
     """
     scheduler = BackgroundScheduler()
     
-    # Aggiungi il job per l'importazione giornaliera (alle 6:00 AM)
-    scheduler.add_job(
-        run_scheduled_import,
-        trigger=CronTrigger(hour=6, minute=0),
-        id='daily_import',
-        name='Importazione giornaliera del feed',
-        replace_existing=True
-    )
-    
-    # In ambiente di sviluppo, aggiungi anche un job che esegue ogni 15 minuti
-    if os.environ.get('FLASK_ENV') == 'development':
-        scheduler.add_job(
-            run_scheduled_import,
-            trigger=CronTrigger(minute='*/15'),  # Ogni 15 minuti
-            id='test_import',
-            name='Importazione test ogni 15 minuti',
-            replace_existing=True
-        )
+    with get_db() as db:
+        sources = db.query(FeedSource).filter(
+            FeedSource.enabled == True,
+            FeedSource.schedule.isnot(None)
+        ).order_by(FeedSource.id).all()
+        
+        for source in sources:
+            # Importazione secondo lo schedule della fonte (es. ogni giorno alle 6:00 AM)
+            scheduler.add_job(
+                _enqueue_scheduled,
+                args=(source.id,),
+                trigger=CronTrigger.from_crontab(source.schedule),
+                id=f'import_{source.id}',
+                name=f'Importazione del feed {source.name}',
+                replace_existing=True
+            )
+            
+            # In ambiente di sviluppo, aggiungi anche un job che esegue ogni 15 minuti
+            if os.environ.get('FLASK_ENV') == 'development':
+                scheduler.add_job(
+                    _enqueue_scheduled,
+                    args=(source.id,),
+                    trigger=CronTrigger(minute='*/15'),  # Ogni 15 minuti
+                    id=f'test_import_{source.id}',
+                    name=f'Importazione test ogni 15 minuti del feed {source.name}',
+                    replace_existing=True
+                )
+            
+            logger.info(f"Fonte {source.name}: importazione programmata ({source.schedule})")
     
     # Avvia lo scheduler
     scheduler.start()
-    logger.info("Scheduler avviato con successo. L'importazione verrà eseguita ogni giorno alle 6:00 AM.")
+    logger.info(f"Scheduler avviato con successo per {len(sources)} fonti.")
     
     return scheduler
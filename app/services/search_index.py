@@ -0,0 +1,267 @@
+"""
+Indice full-text del catalogo basato su SQLite FTS5.
+
+La tabella virtuale products_fts indicizza titolo, descrizione, marca e
+tipo di prodotto, e conserva l'ID del prodotto in una colonna non
+indicizzata. Il rowid di ogni riga dell'indice è la chiave intera assegnata
+al prodotto in products_fts_docs: a differenza del rowid di products, che
+ha una chiave primaria testuale e può essere rinumerato da VACUUM, una
+INTEGER PRIMARY KEY è stabile, così che aggiornamenti e join restino
+ricerche per chiave. L'importatore mantiene l'indice allineato a ogni
+blocco scritto; i prodotti rimossi dal feed non vengono indicizzati.
+
+Se la build di SQLite non include FTS5 l'indice resta disattivato e la
+ricerca ricade sui filtri LIKE.
+"""
+import logging
+import re
+from typing import List, Optional, Sequence
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.orm import Session
+
+# Logger
+logger = logging.getLogger("search_index")
+
+FTS_TABLE = 'products_fts'
+DOCS_TABLE = 'products_fts_docs'
+
+# Colonne indicizzate e relativo peso nel ranking bm25
+FTS_COLUMNS = (
+    ('title', 10.0),
+    ('description', 1.0),
+    ('brand', 5.0),
+    ('product_type', 3.0),
+)
+
+# unicode61 con rimozione dei diacritici: "comò" e "como" coincidono e gli
+# apostrofi separano le parole ("dell'armadio" -> "dell", "armadio")
+_CREATE_FTS_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"id UNINDEXED, {', '.join(name for name, _ in FTS_COLUMNS)}, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '3 4')"
+)
+
+# Chiave intera stabile di ogni prodotto indicizzato, usata come rowid in products_fts
+_CREATE_DOCS_TABLE = (
+    f"CREATE TABLE IF NOT EXISTS {DOCS_TABLE} ("
+    "doc_id INTEGER PRIMARY KEY, product_id TEXT NOT NULL UNIQUE)"
+)
+
+_COLUMN_LIST = ', '.join(name for name, _ in FTS_COLUMNS)
+_SOURCE_LIST = ', '.join(f"coalesce(p.{name}, '')" for name, _ in FTS_COLUMNS)
+_INDEX_ACTIVE_PRODUCTS = (
+    f"INSERT INTO {FTS_TABLE}(rowid, id, {_COLUMN_LIST}) "
+    f"SELECT d.doc_id, p.id, {_SOURCE_LIST} FROM products AS p "
+    f"JOIN {DOCS_TABLE} AS d ON d.product_id = p.id WHERE p.removed_at IS NULL"
+)
+_ASSIGN_ACTIVE_DOCS = f"INSERT OR IGNORE INTO {DOCS_TABLE}(product_id) SELECT id FROM products WHERE removed_at IS NULL"
+# La colonna id non indicizzata non contribuisce al ranking
+_BM25_WEIGHTS = ', '.join(['0.0', *(str(weight) for _, weight in FTS_COLUMNS)])
+
+_DELETE_BY_PRODUCT_IDS = text(
+    f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT doc_id FROM {DOCS_TABLE} WHERE product_id IN :ids)"
+).bindparams(bindparam('ids', expanding=True))
+
+_ASSIGN_DOCS_BY_PRODUCT_IDS = text(
+    f"INSERT OR IGNORE INTO {DOCS_TABLE}(product_id) SELECT id FROM products WHERE id IN :ids"
+).bindparams(bindparam('ids', expanding=True))
+
+_INSERT_BY_PRODUCT_IDS = text(
+    f"INSERT INTO {FTS_TABLE}(rowid, id, {_COLUMN_LIST}) "
+    f"SELECT d.doc_id, p.id, {_SOURCE_LIST} FROM products AS p "
+    f"JOIN {DOCS_TABLE} AS d ON d.product_id = p.id WHERE p.id IN :ids AND p.removed_at IS NULL"
+).bindparams(bindparam('ids', expanding=True))
+
+_DELETE_REMOVED_PRODUCTS = text(
+    f"DELETE FROM {FTS_TABLE} WHERE rowid IN ("
+    f"SELECT d.doc_id FROM products AS p JOIN {DOCS_TABLE} AS d ON d.product_id = p.id "
+    f"WHERE p.removed_at >= :since)"
+).bindparams(bindparam('since', type_=DateTime))
+
+# Numero massimo di ID per istruzione di aggiornamento dell'indice
+_BATCH_SIZE = 500
+
+# Parole frequenti nelle richieste in italiano che non aiutano la ricerca
+STOPWORDS = frozenset({
+    'che', 'chi', 'con', 'per', 'tra', 'fra', 'una', 'uno', 'del', 'dei', 'degli',
+    'della', 'delle', 'dello', 'dal', 'dai', 'dalla', 'dalle', 'nel', 'nei', 'nella',
+    'nelle', 'sul', 'sui', 'sulla', 'sulle', 'gli', 'non', 'sono', 'come', 'anche',
+    'qualche', 'quali', 'quale', 'prodotti', 'prodotto',
+    # Forme verbali delle richieste ("cerca un tavolo", "vorremmo vedere...")
+    'cerco', 'cerchi', 'cerca', 'cerchiamo', 'cercate', 'cercare', 'cercavo', 'cercando',
+    'trova', 'trovo', 'trovi', 'troviamo', 'trovate', 'trovare', 'trovami', 'trovatemi',
+    'mostra', 'mostri', 'mostrate', 'mostrare', 'mostrami', 'mostratemi', 'mostrarmi',
+    'vorrei', 'vorremmo', 'vorrebbe', 'voglio', 'vogliamo', 'volevo', 'volevamo',
+    'avete', 'hai', 'avere', 'vedere', 'vedi', 'fammi', 'fatemi', 'dammi', 'datemi',
+    'puoi', 'potete', 'posso', 'possiamo', 'sto', 'stiamo',
+})
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+_fts_enabled: Optional[bool] = None
+
+def ensure_search_index(engine):
+    """
+    Crea l'indice full-text se manca e lo popola se è vuoto.
+
+    Args:
+        engine: Engine SQLAlchemy del database
+    """
+    global _fts_enabled
+
+    with engine.begin() as conn:
+        fts_exists = _table_exists(conn, FTS_TABLE)
+        if fts_exists and not _table_exists(conn, DOCS_TABLE):
+            # Indice creato con il rowid di products, non stabile: va ricostruito
+            logger.info("Indice full-text legato al rowid di products: ricostruzione")
+            conn.execute(text(f"DROP TABLE {FTS_TABLE}"))
+        try:
+            conn.execute(text(_CREATE_FTS_TABLE))
+        except Exception as e:
+            logger.warning(f"FTS5 non disponibile, la ricerca userà LIKE: {str(e)}")
+            _fts_enabled = False
+            return
+        conn.execute(text(_CREATE_DOCS_TABLE))
+
+        _fts_enabled = True
+        indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+        if not indexed and conn.execute(text("SELECT 1 FROM products LIMIT 1")).first():
+            logger.info("Popolamento dell'indice full-text dei prodotti")
+            conn.execute(text(_ASSIGN_ACTIVE_DOCS))
+            conn.execute(text(_INDEX_ACTIVE_PRODUCTS))
+
+def _table_exists(conn, name: str) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': name}
+    ).first() is not None
+
+def search_index_enabled(db: Session) -> bool:
+    """
+    Indica se l'indice full-text esiste nel database.
+
+    Args:
+        db (Session): Sessione del database
+
+    Returns:
+        bool: True se la tabella FTS5 è disponibile
+    """
+    global _fts_enabled
+
+    if _fts_enabled is None:
+        _fts_enabled = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': FTS_TABLE}
+        ).first() is not None
+    return _fts_enabled
+
+def rebuild_search_index(db: Session):
+    """
+    Ricostruisce da zero l'indice full-text. Il commit resta al chiamante.
+
+    Args:
+        db (Session): Sessione del database
+    """
+    if not search_index_enabled(db):
+        return
+    db.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.execute(text(f"DELETE FROM {DOCS_TABLE}"))
+    db.execute(text(_ASSIGN_ACTIVE_DOCS))
+    db.execute(text(_INDEX_ACTIVE_PRODUCTS))
+
+def update_search_index(db: Session, product_ids: Sequence[str]):
+    """
+    Reindicizza i prodotti indicati dopo un inserimento o un aggiornamento.
+
+    Args:
+        db (Session): Sessione del database
+        product_ids (Sequence[str]): ID dei prodotti scritti
+    """
+    if not product_ids or not search_index_enabled(db):
+        return
+
+    for start in range(0, len(product_ids), _BATCH_SIZE):
+        batch = list(product_ids[start:start + _BATCH_SIZE])
+        db.execute(_DELETE_BY_PRODUCT_IDS, {'ids': batch})
+        db.execute(_ASSIGN_DOCS_BY_PRODUCT_IDS, {'ids': batch})
+        db.execute(_INSERT_BY_PRODUCT_IDS, {'ids': batch})
+
+def remove_from_search_index(db: Session, product_ids: Sequence[str]):
+    """
+    Rimuove dall'indice i prodotti indicati.
+
+    Args:
+        db (Session): Sessione del database
+        product_ids (Sequence[str]): ID dei prodotti da rimuovere
+    """
+    if not product_ids or not search_index_enabled(db):
+        return
+
+    for start in range(0, len(product_ids), _BATCH_SIZE):
+        db.execute(_DELETE_BY_PRODUCT_IDS, {'ids': list(product_ids[start:start + _BATCH_SIZE])})
+
+def remove_removed_products(db: Session, since):
+    """
+    Rimuove dall'indice i prodotti marcati come rimossi a partire da un istante.
+
+    Args:
+        db (Session): Sessione del database
+        since (datetime): Istante della marcatura (removed_at) dei prodotti da rimuovere
+    """
+    if not search_index_enabled(db):
+        return
+    db.execute(_DELETE_REMOVED_PRODUCTS, {'since': since})
+
+def build_match_query(query_text: str) -> Optional[str]:
+    """
+    Converte il testo dell'utente in un'espressione MATCH di FTS5.
+
+    Ogni termine significativo diventa una ricerca per prefisso; ai termini
+    lunghi viene tolta la vocale finale, così che singolare e plurale
+    italiani coincidano ("tavolo" e "tavoli" -> tavol*).
+
+    Args:
+        query_text (str): Testo della ricerca
+
+    Returns:
+        Optional[str]: Espressione MATCH, o None se non ci sono termini utili
+    """
+    terms = []
+    for token in _TOKEN.findall(query_text.lower()):
+        if len(token) < 3 or token in STOPWORDS or token.isdigit():
+            continue
+        if len(token) >= 5 and token[-1] in 'aeiouàèéìòù':
+            token = token[:-1]
+        if token not in terms:
+            terms.append(token)
+
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_products(db: Session, query_text: str, limit: int = 10) -> Optional[List]:
+    """
+    Cerca i prodotti nell'indice full-text ordinandoli per rilevanza (bm25).
+
+    Args:
+        db (Session): Sessione del database
+        query_text (str): Testo della ricerca
+        limit (int): Numero massimo di risultati
+
+    Returns:
+        Optional[List]: Righe dei prodotti trovati, o None se l'indice non è disponibile
+    """
+    if not search_index_enabled(db):
+        return None
+
+    match = build_match_query(query_text)
+    if match is None:
+        return []
+
+    return db.execute(text(
+        f"SELECT p.id, p.title, p.price, p.sale_price, p.brand, p.availability, p.image_link "
+        f"FROM {FTS_TABLE} JOIN products AS p ON p.id = {FTS_TABLE}.id "
+        f"WHERE {FTS_TABLE} MATCH :match "
+        f"ORDER BY bm25({FTS_TABLE}, {_BM25_WEIGHTS}) "
+        f"LIMIT :limit"
+    ), {'match': match, 'limit': limit}).all()
@@ -0,0 +1,426 @@
+"""
+Indice dei prodotti simili.
+
+Ogni prodotto attivo è descritto da un vettore di caratteristiche: percorsi
+di categoria (con gli antenati), marca, materiale, colore, fascia di prezzo
+e TF-IDF delle parole del titolo. Ogni gruppo di caratteristiche è
+normalizzato e pesato secondo FEATURE_WEIGHTS, così che il prodotto scalare
+tra due vettori sia la media pesata delle similarità del coseno dei gruppi,
+tra 0 e 1.
+
+I candidati di un prodotto sono i CANDIDATE_WINDOW prodotti più vicini per
+prezzo nello stesso blocco (la categoria Google o, in mancanza, il
+product_type). Le similarità sono calcolate con NumPy come prodotto tra
+matrici, per gruppi di righe, e i primi NEIGHBORS di ogni prodotto vengono
+salvati nella sua riga di ProductSimilarity: i simili di un prodotto sono
+poi una lettura sulla chiave primaria.
+
+Dopo ogni importazione vengono ricalcolati solo i prodotti con
+caratteristiche cambiate (impronta in ProductSimilarity), quelli che li
+avevano tra i simili e quelli per cui un prodotto cambiato entra tra i primi
+NEIGHBORS. I simili dei prodotti non ricalcolati restano quelli del calcolo
+precedente: le frequenze delle parole del blocco e la finestra dei candidati
+possono nel frattempo essersi spostate di poco rispetto a un ricalcolo
+completo, che avviene quando cambia più di FULL_REBUILD_SHARE del catalogo.
+
+Senza NumPy l'indice non viene calcolato e i prodotti simili vengono cercati
+per categoria.
+"""
+import hashlib
+import logging
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # dipendenza opzionale: senza NumPy l'indice non viene calcolato
+    np = None
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.models.models import Product, ProductSimilarity
+from app.services.taxonomy import TAXONOMY_FIELDS, PATH_SEPARATOR, path_key, split_category_path
+
+# Logger
+logger = logging.getLogger("similarity")
+
+# Simili conservati per prodotto
+NEIGHBORS = 10
+
+# Candidati valutati per prodotto, i più vicini per prezzo nel blocco
+CANDIDATE_WINDOW = 1000
+
+# Parole dei titoli usate per blocco, le più frequenti tra quelle presenti in almeno due titoli
+MAX_TITLE_TERMS = 512
+
+# Similarità minima di un prodotto simile
+MIN_SCORE = 0.05
+
+# Peso di ogni gruppo di caratteristiche (somma 1)
+FEATURE_WEIGHTS = {
+    'category': 0.25,
+    'brand': 0.15,
+    'material': 0.1,
+    'color': 0.1,
+    'price': 0.1,
+    'title': 0.3,
+}
+
+# Rapporto tra i limiti di due fasce di prezzo consecutive
+PRICE_BAND_RATIO = 1.25
+
+# Quota di prodotti cambiati oltre la quale si ricalcola l'intero indice
+FULL_REBUILD_SHARE = 0.5
+
+# Righe per ogni prodotto tra matrici
+_ROW_CHUNK = 256
+
+_TITLE_TERM = re.compile(r'[^\W\d_]{3,}')
+_VALUE_SEPARATORS = re.compile(r'\s*[/,|]\s*')
+
+_products = Product.__table__
+_similarity = ProductSimilarity.__table__
+
+# Eseguite con executemany direttamente dal driver
+_SAVE_NEIGHBORS = "INSERT OR REPLACE INTO product_similarity (product_id, signature, neighbor_ids, scores) VALUES (?, ?, ?, ?)"
+_DELETE_NEIGHBORS = "DELETE FROM product_similarity WHERE product_id = ?"
+
+_numpy_warning_logged = False
+
+def price_band(price: Optional[float]) -> Optional[int]:
+    """
+    Restituisce la fascia di un prezzo, in scala logaritmica.
+
+    Args:
+        price (float): Prezzo
+
+    Returns:
+        Optional[int]: Fascia, o None se il prezzo manca o non è positivo
+    """
+    if not price or price <= 0:
+        return None
+    return math.floor(math.log(price, PRICE_BAND_RATIO))
+
+def _category_weights(paths: Tuple[Optional[str], ...]) -> Dict[str, float]:
+    """Nodi dei percorsi di categoria e loro antenati: i nodi più profondi sono più specifici."""
+    weights = {}
+    for taxonomy, path in zip(TAXONOMY_FIELDS, paths):
+        segments = split_category_path(path)
+        for depth in range(1, len(segments) + 1):
+            weights[f"{taxonomy}:{PATH_SEPARATOR.join(segments[:depth]).lower()}"] = float(depth)
+    return weights
+
+def _value_weights(value: Optional[str]) -> Dict[str, float]:
+    """Valori di un attributo, anche multipli ("Legno / Metallo"), in minuscolo."""
+    if not value:
+        return {}
+    return {part.lower(): 1.0 for part in _VALUE_SEPARATORS.split(value.strip()) if part}
+
+def _band_weights(band: Optional[int]) -> Dict[int, float]:
+    """Fascia di prezzo; le fasce adiacenti contano a metà."""
+    if band is None:
+        return {}
+    return {band - 1: 0.5, band: 1.0, band + 1: 0.5}
+
+class _Vocabulary:
+    """Valori distinti di un gruppo di caratteristiche, con i pesi già normalizzati."""
+    def __init__(self, group: str, parse: Callable[[Any], Dict[Hashable, float]]):
+        self.scale = math.sqrt(FEATURE_WEIGHTS[group])
+        self.parse = parse
+        self.codes: Dict[Hashable, int] = {}
+        self.weights: List[Dict[Hashable, float]] = []
+
+    def code(self, value: Hashable) -> int:
+        """Codice del valore, calcolandone i pesi alla prima occorrenza."""
+        code = self.codes.get(value)
+        if code is None:
+            weights = self.parse(value)
+            norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+            self.weights.append({key: weight * self.scale / norm for key, weight in weights.items()} if norm else {})
+            code = self.codes[value] = len(self.weights) - 1
+        return code
+
+    def matrix(self, codes: 'np.ndarray') -> 'np.ndarray':
+        """Caratteristiche del gruppo per i codici dati, una riga per codice."""
+        distinct, inverse = np.unique(codes, return_inverse=True)
+        columns: Dict[Hashable, int] = {}
+        for code in distinct.tolist():
+            for key in self.weights[code]:
+                columns.setdefault(key, len(columns))
+        table = np.zeros((len(distinct), len(columns)), dtype=np.float32)
+        for row, code in enumerate(distinct.tolist()):
+            for key, weight in self.weights[code].items():
+                table[row, columns[key]] = weight
+        return table[inverse]
+
+class _Features:
+    """Caratteristiche di un prodotto attivo."""
+    __slots__ = ('product_id', 'block', 'price', 'codes', 'terms', 'signature')
+
+    def __init__(self, product_id, block, price, codes, terms, signature):
+        self.product_id = product_id
+        self.block = block
+        self.price = price
+        self.codes = codes
+        self.terms = terms
+        self.signature = signature
+
+def _load_features(db: Session) -> Tuple[Dict[str, _Features], List[_Vocabulary]]:
+    """Legge le caratteristiche dei prodotti attivi e i vocabolari dei gruppi, tranne il titolo."""
+    vocabularies = [
+        _Vocabulary('category', _category_weights),
+        _Vocabulary('brand', _value_weights),
+        _Vocabulary('material', _value_weights),
+        _Vocabulary('color', _value_weights),
+        _Vocabulary('price', _band_weights),
+    ]
+    category, brand, material, color, price = vocabularies
+    blocks: Dict[Tuple[Optional[str], ...], str] = {}
+
+    columns = [
+        _products.c.id, _products.c.removed_at, _products.c.title, _products.c.price, _products.c.brand,
+        _products.c.material, _products.c.color, *(_products.c[field.key] for field in TAXONOMY_FIELDS.values())
+    ]
+    items = {}
+    # removed_at è filtrato qui, come in update_taxonomy, per non far usare a SQLite l'indice su removed_at
+    for product_id, removed_at, title, product_price, product_brand, product_material, product_color, *paths in db.execute(select(*columns)):
+        if removed_at is not None:
+            continue
+        paths = tuple(paths)
+        block = blocks.get(paths)
+        if block is None:
+            block = blocks[paths] = next((path_key(path) for path in paths if path and path.strip()), '')
+        band = price_band(product_price)
+        # Il prezzo entra nell'impronta solo con la sua fascia
+        signature = hashlib.sha1(
+            f"{title}\x1f{product_brand}\x1f{product_material}\x1f{product_color}\x1f{band}\x1f{paths}".encode('utf-8')
+        ).hexdigest()
+        items[product_id] = _Features(
+            product_id, block, product_price,
+            (category.code(paths), brand.code(product_brand), material.code(product_material),
+             color.code(product_color), price.code(band)),
+            _TITLE_TERM.findall((title or '').lower()),
+            signature
+        )
+    return items, vocabularies
+
+class _Block:
+    """Prodotti di un blocco ordinati per prezzo e loro matrice delle caratteristiche."""
+    def __init__(self, items: List[_Features], vocabularies: List[_Vocabulary]):
+        items.sort(key=lambda item: (item.price is None, item.price or 0, item.product_id))
+        self.items = items
+        self.product_ids = [item.product_id for item in items]
+        self.positions = {product_id: position for position, product_id in enumerate(self.product_ids)}
+
+        codes = np.array([item.codes for item in items], dtype=np.int64)
+        self.matrix = np.hstack([
+            *(vocabulary.matrix(codes[:, index]) for index, vocabulary in enumerate(vocabularies)),
+            self._title_matrix()
+        ])
+
+    def _title_matrix(self) -> 'np.ndarray':
+        """TF-IDF delle parole dei titoli, con le frequenze dei documenti del blocco."""
+        n = len(self.items)
+        document_frequency = Counter(term for item in self.items for term in set(item.terms))
+        terms = [term for term, count in document_frequency.most_common(MAX_TITLE_TERMS) if count >= 2]
+        columns = {term: column for column, term in enumerate(terms)}
+        idf = [math.log((1 + n) / (1 + document_frequency[term])) + 1 for term in terms]
+
+        rows, cols = [], []
+        for row, item in enumerate(self.items):
+            for term in item.terms:
+                column = columns.get(term)
+                if column is not None:
+                    rows.append(row)
+                    cols.append(column)
+
+        matrix = np.zeros((n, len(terms)), dtype=np.float32)
+        # Le parole ripetute nel titolo sommano la loro frequenza
+        np.add.at(matrix, (rows, cols), np.array(idf, dtype=np.float32)[cols])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix *= math.sqrt(FEATURE_WEIGHTS['title']) / np.where(norms > 0, norms, 1)
+        return matrix
+
+    def iter_scores(self, positions: Sequence[int]) -> Iterator[Tuple['np.ndarray', int, 'np.ndarray']]:
+        """
+        Calcola le similarità delle posizioni date con i rispettivi candidati.
+
+        Args:
+            positions (Sequence[int]): Posizioni nel blocco dei prodotti da calcolare
+
+        Yields:
+            Tuple: Posizioni di un gruppo di righe, prima colonna e matrice delle
+                   similarità (-1 fuori dalla finestra di ogni riga e sul prodotto stesso)
+        """
+        group = []
+        for position in sorted(positions):
+            if group and (len(group) == _ROW_CHUNK or position - group[0] > CANDIDATE_WINDOW):
+                yield self._scores(np.array(group))
+                group = []
+            group.append(position)
+        if group:
+            yield self._scores(np.array(group))
+
+    def _scores(self, rows: 'np.ndarray') -> Tuple['np.ndarray', int, 'np.ndarray']:
+        # La finestra di ogni riga comprende CANDIDATE_WINDOW candidati oltre al prodotto stesso
+        size = CANDIDATE_WINDOW + 1
+        starts = np.clip(rows - CANDIDATE_WINDOW // 2, 0, max(len(self.items) - size, 0))
+        first, last = int(starts[0]), min(int(starts[-1]) + size, len(self.items))
+        scores = self.matrix[rows] @ self.matrix[first:last].T
+        columns = np.arange(first, last)
+        scores[(columns < starts[:, None]) | (columns >= starts[:, None] + size)] = -1
+        scores[np.arange(len(rows)), rows - first] = -1
+        return rows, first, scores
+
+    def top_neighbors(self, rows: 'np.ndarray', first: int, scores: 'np.ndarray') -> Dict[str, Tuple[str, str]]:
+        """Primi NEIGHBORS candidati di ogni riga, per similarità decrescente, nel formato di ProductSimilarity."""
+        k = min(NEIGHBORS, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(k), (len(rows), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1) + first
+        top_scores = np.round(np.take_along_axis(top_scores, order, axis=1).astype(np.float64), 4)
+        # I punteggi sono ordinati: i simili validi sono i primi di ogni riga
+        counts = (top_scores >= MIN_SCORE).sum(axis=1)
+
+        product_ids = self.product_ids
+        return {
+            product_ids[row]: (
+                '\n'.join(product_ids[column] for column in columns[:count]),
+                ' '.join(map(str, row_scores[:count]))
+            )
+            for row, columns, row_scores, count in zip(rows.tolist(), top.tolist(), top_scores.tolist(), counts.tolist())
+        }
+
+def update_similarity(db: Session) -> int:
+    """
+    Aggiorna l'indice dei prodotti simili dopo un'importazione. Il commit resta al chiamante.
+
+    Args:
+        db (Session): Sessione del database
+
+    Returns:
+        int: Prodotti di cui sono stati ricalcolati i simili
+    """
+    global _numpy_warning_logged
+
+    if np is None:
+        if not _numpy_warning_logged:
+            logger.warning("NumPy non installato: l'indice dei prodotti simili non viene calcolato")
+            _numpy_warning_logged = True
+        return 0
+
+    items, vocabularies = _load_features(db)
+    stored = {
+        product_id: (signature, neighbor_ids, scores)
+        for product_id, signature, neighbor_ids, scores in db.execute(
+            select(_similarity.c.product_id, _similarity.c.signature, _similarity.c.neighbor_ids, _similarity.c.scores)
+        )
+    }
+    changed = {product_id for product_id, item in items.items() if stored.get(product_id, (None,))[0] != item.signature}
+    removed = [product_id for product_id in stored if product_id not in items]
+    if not changed and not removed:
+        return 0
+
+    full = len(changed) > FULL_REBUILD_SHARE * len(items)
+    stale, thresholds = set(), {}
+    if not full:
+        touched = changed.union(removed)
+        for product_id, (_, neighbor_ids, scores) in stored.items():
+            # Prodotti che avevano tra i simili un prodotto cambiato o rimosso
+            if neighbor_ids and not touched.isdisjoint(neighbor_ids.split('\n')):
+                stale.add(product_id)
+            # Similarità minima tra i simili: un prodotto cambiato che la supera vi entra
+            scores = scores.split()
+            if len(scores) >= NEIGHBORS:
+                thresholds[product_id] = float(scores[-1])
+
+    blocks = defaultdict(list)
+    for item in items.values():
+        blocks[item.block].append(item)
+
+    neighbors = {}
+    for block_items in blocks.values():
+        if not full and not any(item.product_id in changed or item.product_id in stale for item in block_items):
+            continue
+        block = _Block(block_items, vocabularies)
+
+        if full:
+            for rows, first, scores in block.iter_scores(range(len(block.items))):
+                neighbors.update(block.top_neighbors(rows, first, scores))
+            continue
+
+        limits = np.array([thresholds.get(item.product_id, MIN_SCORE) for item in block.items], dtype=np.float32)
+        entering = np.zeros(len(block.items), dtype=bool)
+        changed_positions = [block.positions[product_id] for product_id in changed if product_id in block.positions]
+        for rows, first, scores in block.iter_scores(changed_positions):
+            neighbors.update(block.top_neighbors(rows, first, scores))
+            best = scores.max(axis=0)
+            entering[first:first + len(best)] |= best > limits[first:first + len(best)]
+
+        pending = {block.items[position].product_id for position in np.flatnonzero(entering).tolist()}
+        pending.update(product_id for product_id in stale if product_id in block.positions)
+        for rows, first, scores in block.iter_scores([block.positions[product_id] for product_id in pending - changed]):
+            neighbors.update(block.top_neighbors(rows, first, scores))
+
+    connection = db.connection()
+    if full:
+        db.execute(delete(_similarity))
+    elif removed:
+        connection.exec_driver_sql(_DELETE_NEIGHBORS, [(product_id,) for product_id in removed])
+    if neighbors:
+        connection.exec_driver_sql(_SAVE_NEIGHBORS, [
+            (product_id, items[product_id].signature, neighbor_ids, scores)
+            for product_id, (neighbor_ids, scores) in neighbors.items()
+        ])
+
+    logger.info(
+        f"Indice dei simili aggiornato: {len(neighbors)} prodotti ricalcolati "
+        f"({len(changed)} cambiati, {len(removed)} rimossi{', ricalcolo completo' if full else ''})"
+    )
+    return len(neighbors)
+
+def ensure_similarity(db: Session):
+    """
+    Calcola l'indice dei simili se è vuoto e il catalogo contiene prodotti.
+
+    Args:
+        db (Session): Sessione del database
+    """
+    if np is None or db.execute(select(_similarity.c.product_id).limit(1)).first() is not None:
+        return
+    if db.execute(select(Product.id).where(Product.removed_at.is_(None)).limit(1)).first() is None:
+        return
+    update_similarity(db)
+    db.commit()
+
+def get_neighbor_products(db: Session, product_id: str, limit: int = NEIGHBORS) -> List[Tuple[Product, float]]:
+    """
+    Legge dall'indice i prodotti più simili a un prodotto.
+
+    Args:
+        db (Session): Sessione del database
+        product_id (str): ID del prodotto di riferimento
+        limit (int, optional): Numero massimo di prodotti (al più NEIGHBORS)
+
+    Returns:
+        List[Tuple[Product, float]]: Prodotti simili ancora attivi e similarità, dal più simile
+    """
+    row = db.execute(
+        select(_similarity.c.neighbor_ids, _similarity.c.scores).where(_similarity.c.product_id == product_id)
+    ).first()
+    if row is None or not row.neighbor_ids:
+        return []
+    neighbor_ids = row.neighbor_ids.split('\n')[:limit]
+    scores = [float(score) for score in row.scores.split()]
+    by_id = {p.id: p for p in db.query(Product).filter(Product.id.in_(neighbor_ids))}
+    return [
+        (by_id[neighbor_id], score) for neighbor_id, score in zip(neighbor_ids, scores)
+        if neighbor_id in by_id and by_id[neighbor_id].removed_at is None
+    ]
@@ -0,0 +1,320 @@
+"""
+Albero delle categorie del catalogo.
+
+I percorsi di categoria separati da '>' ("Arredamento > Tavoli > Tavoli da
+pranzo") vengono scomposti in nodi di CategoryNode, uno per prefisso, con
+un albero per ciascun campo (google_product_category e product_type).
+ProductCategory associa ogni prodotto attivo al nodo finale del suo
+percorso e a tutti gli antenati, così che i prodotti di un ramo e i
+conteggi per nodo siano letture indicizzate invece di scansioni LIKE.
+
+L'importatore mantiene l'albero allineato a ogni blocco scritto, come
+l'indice full-text: per i prodotti scritti o rimossi confronta le
+associazioni correnti con quelle attese e aggiorna i conteggi dei nodi
+con incrementi. I nodi senza prodotti vengono eliminati.
+"""
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models.models import CategoryNode, Product, ProductCategory
+
+# Logger
+logger = logging.getLogger("taxonomy")
+
+# Tassonomie e campo del prodotto da cui derivano
+TAXONOMY_GOOGLE = 'google'
+TAXONOMY_PRODUCT_TYPE = 'product_type'
+TAXONOMY_FIELDS = {
+    TAXONOMY_GOOGLE: Product.google_product_category,
+    TAXONOMY_PRODUCT_TYPE: Product.product_type,
+}
+
+PATH_SEPARATOR = ' > '
+_SEGMENT_SEPARATOR = re.compile(r'\s*>\s*')
+
+# Numero massimo di ID per istruzione di aggiornamento
+_BATCH_SIZE = 500
+
+_nodes = CategoryNode.__table__
+_links = ProductCategory.__table__
+_products = Product.__table__
+
+_INCREMENT_COUNTS = update(_nodes).where(_nodes.c.id == bindparam('node_id')).values(
+    product_count=_nodes.c.product_count + bindparam('products'),
+    direct_count=_nodes.c.direct_count + bindparam('direct_products')
+)
+
+# Eseguite con executemany direttamente dal driver: sono le istruzioni più ripetute
+_INSERT_LINK = "INSERT INTO product_categories (node_id, product_id, direct) VALUES (?, ?, ?)"
+_DELETE_LINK = "DELETE FROM product_categories WHERE node_id = ? AND product_id = ?"
+
+def split_category_path(path: Optional[str]) -> List[str]:
+    """
+    Scompone un percorso di categoria nei suoi segmenti.
+
+    Args:
+        path (str): Percorso separato da '>'
+
+    Returns:
+        List[str]: Segmenti non vuoti, con gli spazi normalizzati
+    """
+    if not path:
+        return []
+    return [' '.join(segment.split()) for segment in _SEGMENT_SEPARATOR.split(path) if segment.strip()]
+
+def path_key(path: str) -> str:
+    """Chiave di ricerca di un percorso: segmenti normalizzati e in minuscolo."""
+    return PATH_SEPARATOR.join(split_category_path(path)).lower()
+
+class _NodeIndex:
+    """ID dei nodi per tassonomia e percorso, con creazione dei nodi mancanti."""
+    def __init__(self, db: Session):
+        self.db = db
+        self.ids: Dict[Tuple[str, str], int] = {
+            (taxonomy, key): node_id
+            for node_id, taxonomy, key in db.execute(select(_nodes.c.id, _nodes.c.taxonomy, _nodes.c.path_key))
+        }
+        # Percorsi già risolti, come scritti nel feed: i percorsi distinti sono pochi
+        self._paths: Dict[Tuple[str, Optional[str]], Tuple[int, ...]] = {}
+
+    def path_ids(self, taxonomy: str, path: Optional[str]) -> Tuple[int, ...]:
+        """Restituisce gli ID dei nodi del percorso, dalla radice al nodo finale."""
+        resolved = self._paths.get((taxonomy, path))
+        if resolved is None:
+            resolved = self._paths[(taxonomy, path)] = tuple(self._resolve(taxonomy, path))
+        return resolved
+
+    def _resolve(self, taxonomy: str, path: Optional[str]) -> List[int]:
+        node_ids = []
+        segments = split_category_path(path)
+        for depth in range(1, len(segments) + 1):
+            node_path = PATH_SEPARATOR.join(segments[:depth])
+            key = (taxonomy, node_path.lower())
+            node_id = self.ids.get(key)
+            if node_id is None:
+                node_id = self.db.execute(insert(_nodes).values(
+                    taxonomy=taxonomy,
+                    parent_id=node_ids[-1] if node_ids else None,
+                    name=segments[depth - 1],
+                    path=node_path,
+                    path_key=key[1],
+                    depth=depth,
+                    product_count=0,
+                    direct_count=0
+                )).inserted_primary_key[0]
+                self.ids[key] = node_id
+            node_ids.append(node_id)
+        return node_ids
+
+def update_taxonomy(db: Session, product_ids: Sequence[str]):
+    """
+    Allinea l'albero delle categorie ai prodotti indicati dopo una scrittura
+    o una rimozione. Il commit resta al chiamante.
+
+    Args:
+        db (Session): Sessione del database
+        product_ids (Sequence[str]): ID dei prodotti scritti o rimossi
+    """
+    if not product_ids:
+        return
+
+    nodes = _NodeIndex(db)
+    products, direct_products = Counter(), Counter()
+    for start in range(0, len(product_ids), _BATCH_SIZE):
+        batch = list(product_ids[start:start + _BATCH_SIZE])
+
+        current = {
+            (node_id, product_id): direct
+            for node_id, product_id, direct in db.execute(
+                select(_links.c.node_id, _links.c.product_id, _links.c.direct).where(_links.c.product_id.in_(batch))
+            )
+        }
+        expected = {}
+        # removed_at è filtrato qui: con la condizione nella query SQLite può
+        # preferire l'indice su removed_at, quasi tutto NULL, alla chiave primaria
+        rows = db.execute(
+            select(_products.c.id, _products.c.removed_at, *(_products.c[field.key] for field in TAXONOMY_FIELDS.values()))
+            .where(_products.c.id.in_(batch))
+        )
+        for product_id, removed_at, *paths in rows:
+            if removed_at is not None:
+                continue
+            for taxonomy, path in zip(TAXONOMY_FIELDS, paths):
+                node_ids = nodes.path_ids(taxonomy, path)
+                for node_id in node_ids:
+                    expected[(node_id, product_id)] = False
+                if node_ids:
+                    expected[(node_ids[-1], product_id)] = True
+
+        stale = [link for link, direct in current.items() if expected.get(link) != direct]
+        added = [link for link, direct in expected.items() if current.get(link) != direct]
+        for node_id, product_id in stale:
+            products[node_id] -= 1
+            direct_products[node_id] -= current[(node_id, product_id)]
+        for node_id, product_id in added:
+            products[node_id] += 1
+            direct_products[node_id] += expected[(node_id, product_id)]
+
+        if stale:
+            db.connection().exec_driver_sql(_DELETE_LINK, stale)
+        if added:
+            db.connection().exec_driver_sql(_INSERT_LINK, [
+                (node_id, product_id, expected[(node_id, product_id)]) for node_id, product_id in added
+            ])
+
+    deltas = [
+        {'node_id': node_id, 'products': products[node_id], 'direct_products': direct_products[node_id]}
+        for node_id in products.keys() | direct_products.keys()
+        if products[node_id] or direct_products[node_id]
+    ]
+    if deltas:
+        db.execute(_INCREMENT_COUNTS, deltas)
+        # Un nodo vuoto ha vuoti anche tutti i discendenti
+        db.execute(delete(_nodes).where(_nodes.c.product_count <= 0))
+
+def remove_removed_from_taxonomy(db: Session, since):
+    """
+    Toglie dall'albero i prodotti marcati come rimossi a partire da un istante.
+
+    Args:
+        db (Session): Sessione del database
+        since (datetime): Istante della marcatura (removed_at) dei prodotti da togliere
+    """
+    removed_ids = db.execute(select(_products.c.id).where(_products.c.removed_at >= since)).scalars().all()
+    update_taxonomy(db, removed_ids)
+
+def rebuild_taxonomy(db: Session):
+    """
+    Ricostruisce da zero l'albero delle categorie. Il commit resta al chiamante.
+
+    Args:
+        db (Session): Sessione del database
+    """
+    logger.info("Ricostruzione dell'albero delle categorie")
+    db.execute(delete(_links))
+    db.execute(delete(_nodes))
+    product_ids = db.execute(select(Product.id).where(Product.removed_at.is_(None))).scalars().all()
+    update_taxonomy(db, product_ids)
+
+def ensure_taxonomy(db: Session):
+    """
+    Costruisce l'albero delle categorie se è vuoto e il catalogo contiene prodotti.
+
+    Args:
+        db (Session): Sessione del database
+    """
+    if db.execute(select(_nodes.c.id).limit(1)).first() is not None:
+        return
+    if db.execute(select(Product.id).where(Product.removed_at.is_(None)).limit(1)).first() is None:
+        return
+    rebuild_taxonomy(db)
+    db.commit()
+
+def count_categories(db: Session, taxonomy: str = TAXONOMY_PRODUCT_TYPE) -> int:
+    """
+    Conta le categorie distinte assegnate ai prodotti attivi.
+
+    Args:
+        db (Session): Sessione del database
+        taxonomy (str, optional): Tassonomia
+
+    Returns:
+        int: Nodi che sono il percorso completo di almeno un prodotto
+    """
+    return db.query(func.count(CategoryNode.id)).filter(
+        CategoryNode.taxonomy == taxonomy,
+        CategoryNode.direct_count > 0
+    ).scalar() or 0
+
+def find_category_nodes(db: Session, category: str, taxonomy: Optional[str] = None) -> List[CategoryNode]:
+    """
+    Trova i nodi il cui percorso contiene il testo indicato.
+
+    Dei nodi trovati restano solo i più alti di ogni ramo: i prodotti dei
+    discendenti sono già associati agli antenati.
+
+    Args:
+        db (Session): Sessione del database
+        category (str): Nome o percorso (anche parziale) della categoria
+        taxonomy (str, optional): Tassonomia in cui cercare (tutte se None)
+
+    Returns:
+        List[CategoryNode]: Nodi trovati, per tassonomia e percorso
+    """
+    key = path_key(category)
+    if not key:
+        return []
+
+    query = db.query(CategoryNode).filter(CategoryNode.path_key.contains(key, autoescape=True))
+    if taxonomy is not None:
+        query = query.filter(CategoryNode.taxonomy == taxonomy)
+    matched = query.order_by(CategoryNode.taxonomy, CategoryNode.path_key).all()
+
+    matched_ids = {node.id for node in matched}
+    return [node for node in matched if node.parent_id not in matched_ids]
+
+def get_category_product_ids(db: Session, node_ids: Sequence[int], limit: int = 10) -> List[str]:
+    """
+    Restituisce gli ID dei prodotti attivi dei nodi indicati e dei loro discendenti.
+
+    Ogni nodo è una lettura per intervallo sull'indice di ProductCategory,
+    interrotta appena raggiunto il limite.
+
+    Args:
+        db (Session): Sessione del database
+        node_ids (Sequence[int]): Nodi di categoria
+        limit (int, optional): Numero massimo di prodotti
+
+    Returns:
+        List[str]: ID distinti, nell'ordine dei nodi e poi degli ID
+    """
+    product_ids: Dict[str, None] = {}
+    for node_id in node_ids:
+        if len(product_ids) >= limit:
+            break
+        rows = db.execute(
+            select(_links.c.product_id).where(_links.c.node_id == node_id)
+            .order_by(_links.c.product_id).limit(limit + len(product_ids))
+        ).scalars()
+        for product_id in rows:
+            product_ids.setdefault(product_id)
+            if len(product_ids) >= limit:
+                break
+    return list(product_ids)
+
+def get_category_tree(db: Session, taxonomy: str = TAXONOMY_GOOGLE, max_depth: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Restituisce l'albero delle categorie di una tassonomia.
+
+    Args:
+        db (Session): Sessione del database
+        taxonomy (str, optional): Tassonomia
+        max_depth (int, optional): Profondità massima dei nodi restituiti
+
+    Returns:
+        List[Dict[str, Any]]: Nodi radice con i figli annidati, per nome
+    """
+    query = db.query(
+        CategoryNode.id, CategoryNode.parent_id, CategoryNode.name, CategoryNode.path,
+        CategoryNode.depth, CategoryNode.product_count, CategoryNode.direct_count
+    ).filter(CategoryNode.taxonomy == taxonomy)
+    if max_depth is not None:
+        query = query.filter(CategoryNode.depth <= max_depth)
+
+    children: Dict[Optional[int], List[Dict[str, Any]]] = {}
+    for row in query.order_by(CategoryNode.depth, CategoryNode.name):
+        children.setdefault(row.parent_id, []).append({
+            'id': row.id,
+            'name': row.name,
+            'path': row.path,
+            'depth': row.depth,
+            'product_count': row.product_count,
+            'direct_count': row.direct_count,
+            'children': children.setdefault(row.id, [])
+        })
+    return children.get(None, [])
@@ -0,0 +1,162 @@
+"""
+Parser incrementale per feed JSON di prodotti.
+
+Legge l'array dei prodotti un elemento alla volta da una sequenza di blocchi
+di testo, così che l'occupazione di memoria resti costante indipendentemente
+dalla dimensione del feed. Supporta sia il formato con involucro
+``{"products": [...]}`` sia l'array semplice ``[...]``.
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+# Dimensione dei blocchi letti da file o da HTTP
+CHUNK_SIZE = 64 * 1024
+
+# Soglia oltre la quale il buffer già consumato viene scartato
+_COMPACT_THRESHOLD = 256 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class _JsonTextStream:
+    """
+    Buffer di testo alimentato a blocchi con primitive minime di parsing JSON.
+    """
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Legge un nuovo blocco nel buffer. Restituisce False a fine stream."""
+        if self.eof:
+            return False
+        for chunk in self._chunks:
+            if chunk:
+                if self.pos > _COMPACT_THRESHOLD:
+                    self.buf = self.buf[self.pos:]
+                    self.pos = 0
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def peek(self) -> Optional[str]:
+        """Restituisce il prossimo carattere significativo senza consumarlo."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str):
+        """Consuma il carattere atteso o solleva ValueError."""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"JSON non valido: atteso '{char}', trovato '{found}' (posizione {self.pos})")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decodifica il prossimo valore JSON completo."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # Un valore che termina esattamente a fine buffer potrebbe essere
+            # troncato (es. un numero spezzato tra due blocchi)
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def array_items(self) -> Iterator[Any]:
+        """Itera gli elementi di un array JSON a partire dalla '[' di apertura."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"JSON non valido: separatore '{separator}' inatteso nell'array dei prodotti")
+
+def iter_feed_products(chunks: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Itera i prodotti di un feed JSON letto a blocchi.
+
+    Args:
+        chunks: Sequenza di blocchi di testo del documento JSON
+
+    Yields:
+        Dict[str, Any]: Un prodotto alla volta, nell'ordine del feed
+
+    Raises:
+        ValueError: Se il documento non è un array o un oggetto con chiave "products"
+    """
+    stream = _JsonTextStream(chunks)
+    _seek_products_array(stream)
+    yield from stream.array_items()
+
+def _seek_products_array(stream: _JsonTextStream):
+    """
+    Porta lo stream sulla '[' di apertura dell'array dei prodotti.
+
+    Raises:
+        ValueError: Se il documento non è un array o un oggetto con chiave "products"
+    """
+    first = stream.peek()
+
+    if first == '[':
+        return
+
+    if first != '{':
+        raise ValueError("Formato JSON non riconosciuto")
+
+    # Oggetto con involucro: cerca la chiave "products" saltando le altre
+    stream.expect('{')
+    if stream.peek() == '}':
+        raise ValueError("Formato JSON non riconosciuto")
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == "products":
+            if stream.peek() != '[':
+                raise ValueError("Formato JSON non riconosciuto")
+            return
+        stream.value()
+        separator = stream.peek()
+        stream.pos += 1
+        if separator == '}':
+            raise ValueError("Formato JSON non riconosciuto")
+        if separator != ',':
+            raise ValueError(f"JSON non valido: separatore '{separator}' inatteso")
+
+def iter_file_chunks(path: str, chunk_size: int = CHUNK_SIZE, encoding: str = 'utf-8') -> Iterator[str]:
+    """
+    Legge un file di testo a blocchi.
+
+    Args:
+        path: Percorso del file
+        chunk_size: Numero di caratteri per blocco
+        encoding: Codifica del file
+
+    Yields:
+        str: Blocchi di testo
+    """
+    with open(path, 'r', encoding=encoding) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,225 @@
+"""
+Lettura di un feed JSON su più processi.
+
+Il file viene diviso in frammenti di circa SHARD_BYTES byte, tagliati in
+corrispondenza di un probabile confine tra due prodotti (``},{``). Ogni
+frammento viene decodificato in un processo separato, che applica a ogni
+prodotto una funzione (normalizzazione, validazione) e restituisce i
+risultati; il processo principale li riceve nell'ordine del feed.
+
+Un taglio può cadere dentro un prodotto (ad esempio in una lista di
+oggetti annidata): in quel caso il frammento precedente termina con un
+prodotto troncato e non risulta valido. Poiché il primo frammento parte
+sempre dal primo prodotto, il processo principale convalida i frammenti in
+ordine e, quando un frammento non è valido, lo rielabora unito al
+successivo. Il risultato è quindi identico a quello della lettura
+sequenziale.
+
+Il frazionamento richiede una codifica compatibile con ASCII (UTF-8,
+Latin-1...), così che i byte dei separatori JSON non compaiano all'interno
+di altri caratteri.
+"""
+import codecs
+import json
+import logging
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from app.utils.feed_parser import _WHITESPACE, _JsonTextStream, _seek_products_array
+
+# Logger
+logger = logging.getLogger("feed_shards")
+
+# Dimensione indicativa di un frammento
+SHARD_BYTES = 4 * 1024 * 1024
+
+# Byte letti dall'inizio del file per trovare l'array dei prodotti
+_PREFIX_BYTES = 1024 * 1024
+
+# Byte letti per volta nella ricerca di un taglio
+_CUT_WINDOW = 256 * 1024
+
+# Confine tra due oggetti consecutivi di un array
+_ITEM_BOUNDARY = re.compile(rb'\}[ \t\n\r]*,[ \t\n\r]*\{')
+
+# Codifiche in cui i caratteri ASCII sono rappresentati da un solo byte non ambiguo
+_ASCII_COMPATIBLE = {'utf-8', 'utf-8-sig', 'ascii', 'latin-1', 'iso8859-15', 'cp1252'}
+
+# Esito della decodifica di un frammento
+SHARD_CUT = 'cut'  # frammento consumato fino al taglio, dopo una virgola
+SHARD_END = 'end'  # raggiunta la chiusura dell'array
+SHARD_INVALID = 'invalid'  # JSON non decodificabile: taglio errato o feed non valido
+SHARD_ERROR = 'error'  # errore della funzione applicata ai prodotti
+
+def supports_sharding(encoding: str) -> bool:
+    """
+    Indica se un file con la codifica data può essere frazionato.
+
+    Args:
+        encoding (str): Codifica del file
+
+    Returns:
+        bool: True se la codifica è compatibile con ASCII
+    """
+    try:
+        return codecs.lookup(encoding).name in _ASCII_COMPATIBLE
+    except LookupError:
+        return False
+
+def find_products_start(path: str, encoding: str) -> Optional[int]:
+    """
+    Restituisce la posizione in byte del primo prodotto del feed.
+
+    Args:
+        path (str): Percorso del file
+        encoding (str): Codifica del file
+
+    Returns:
+        Optional[int]: Posizione successiva alla '[' dell'array dei prodotti, o None
+                       se l'array non inizia entro i primi _PREFIX_BYTES byte
+    """
+    with open(path, 'rb') as f:
+        head = f.read(_PREFIX_BYTES)
+    text = codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+
+    stream = _JsonTextStream([text])
+    try:
+        _seek_products_array(stream)
+        stream.expect('[')
+    except ValueError:
+        return None
+    return len(text[:stream.pos].encode(encoding))
+
+def _find_cut(f, position: int, size: int) -> int:
+    """Restituisce la posizione del primo confine tra prodotti da position in poi (o size)."""
+    while position < size:
+        f.seek(position)
+        window = f.read(_CUT_WINDOW)
+        match = _ITEM_BOUNDARY.search(window)
+        if match:
+            return position + match.end() - 1
+        # Sovrapposizione per i confini a cavallo di due finestre
+        position += max(len(window) - 64, 1)
+    return size
+
+def parse_shard(path: str, encoding: str, start: int, stop: int,
+                func: Optional[Callable[[Any], Any]] = None) -> Tuple[str, Any]:
+    """
+    Decodifica i prodotti di un frammento e vi applica func.
+
+    Args:
+        path (str): Percorso del file
+        encoding (str): Codifica del file
+        start (int): Posizione in byte del primo prodotto del frammento
+        stop (int): Posizione in byte della fine del frammento
+        func (Callable, optional): Funzione applicata a ogni prodotto; se None
+                                   il risultato di ogni prodotto è None
+
+    Returns:
+        Tuple[str, Any]: Esito (SHARD_*) e lista dei risultati, o messaggio per SHARD_ERROR
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(stop - start).decode(encoding)
+
+    decoder = json.JSONDecoder()
+    results: List[Any] = []
+    pos = 0
+    length = len(text)
+    while True:
+        pos = _WHITESPACE.match(text, pos).end()
+        if pos >= length:
+            return SHARD_CUT, results
+        if text[pos] == ']' and not results:
+            # Array vuoto: la ']' segue direttamente la '['
+            return SHARD_END, results
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return SHARD_INVALID, None
+        try:
+            results.append(func(item) if func is not None else None)
+        except Exception as e:
+            return SHARD_ERROR, str(e)
+
+        pos = _WHITESPACE.match(text, pos).end()
+        if pos >= length:
+            return SHARD_INVALID, None
+        if text[pos] == ']':
+            return SHARD_END, results
+        if text[pos] != ',':
+            return SHARD_INVALID, None
+        pos += 1
+
+def map_feed_shards(path: str, encoding: str, func: Optional[Callable[[Any], Any]], workers: int,
+                    shard_bytes: int = SHARD_BYTES) -> Iterator[List[Any]]:
+    """
+    Applica func ai prodotti del feed su più processi.
+
+    Args:
+        path (str): Percorso del file
+        encoding (str): Codifica del file (vedi supports_sharding)
+        func (Callable, optional): Funzione applicata a ogni prodotto, eseguita nei
+                                   processi di lavoro (deve essere serializzabile con pickle)
+        workers (int): Numero di processi
+        shard_bytes (int, optional): Dimensione indicativa dei frammenti
+
+    Yields:
+        List[Any]: Risultati di un frammento, nell'ordine del feed
+
+    Raises:
+        ValueError: Se il feed non è un JSON valido, l'array dei prodotti non è
+                    individuabile o func solleva un errore
+    """
+    start = find_products_start(path, encoding)
+    if start is None:
+        raise ValueError("Array dei prodotti non individuato all'inizio del feed")
+    size = os.path.getsize(path)
+
+    # I processi vengono avviati con spawn: il processo principale può avere
+    # altri thread e connessioni al database aperte
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with open(path, 'rb') as f:
+            planned = deque()
+            next_start = start
+
+            def plan():
+                nonlocal next_start
+                while next_start < size and len(planned) < workers * 2:
+                    stop = _find_cut(f, next_start + shard_bytes, size)
+                    planned.append((next_start, stop, pool.submit(parse_shard, path, encoding, next_start, stop, func)))
+                    next_start = stop
+
+            plan()
+            while planned:
+                shard_start, shard_stop, future = planned.popleft()
+                status, results = future.result()
+
+                # Taglio interno a un prodotto: si rielabora il frammento unito al successivo
+                while status == SHARD_INVALID:
+                    plan()
+                    if not planned:
+                        raise ValueError("JSON non valido nell'array dei prodotti")
+                    _, shard_stop, following = planned.popleft()
+                    following.cancel()
+                    logger.debug(f"Frammento {shard_start}-{shard_stop} rielaborato dopo un taglio non valido")
+                    status, results = parse_shard(path, encoding, shard_start, shard_stop, func)
+
+                if status == SHARD_ERROR:
+                    raise ValueError(results)
+
+                yield results
+
+                if status == SHARD_END:
+                    return
+                plan()
+
+        raise ValueError("JSON non valido: array dei prodotti non terminato")
+    finally:
+        # Anche se il chiamante interrompe la lettura i frammenti in coda non vengono elaborati
+        pool.shutdown(wait=True, cancel_futures=True)
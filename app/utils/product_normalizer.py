@@ -0,0 +1,198 @@
+"""
+Normalizzazione dei prodotti letti dal feed.
+
+Il normalizzatore viene compilato una sola volta da uno schema di campi e
+trasforma ogni prodotto del feed, in un unico passaggio sulle sue chiavi,
+in un ProductRecord: i valori dei campi tracciati già convertiti (prezzi
+compresi), il payload normalizzato in JSON canonico e la sua impronta.
+Lo stesso record serve all'inserimento, al confronto con il database e
+alla scrittura del payload grezzo, senza rileggere il dizionario originale.
+"""
+import hashlib
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, Iterable, Optional
+
+# Logger
+logger = logging.getLogger("product_normalizer")
+
+# Parte numerica di un prezzo, con eventuali separatori di migliaia e decimali
+_PRICE_NUMBER = re.compile(r'[-+]?\d[\d.,\' ]*')
+
+def parse_price(value: Any) -> Optional[float]:
+    """
+    Converte un prezzo del feed in numero.
+
+    Accetta numeri e stringhe con valuta e separatori nei formati più
+    comuni dei feed: "129.00 EUR", "EUR 129,00", "1.299,00 €", "1,299.00".
+    Un solo separatore seguito da tre cifre è considerato delle migliaia
+    solo se la parte intera ha da una a tre cifre senza zeri iniziali
+    ("1.299", ma anche "19.990"); altrimenti è quello dei decimali ("0.125",
+    "1234.567"). Nel primo caso il valore resta ambiguo e viene registrato
+    nel log. Gli esempi si verificano con python -m doctest.
+
+    Args:
+        value (Any): Valore del campo prezzo
+
+    Returns:
+        Optional[float]: Prezzo, o None se vuoto o non interpretabile
+
+    Examples:
+        >>> parse_price("1.299,00 €")
+        1299.0
+        >>> parse_price("EUR 129,00")
+        129.0
+        >>> parse_price("1.299")
+        1299.0
+        >>> parse_price("19.990")
+        19990.0
+        >>> parse_price("0.125")
+        0.125
+        >>> parse_price("00,125")
+        0.125
+        >>> parse_price("1234.567")
+        1234.567
+        >>> parse_price("1.234.567")
+        1234567.0
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+
+    match = _PRICE_NUMBER.search(str(value))
+    if not match:
+        logger.debug(f"Prezzo non interpretabile: {value!r}")
+        return None
+
+    number = match.group().strip().replace(' ', '').replace("'", '')
+    last_comma, last_dot = number.rfind(','), number.rfind('.')
+    if last_comma >= 0 and last_dot >= 0:
+        # Il separatore più a destra è quello dei decimali
+        decimal = ',' if last_comma > last_dot else '.'
+        thousands = '.' if decimal == ',' else ','
+        number = number.replace(thousands, '').replace(decimal, '.')
+    elif last_comma >= 0 or last_dot >= 0:
+        separator = ',' if last_comma >= 0 else '.'
+        integer_part, _, decimals = number.rpartition(separator)
+        if number.count(separator) > 1:
+            number = number.replace(separator, '')
+        elif len(decimals) == 3 and _is_thousands_group(integer_part):
+            logger.debug(f"Prezzo ambiguo {value!r}: separatore '{separator}' interpretato come migliaia")
+            number = number.replace(separator, '')
+        else:
+            number = f"{integer_part}.{decimals}"
+
+    try:
+        return float(number.rstrip('.'))
+    except ValueError:
+        logger.debug(f"Prezzo non interpretabile: {value!r}")
+        return None
+
+def _is_thousands_group(integer_part: str) -> bool:
+    """Indica se la parte intera può precedere un gruppo di migliaia (da 1 a 3 cifre, senza zeri iniziali)."""
+    digits = integer_part.lstrip('+-')
+    return 1 <= len(digits) <= 3 and not digits.startswith('0')
+
+def _to_text(value: Any) -> str:
+    return value if isinstance(value, str) else str(value)
+
+class ProductRecord:
+    """
+    Prodotto normalizzato del feed.
+
+    Attributes:
+        id (str): ID del prodotto
+        item_group_id (str): ID del gruppo di prodotti
+        values (tuple): Valori convertiti dei campi dello schema, nell'ordine dello schema
+        present (int): Maschera di bit dei campi dello schema presenti nel feed
+        payload_json (bytes): Payload normalizzato in JSON canonico (chiavi ordinate)
+        content_hash (str): Digest SHA-1 di payload_json
+    """
+    __slots__ = ('id', 'item_group_id', 'values', 'present', 'payload_json', 'content_hash')
+
+    def __init__(self, id, item_group_id, values, present, payload_json, content_hash):
+        self.id = id
+        self.item_group_id = item_group_id
+        self.values = values
+        self.present = present
+        self.payload_json = payload_json
+        self.content_hash = content_hash
+
+    def has(self, index: int) -> bool:
+        """Indica se il campo di indice dato era presente nel feed."""
+        return bool(self.present >> index & 1)
+
+    def __repr__(self):
+        return f"<ProductRecord(id='{self.id}', hash='{self.content_hash}')>"
+
+class ProductNormalizer:
+    """
+    Normalizzatore compilato da uno schema di campi.
+    """
+    def __init__(self, fields: Iterable[str], converters: Dict[str, Callable[[Any], Any]] = None):
+        """
+        Compila lo schema.
+
+        Args:
+            fields (Iterable[str]): Campi convertiti nel record, nell'ordine di ProductRecord.values
+            converters (Dict[str, Callable], optional): Convertitori per campo; gli altri campi
+                                                        sono convertiti in stringa
+        """
+        converters = converters or {}
+        self.fields = tuple(fields)
+        self._slots = {
+            field: (index, converters.get(field, _to_text)) for index, field in enumerate(self.fields)
+        }
+        # Valori dei campi assenti dal feed, come se valessero ''
+        self._defaults = tuple(converters.get(field, _to_text)('') for field in self.fields)
+
+    def normalize(self, product_data: Dict[str, Any]) -> ProductRecord:
+        """
+        Normalizza un prodotto del feed.
+
+        Nel payload le liste vengono codificate in JSON e i valori None
+        sostituiti da stringhe vuote; l'impronta è calcolata sul payload
+        serializzato con chiavi ordinate.
+
+        Args:
+            product_data (Dict[str, Any]): Dati grezzi del prodotto
+
+        Returns:
+            ProductRecord: Record normalizzato (id None se il prodotto non ha ID)
+
+        Raises:
+            ValueError: Se il prodotto non è un oggetto JSON
+        """
+        if not isinstance(product_data, dict):
+            raise ValueError(f"Prodotto non valido, atteso un oggetto JSON: {str(product_data)[:100]}")
+        slots = self._slots
+        payload = {}
+        values = list(self._defaults)
+        present = 0
+
+        for key, value in product_data.items():
+            if value is None:
+                value = ''
+            elif isinstance(value, list):
+                value = json.dumps(value)
+            payload[key] = value
+
+            slot = slots.get(key)
+            if slot is not None:
+                index, convert = slot
+                values[index] = convert(value)
+                present |= 1 << index
+
+        payload_json = json.dumps(payload, sort_keys=True, separators=(',', ':'),
+                                  ensure_ascii=False, default=str).encode('utf-8')
+        product_id = payload.get('id')
+        return ProductRecord(
+            id=_to_text(product_id) if product_id else None,
+            item_group_id=_to_text(payload.get('item_group_id', '')),
+            values=tuple(values),
+            present=present,
+            payload_json=payload_json,
+            content_hash=hashlib.sha1(payload_json).hexdigest()
+        )
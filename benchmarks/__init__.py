@@ -0,0 +1,7 @@
+"""
+Benchmark dell'applicazione FeedWise.
+
+Gli script di questo package non fanno parte dell'applicazione: si avviano
+con ``python -m benchmarks.<nome>`` dalla radice del repository e lavorano
+su database temporanei.
+"""
@@ -0,0 +1,295 @@
+"""
+Latenza delle API sotto carico concorrente.
+
+Crea un database temporaneo con un catalogo sintetico (importato con
+CatalogImporter da un feed di feed_generator), avvia l'applicazione da
+create_app in un processo separato con il server WSGI di werkzeug e la
+interroga con più client concorrenti su /api/products, /api/dashboard e
+/api/chat. La chiamata a OpenAI è sostituita da una risposta fissa con
+latenza configurabile, così che si misuri solo il lavoro dell'applicazione.
+
+Modelli di concorrenza:
+
+- ``closed``: ogni client invia la richiesta successiva appena riceve la
+  risposta alla precedente;
+- ``open``: le richieste arrivano a frequenza costante (``--rate`` al
+  secondo) e sono servite da tanti thread quanti i client; la latenza è
+  misurata dall'istante di arrivo previsto, includendo l'attesa in coda.
+
+Con ``--during-import`` ogni misura viene ripetuta mentre il server esegue
+un'importazione di una nuova versione del feed, avviata da /api/import e
+letta da un server HTTP locale.
+
+Uso:
+    python -m benchmarks.api_load [--products 100000] [--clients 10 50 200]
+                                  [--endpoints products dashboard chat] [--duration 10]
+                                  [--model closed|open] [--rate 200] [--during-import] [--json]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from benchmarks.feed_generator import write_feed
+from benchmarks.import_bench import FEED_NAME, _FeedHandler, git_commit, run_import, start_feed_server
+
+ENDPOINTS = ('products', 'dashboard', 'chat')
+
+# Domande inviate a /api/chat: coprono i diversi rami di execute_query
+CHAT_MESSAGES = (
+    "Mostrami le statistiche del catalogo",
+    "Quali sono le modifiche recenti?",
+    "Dimmi tutto sul prodotto BENCH0000042",
+    "Quali prodotti hanno un costo sotto 300 euro?",
+    "Che sedie avete in rovere?",
+)
+
+# Percentili riportati per ogni misura
+PERCENTILES = (50, 95, 99)
+
+def serve(database_path: str, chat_latency: float, ready):
+    """
+    Avvia l'applicazione nel processo corrente e la serve fino alla terminazione.
+
+    Args:
+        database_path (str): Database da usare
+        chat_latency (float): Secondi di attesa della risposta simulata di OpenAI
+        ready: Coda su cui pubblicare la porta del server
+    """
+    from unittest import mock
+    from werkzeug.serving import make_server
+
+    from app import create_app
+    from app.config import TestingConfig
+
+    class BenchmarkConfig(TestingConfig):
+        DEBUG = False
+        TESTING = False
+        DATABASE_PATH = database_path
+
+    def fake_openai(messages, *args, **kwargs):
+        time.sleep(chat_latency)
+        return "Risposta simulata dell'assistente."
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app(BenchmarkConfig)
+    with mock.patch('app.services.ai_assistant.query_openai', fake_openai):
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        ready.put(server.server_port)
+        server.serve_forever()
+
+def make_request(session: requests.Session, base_url: str, endpoint: str, rng: random.Random, products: int):
+    """Invia una richiesta all'endpoint indicato e restituisce lo status HTTP."""
+    if endpoint == 'products':
+        params = {'limit': 50, 'after': f"BENCH{rng.randrange(products):07d}"}
+        if rng.random() < 0.3:
+            params['brand'] = rng.choice(('Fiver', 'Nordico', 'Casa Design'))
+        response = session.get(f"{base_url}/api/products", params=params)
+    elif endpoint == 'dashboard':
+        response = session.get(f"{base_url}/api/dashboard")
+    else:
+        response = session.post(f"{base_url}/api/chat", json={
+            'message': rng.choice(CHAT_MESSAGES), 'conversation_history': []
+        })
+    response.content
+    return response.status_code
+
+def run_closed(base_url: str, endpoint: str, clients: int, duration: float, products: int) -> tuple:
+    """Carico a ciclo chiuso. Restituisce (latenze in secondi, errori, durata effettiva)."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        own = []
+        failed = 0
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    ok = make_request(session, base_url, endpoint, rng, products) < 400
+                except requests.RequestException:
+                    ok = False
+                own.append(time.perf_counter() - start)
+                failed += not ok
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+def run_open(base_url: str, endpoint: str, clients: int, duration: float, products: int, rate: float) -> tuple:
+    """Carico a ciclo aperto. Restituisce (latenze in secondi, errori, durata effettiva)."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(scheduled, seed):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        try:
+            ok = make_request(local.session, base_url, endpoint, random.Random(seed), products) < 400
+        except requests.RequestException:
+            ok = False
+        with lock:
+            latencies.append(time.perf_counter() - scheduled)
+            errors[0] += not ok
+
+    started = time.perf_counter()
+    interval = 1.0 / rate
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for sent in range(int(duration * rate)):
+            scheduled = started + sent * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, scheduled, sent)
+    return latencies, errors[0], time.perf_counter() - started
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    """Percentili di latenza (ms, nearest-rank) e throughput di una misura."""
+    ordered = sorted(latencies)
+    result = {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+    }
+    for percentile in PERCENTILES:
+        rank = max(0, -(-percentile * len(ordered) // 100) - 1)
+        result[f'p{percentile}_ms'] = round(ordered[rank] * 1000, 2) if ordered else None
+    result['max_ms'] = round(ordered[-1] * 1000, 2) if ordered else None
+    return result
+
+def _parse_time(value: str) -> datetime:
+    """Converte un istante ISO restituito dalle API (UTC) in datetime con fuso."""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+class ImportDriver:
+    """Avvia importazioni di nuove versioni del feed sul server sotto misura."""
+    def __init__(self, base_url: str, workdir: str, products: int, churn: float):
+        self.base_url = base_url
+        self.feed_path = os.path.join(workdir, FEED_NAME)
+        self.products = products
+        self.churn = churn
+        self.version = 0
+        self.server, self.feed_url = start_feed_server(self.feed_path)
+
+    def start(self) -> str:
+        """Pubblica la versione successiva del feed, avvia l'importazione e ne attende l'inizio."""
+        self.version += 1
+        write_feed(self.feed_path, self.products, self.churn, self.version)
+        _FeedHandler.etag = f'"v{self.version}"'
+        response = requests.post(f"{self.base_url}/api/import", json={
+            'source_type': 'url', 'url': self.feed_url, 'version_label': f'load_v{self.version}'
+        })
+        job_id = response.json()['job']['id']
+        while self.status(job_id)['state'] == 'queued':
+            time.sleep(0.05)
+        return job_id
+
+    def status(self, job_id: str) -> dict:
+        return requests.get(f"{self.base_url}/api/import/{job_id}").json()
+
+    def wait(self, job_id: str) -> dict:
+        """Attende la fine dell'importazione e ne restituisce lo stato finale."""
+        while True:
+            job = self.status(job_id)
+            if job['state'] in ('completed', 'failed'):
+                return job
+            time.sleep(0.2)
+
+    def close(self):
+        self.server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--duration', type=float, default=10.0, help="Secondi di carico per misura")
+    parser.add_argument('--model', choices=('closed', 'open'), default='closed')
+    parser.add_argument('--rate', type=float, default=200.0, help="Richieste al secondo (modello open)")
+    parser.add_argument('--chat-latency', type=float, default=0.0, help="Secondi di attesa simulati per OpenAI")
+    parser.add_argument('--during-import', action='store_true', help="Ripete le misure durante un'importazione")
+    parser.add_argument('--churn', type=float, default=5.0, help="Churn delle versioni importate durante il carico")
+    parser.add_argument('--json', action='store_true', help="Stampa i risultati in formato JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='feedwise-bench-')
+    context = multiprocessing.get_context('spawn')
+    server = driver = None
+    try:
+        # Catalogo iniziale, importato in un processo separato
+        database_path = os.path.join(workdir, 'load.db')
+        feed_path = os.path.join(workdir, 'initial.json')
+        write_feed(feed_path, args.products)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            pool.submit(run_import, database_path, feed_path, None, 'load_v0').result()
+        os.remove(feed_path)
+
+        ready = context.Queue()
+        server = context.Process(target=serve, args=(database_path, args.chat_latency, ready), daemon=True)
+        server.start()
+        base_url = f"http://127.0.0.1:{ready.get(timeout=60)}"
+        if args.during_import:
+            driver = ImportDriver(base_url, workdir, args.products, args.churn)
+
+        runs = []
+        for during_import in ([False, True] if args.during_import else [False]):
+            for endpoint in args.endpoints:
+                for clients in args.clients:
+                    job_id = driver.start() if during_import else None
+                    load_started = datetime.now(timezone.utc)
+                    if args.model == 'closed':
+                        measured = run_closed(base_url, endpoint, clients, args.duration, args.products)
+                    else:
+                        measured = run_open(base_url, endpoint, clients, args.duration, args.products, args.rate)
+                    run = dict(endpoint=endpoint, clients=clients, model=args.model,
+                               during_import=during_import, **summarize(*measured))
+                    if job_id:
+                        # L'importazione può terminare prima della fine della misura
+                        job = driver.wait(job_id)
+                        started, finished = _parse_time(job['started_at']), _parse_time(job['finished_at'])
+                        run['import_seconds'] = round((finished - started).total_seconds(), 2)
+                        run['import_overlap_seconds'] = round(min(measured[2], (finished - load_started).total_seconds()), 2)
+                        run['import_state'] = job['state']
+                    runs.append(run)
+    finally:
+        if driver is not None:
+            driver.close()
+        if server is not None:
+            server.terminate()
+            server.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({'commit': git_commit(), 'products': args.products, 'duration': args.duration,
+                          'runs': runs}, indent=2))
+        return
+
+    for run in runs:
+        suffix = ' durante import' if run['during_import'] else ''
+        print(f"== {run['endpoint']} x{run['clients']} ({run['model']}{suffix}): "
+              f"{run['throughput_rps']} req/s, p50 {run['p50_ms']} ms, p95 {run['p95_ms']} ms, "
+              f"p99 {run['p99_ms']} ms, errori {run['errors']}/{run['requests']}")
+
+if __name__ == '__main__':
+    main()
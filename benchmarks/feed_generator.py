@@ -0,0 +1,149 @@
+"""
+Generatore di feed sintetici per i benchmark di importazione.
+
+Produce feed JSON nel formato del fornitore (``{"products": [...]}``) con i
+campi del modello Product. Le versioni successive alla prima applicano una
+percentuale di churn cumulativa rispetto alla versione precedente: la
+maggior parte dei prodotti coinvolti cambia prezzo e disponibilità, una
+parte esce dal feed e altrettanti prodotti nuovi vi entrano. Il contenuto
+dipende solo da dimensione, churn, versione e seme, quindi due esecuzioni
+con gli stessi parametri producono file identici.
+
+Uso:
+    python -m benchmarks.feed_generator --items 100000 [--churn 5] [--versions 2] [--output DIR]
+"""
+import argparse
+import json
+import os
+import random
+from typing import Any, Dict, Iterator
+
+BRANDS = ('Fiver', 'Mobili Fiver', 'Casa Design', 'Legno Italia', 'Arredo Pro', 'Nordico')
+CATEGORIES = ('Arredamento > Tavoli', 'Arredamento > Sedie', 'Arredamento > Librerie',
+              'Arredamento > Cassettiere', 'Arredamento > Scaffali')
+COLORS = ('Rovere', 'Noce', 'Bianco', 'Antracite', 'Cemento', 'Frassino')
+MATERIALS = ('Legno', 'Nobilitato', 'Metallo', 'Vetro')
+AVAILABILITY = ('in stock', 'in stock', 'in stock', 'out of stock', 'preorder')
+
+# Ripartizione del churn di ogni versione tra modifiche, rimozioni e aggiunte
+REMOVED_SHARE = 0.1
+ADDED_SHARE = 0.1
+
+def make_product(index: int, revision: int = 0) -> Dict[str, Any]:
+    """
+    Costruisce il prodotto sintetico di indice dato.
+
+    Args:
+        index (int): Indice del prodotto, determina ID e attributi stabili
+        revision (int, optional): Numero di modifiche subite, determina prezzo e disponibilità
+
+    Returns:
+        Dict[str, Any]: Prodotto nel formato del feed
+    """
+    rng = random.Random(index)
+    category = CATEGORIES[index % len(CATEGORIES)]
+    name = category.split(' > ')[-1]
+    price = round(rng.uniform(20, 2000) * (1 + 0.03 * revision), 2)
+    on_sale = rng.random() < 0.2
+    product_id = f"BENCH{index:07d}"
+    return {
+        "id": product_id,
+        "item_group_id": f"G{index // 4:06d}",
+        "title": f"{name} {rng.choice(COLORS)} {index}",
+        "description": f"Articolo sintetico {index} della categoria {category}. " * 3,
+        "price": f"{price:.2f}",
+        "sale_price": f"{price * 0.8:.2f}" if on_sale else "",
+        "brand": BRANDS[index % len(BRANDS)],
+        "condition": "new",
+        "availability": AVAILABILITY[(index + revision) % len(AVAILABILITY)],
+        "availability_date": "",
+        "color": rng.choice(COLORS),
+        "material": rng.choice(MATERIALS),
+        "mpn": f"MPN-{index:07d}",
+        "google_product_category": category,
+        "product_type": f"Mobili > {name}",
+        "link": f"https://example.com/p/{product_id}",
+        "mobile_link": f"https://m.example.com/p/{product_id}",
+        "image_link": f"https://cdn.example.com/img/{product_id}.jpg",
+        "additional_image_links": [f"https://cdn.example.com/img/{product_id}_{n}.jpg" for n in range(1, 4)],
+        "custom_label_1": f"lotto-{index % 50}",
+        "custom_label_2": "",
+        "custom_label_3": "",
+        "custom_label_4": ""
+    }
+
+def iter_products(items: int, churn: float = 0.0, version: int = 0, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    """
+    Itera i prodotti di una versione del feed.
+
+    Args:
+        items (int): Numero di prodotti della versione 0
+        churn (float, optional): Percentuale di prodotti coinvolti da ogni versione
+        version (int, optional): Versione del feed (0 = catalogo iniziale)
+        seed (int, optional): Seme della scelta dei prodotti coinvolti
+
+    Yields:
+        Dict[str, Any]: Prodotti nell'ordine del feed
+    """
+    revisions: Dict[int, int] = {}
+    removed = set()
+    added = 0
+    affected = int(items * churn / 100)
+
+    for current in range(1, version + 1):
+        rng = random.Random(seed * 1000 + current)
+        sample = rng.sample(range(items), affected)
+        to_remove = int(affected * REMOVED_SHARE)
+        removed.update(sample[:to_remove])
+        for index in sample[to_remove:]:
+            revisions[index] = revisions.get(index, 0) + 1
+        added += int(affected * ADDED_SHARE)
+
+    for index in range(items):
+        if index not in removed:
+            yield make_product(index, revisions.get(index, 0))
+    for index in range(items, items + added):
+        yield make_product(index)
+
+def write_feed(path: str, items: int, churn: float = 0.0, version: int = 0, seed: int = 42) -> int:
+    """
+    Scrive una versione del feed su file, un prodotto alla volta.
+
+    Args:
+        path (str): Percorso del file JSON
+        items (int): Numero di prodotti della versione 0
+        churn (float, optional): Percentuale di prodotti coinvolti da ogni versione
+        version (int, optional): Versione del feed
+        seed (int, optional): Seme della scelta dei prodotti coinvolti
+
+    Returns:
+        int: Numero di prodotti scritti
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"products": [')
+        for product in iter_products(items, churn, version, seed):
+            if count:
+                f.write(',\n')
+            f.write(json.dumps(product, ensure_ascii=False))
+            count += 1
+        f.write(']}\n')
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--churn', type=float, default=5.0, help="Percentuale di churn per versione")
+    parser.add_argument('--versions', type=int, default=2, help="Numero di versioni da generare")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='.', help="Cartella dei file generati")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for version in range(args.versions):
+        path = os.path.join(args.output, f"feed_{args.items}_v{version}.json")
+        count = write_feed(path, args.items, args.churn, version, args.seed)
+        print(f"{path}: {count} prodotti, {os.path.getsize(path)} byte")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmark dell'importazione del catalogo su feed sintetici.
+
+Per ciascuna dimensione richiesta crea un database temporaneo, importa la
+versione 0 del feed generato da feed_generator e poi le versioni
+successive con il churn indicato, misurando tempo reale, picco di memoria,
+righe al secondo e dimensione del database. Ogni importazione gira in un
+processo nuovo, così che il picco di memoria sia quello della singola
+esecuzione. Il feed viene letto da file oppure, con ``--http``, da un
+server HTTP locale che fa le veci del fornitore.
+
+Con ``--json`` i risultati includono il commit corrente, per confrontare
+le esecuzioni di versioni diverse del codice.
+
+Uso:
+    python -m benchmarks.import_bench [--items 10000 100000 1000000] [--churn 5]
+                                      [--versions 2] [--http] [--parse-workers 4]
+                                      [--json] [--output FILE]
+"""
+import argparse
+import http.server
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.feed_generator import write_feed
+
+FEED_NAME = 'feed.json'
+
+class _FeedHandler(http.server.BaseHTTPRequestHandler):
+    """Serve il feed corrente con un ETag pari alla sua versione."""
+    feed_path = None
+    etag = None
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(os.path.getsize(self.feed_path)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        with open(self.feed_path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_feed_server(feed_path: str):
+    """Avvia il server HTTP locale del feed. Restituisce (server, url)."""
+    _FeedHandler.feed_path = feed_path
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _FeedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/{FEED_NAME}"
+
+def run_import(database_path: str, feed_path: str, source_url: str, version_label: str,
+               parse_workers: int = 0) -> dict:
+    """
+    Esegue un'importazione nel processo corrente e ne restituisce le misure.
+
+    Il tempo e il picco di memoria sono quelli registrati dall'importatore
+    su CatalogSync.metrics; il tempo reale complessivo comprende anche la
+    creazione dell'importatore.
+    """
+    from app import create_app
+    from app.config import TestingConfig
+    from app.models.database import ensure_db_initialized, get_db
+    from app.services.catalog_importer import CatalogImporter
+
+    class BenchmarkConfig(TestingConfig):
+        DEBUG = False
+        DATABASE_PATH = database_path
+
+    create_app(BenchmarkConfig)
+    ensure_db_initialized()
+
+    with get_db() as db:
+        start = time.perf_counter()
+        importer = CatalogImporter(db, source_url=source_url, json_file=None if source_url else feed_path,
+                                   version_label=version_label, parse_workers=parse_workers)
+        success = importer.import_catalog()
+        elapsed = time.perf_counter() - start
+        sync = importer.sync_record
+        return {
+            'success': success,
+            'error': sync.error_message,
+            'wall_seconds': round(elapsed, 3),
+            'products_total': sync.products_total,
+            'products_added': sync.products_added,
+            'products_updated': sync.products_updated,
+            'products_removed': sync.products_removed,
+            'metrics': sync.metrics
+        }
+
+def database_size(database_path: str) -> int:
+    """Dimensione del database dopo il checkpoint del WAL, in byte."""
+    with sqlite3.connect(database_path) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return sum(os.path.getsize(path) for path in (database_path, database_path + '-wal')
+               if os.path.exists(path))
+
+def git_commit():
+    """Commit corrente del repository, se disponibile."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_size(workdir: str, items: int, churn: float, versions: int, use_http: bool, seed: int,
+               parse_workers: int = 0) -> list:
+    """Importa le versioni del feed di una dimensione e restituisce una misura per versione."""
+    database_path = os.path.join(workdir, f'bench_{items}.db')
+    feed_path = os.path.join(workdir, FEED_NAME)
+    server, source_url = start_feed_server(feed_path) if use_http else (None, None)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for version in range(versions):
+            count = write_feed(feed_path, items, churn, version, seed)
+            _FeedHandler.etag = f'"v{version}"'
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                run = pool.submit(run_import, database_path, feed_path, source_url,
+                                  f'bench_{items}_v{version}', parse_workers).result()
+
+            metrics = run.pop('metrics') or {}
+            results.append(dict(
+                items=items,
+                version=version,
+                churn=churn if version else 0.0,
+                source='http' if use_http else 'file',
+                parse_workers=parse_workers,
+                feed_items=count,
+                feed_bytes=os.path.getsize(feed_path),
+                rows_per_second=round(count / run['wall_seconds'], 1) if run['wall_seconds'] else None,
+                peak_rss_bytes=metrics.get('peak_rss_bytes'),
+                db_bytes=database_size(database_path),
+                phases=metrics.get('phases', {}),
+                **run
+            ))
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--churn', type=float, default=5.0, help="Percentuale di churn per versione")
+    parser.add_argument('--versions', type=int, default=2, help="Versioni importate per dimensione")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--http', action='store_true', help="Legge il feed da un server HTTP locale")
+    parser.add_argument('--parse-workers', type=int, default=0, help="Processi per la lettura del feed")
+    parser.add_argument('--json', action='store_true', help="Stampa i risultati in formato JSON")
+    parser.add_argument('--output', help="Salva i risultati JSON nel file indicato")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='feedwise-bench-')
+    try:
+        runs = []
+        for items in args.items:
+            runs.extend(bench_size(workdir, items, args.churn, args.versions, args.http, args.seed,
+                                   args.parse_workers))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for run in runs:
+        peak = f"{run['peak_rss_bytes'] / 2**20:.0f} MiB" if run['peak_rss_bytes'] else 'n/d'
+        print(f"== {run['items']} prodotti v{run['version']} ({run['source']}): "
+              f"{run['wall_seconds']} s, {run['rows_per_second']} righe/s, picco {peak}, "
+              f"db {run['db_bytes'] / 2**20:.1f} MiB "
+              f"(+{run['products_added']} ~{run['products_updated']} -{run['products_removed']})")
+
+if __name__ == '__main__':
+    main()
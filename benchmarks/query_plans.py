@@ -0,0 +1,172 @@
+"""
+Piani di esecuzione delle query del catalogo prima e dopo gli indici gestiti.
+
+Crea un database temporaneo con dati sintetici, lo riporta al solo insieme
+di indici delle versioni precedenti e misura le query eseguite da
+catalog_query e dalla dashboard; poi applica ensure_indexes() e ripete.
+
+Uso:
+    python -m benchmarks.query_plans [--products 20000] [--changes 200000] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+# Query misurate: (nome, SQL, parametri)
+QUERIES = (
+    ("recent_changes_grouped",
+     "SELECT product_id, count(id) AS change_count FROM product_changes "
+     "WHERE changed_at >= :since GROUP BY product_id ORDER BY change_count DESC LIMIT 10",
+     {'since': 'SINCE'}),
+    ("product_change_history",
+     "SELECT * FROM product_changes WHERE product_id = :product_id AND changed_at >= :since "
+     "ORDER BY changed_at DESC",
+     {'product_id': 'P000042', 'since': 'SINCE'}),
+    ("sync_changes",
+     "SELECT product_id, count(*) FROM product_changes WHERE sync_id = :sync_id GROUP BY product_id",
+     {'sync_id': 3}),
+    ("products_by_price",
+     "SELECT id, title, price FROM products WHERE price >= :min_price AND price <= :max_price LIMIT 10",
+     {'min_price': 100.0, 'max_price': 110.0}),
+    ("price_stats",
+     "SELECT avg(price), min(price), max(price) FROM products", {}),
+    ("top_brands",
+     "SELECT brand, count(id) AS count FROM products GROUP BY brand ORDER BY count DESC LIMIT 5", {}),
+    ("unique_brands",
+     "SELECT count(DISTINCT brand) FROM products", {}),
+    ("unique_categories",
+     "SELECT count(DISTINCT product_type) FROM products", {}),
+    ("products_by_availability",
+     "SELECT id, title FROM products WHERE availability = :availability LIMIT 100",
+     {'availability': 'preorder'}),
+    ("products_by_category",
+     "SELECT id, title FROM products WHERE google_product_category = :category LIMIT 100",
+     {'category': 'Arredamento > Sedie'}),
+    ("last_sync",
+     "SELECT id FROM catalog_syncs ORDER BY completed_at DESC LIMIT 1", {}),
+)
+
+# Indici presenti prima dell'introduzione degli indici gestiti
+LEGACY_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_product_changes_product_id ON product_changes (product_id)",
+    "CREATE INDEX IF NOT EXISTS ix_product_changes_sync_id ON product_changes (sync_id)",
+)
+
+BRANDS = ('Fiver', 'Mobili Fiver', 'Casa Design', 'Legno Italia', 'Arredo Pro', 'Nordico')
+CATEGORIES = ('Arredamento > Tavoli', 'Arredamento > Sedie', 'Arredamento > Librerie',
+              'Arredamento > Cassettiere', 'Arredamento > Scaffali')
+AVAILABILITY = ('in stock', 'in stock', 'in stock', 'out of stock', 'preorder')
+FIELDS = ('price', 'sale_price', 'availability', 'title')
+
+def populate(conn, products: int, changes: int, syncs: int = 30):
+    """Inserisce prodotti, sincronizzazioni e modifiche sintetiche."""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    conn.execute(text(
+        "INSERT INTO catalog_syncs (id, started_at, completed_at, success, import_version) "
+        "VALUES (:id, :ts, :ts, 1, :version)"
+    ), [{'id': i, 'ts': now - timedelta(days=syncs - i), 'version': f'bench_{i}'} for i in range(1, syncs + 1)])
+
+    conn.execute(text(
+        "INSERT INTO products (id, title, price, brand, availability, google_product_category, product_type) "
+        "VALUES (:id, :title, :price, :brand, :availability, :category, :category)"
+    ), [{
+        'id': f'P{i:06d}',
+        'title': f'Prodotto {i}',
+        'price': round(rng.uniform(20, 2000), 2),
+        'brand': rng.choice(BRANDS),
+        'availability': rng.choice(AVAILABILITY),
+        'category': rng.choice(CATEGORIES),
+    } for i in range(products)])
+
+    conn.execute(text(
+        "INSERT INTO product_changes (product_id, sync_id, field_name, old_value, new_value, changed_at) "
+        "VALUES (:product_id, :sync_id, :field, 'a', 'b', :changed_at)"
+    ), [{
+        'product_id': f'P{rng.randrange(products):06d}',
+        'sync_id': sync_id,
+        'field': rng.choice(FIELDS),
+        'changed_at': now - timedelta(days=syncs - sync_id, seconds=rng.randrange(3600)),
+    } for sync_id in (rng.randint(1, syncs) for _ in range(changes))])
+
+def reset_to_legacy_indexes(conn, metadata):
+    """Elimina gli indici gestiti e ricrea quelli delle versioni precedenti."""
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            if not index.unique and index.name != 'ix_products_item_group_id':
+                conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    for statement in LEGACY_INDEXES:
+        conn.execute(text(statement))
+    conn.execute(text("ANALYZE"))
+
+def measure(engine, since, repeat: int = 5) -> dict:
+    """Restituisce piano di esecuzione e tempo medio di ciascuna query."""
+    results = {}
+    # Connessioni nuove: la cache degli statement di pysqlite riutilizzerebbe
+    # i piani compilati prima della modifica degli indici
+    engine.dispose()
+    with engine.connect() as conn:
+        for name, sql, params in QUERIES:
+            params = {k: since if v == 'SINCE' else v for k, v in params.items()}
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(text(sql), params).all()
+            elapsed_ms = (time.perf_counter() - start) / repeat * 1000
+            # EXPLAIN non legge il database e non ricarica lo schema modificato
+            # da altre connessioni: va eseguito dopo la query vera
+            plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+            results[name] = {'plan': plan, 'ms': round(elapsed_ms, 3)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--changes', type=int, default=200000)
+    parser.add_argument('--json', action='store_true', help="Stampa i risultati in formato JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='feedwise-bench-')
+    try:
+        from app import create_app
+        from app.config import TestingConfig
+        from app.models import database
+
+        class BenchmarkConfig(TestingConfig):
+            DEBUG = False
+            DATABASE_PATH = os.path.join(workdir, 'bench.db')
+
+        create_app(BenchmarkConfig)
+        database.ensure_db_initialized()
+        engine = database.engine
+
+        with engine.begin() as conn:
+            populate(conn, args.products, args.changes)
+            reset_to_legacy_indexes(conn, database.Base.metadata)
+
+        since = datetime.utcnow() - timedelta(days=7)
+        before = measure(engine, since)
+        database.ensure_indexes()
+        after = measure(engine, since)
+
+        if args.json:
+            print(json.dumps({'products': args.products, 'changes': args.changes,
+                              'before': before, 'after': after}, indent=2))
+            return
+
+        for name, _, _ in QUERIES:
+            print(f"== {name}: {before[name]['ms']} ms -> {after[name]['ms']} ms")
+            print("   prima: " + " | ".join(before[name]['plan']))
+            print("   dopo:  " + " | ".join(after[name]['plan']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,8 @@ import logging
 import signal
 from app import create_app
 from app.services.scheduler import start_scheduler
-from app.models.database import ensure_db_initialized
+from app.models.database import ensure_db_initialized, get_db
+from app.services.feed_sources import sync_feed_sources
 
 def setup_logging(app):
     """Configura il sistema di logging"""
@@ -42,6 +43,10 @@ if __name__ == "__main__":
     # Assicurati che il database sia inizializzato
     ensure_db_initialized()
     
+    # Allinea il registro delle fonti alla configurazione
+    with get_db() as db:
+        sync_feed_sources(db, app.config['FEED_SOURCES'])
+    
     # Avvia lo scheduler interno
     scheduler = start_scheduler()
     